@@ -1,15 +1,17 @@
 import clr
 clr.AddReference("System.Windows.Forms")
 import sys
-from re import search
 
 import pandas as pd
 from connect import *
 
 from System.Windows.Forms import MessageBox
 
+from CaseSnapshot import CaseSnapshot
+from UniqueNames import name_item
 
-case = exam = None
+
+case = exam = snapshot = None
 
 
 def create_roi_if_absent(roi_name, roi_type):
@@ -22,62 +24,20 @@ def create_roi_if_absent(roi_name, roi_type):
     roi = get_latest_roi(roi_name, unapproved_only=True)  # Latest unapproved ROI
     if roi is None:  # No such ROIs exist
         color = colors[roi_name].replace(";", ",")  # E.g., "255; 1; 2; 3" -> "255, 1, 2, 3"
-        roi_name = name_item(roi_name, [r.Name for r in case.PatientModel.RegionsOfInterest], 16)
+        roi_name = name_item(roi_name, snapshot.roi_names, 16)
         roi = case.PatientModel.CreateRoi(Name=roi_name, Type=roi_type, Color=color)  # Create a new ROI
+        snapshot.add_roi(roi)
     return roi
 
 
 def get_latest_roi(base_roi_name, **kwargs):
     # Helper function that returns the ROI with the given "base name" and largest copy number
     # kwargs:
-    # unapproved_only: If True, consider only the ROIs that are not part of any approved structure set in the case
+    # unapproved_only: If True, consider only the ROIs that are not part of any approved structure set on the exam
     # non_empty_only: If True, consider only the ROIs with geometries on the exam
 
-    unapproved_only = kwargs.get("unapproved_only", False)
-    non_empty_only = kwargs.get("non_empty_only", False)
-
-    base_roi_name = base_roi_name.lower()
-
-    rois = case.PatientModel.RegionsOfInterest
-    if unapproved_only:
-        approved_roi_names = [geom.OfRoi.Name for approved_ss in case.PatientModel.StructureSets[exam.Name].ApprovedStructureSets for geom in approved_ss.ApprovedRoiStructures]
-        approved_roi_names.extend([geom.OfRoi.Name for plan in case.TreatmentPlans for bs in plan.BeamSets if bs.DependentApprovedStructureSet is not None for geom in bs.DependentApprovedStructureSet.ApprovedRoiStructures])
-        rois = [roi for roi in rois if roi.Name not in approved_roi_names]
-    if non_empty_only:
-        rois = [roi for roi in rois if case.PatientModel.StructureSets[exam.Name].RoiGeometries[roi.Name].HasContours()]
-    
-    latest_copy_num = copy_num = -1
-    latest_roi = None
-    for roi in rois:
-        roi_name = roi.Name.lower()
-        if roi_name == base_roi_name:
-            copy_num = 0
-        else:
-            m = search(" \((\d+)\)".format(base_roi_name), roi_name)
-            if m:  # There is a copy number
-                grp = m.group()
-                length = min(16 - len(grp), len(base_roi_name))
-                if roi_name[:length] == base_roi_name[:length]:
-                    copy_num = int(m.group(1))
-        if copy_num > latest_copy_num:
-            latest_copy_num = copy_num
-            latest_roi = roi
-    return latest_roi
-
-
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
+    roi_name = snapshot.latest_roi_name(base_roi_name, kwargs.get("unapproved_only", False), kwargs.get("non_empty_only", False), exam.Name)
+    return None if roi_name is None else case.PatientModel.RegionsOfInterest[roi_name]
 
 
 def add_box_to_external():
@@ -93,7 +53,7 @@ def add_box_to_external():
     Outer and inner couch structures are support structures and have respective materials cork and PMI foam.
     """
 
-    global case, exam
+    global case, exam, snapshot
 
     # Get current objects
     try:
@@ -107,6 +67,7 @@ def add_box_to_external():
         MessageBox.Show("There are no examinations in the current case. Click OK to abort script.", "No Examinations")
         sys.exit(1) 
     ss = case.PatientModel.StructureSets[exam.Name]
+    snapshot = CaseSnapshot(case)  # ROI names and approvals, read once
 
     # External
     ext = [geom for geom in ss.RoiGeometries if geom.OfRoi.Type == "External"]
@@ -157,9 +118,7 @@ def add_box_to_external():
     ext_no_box.CreateMarginGeometry(Examination=exam, SourceRoiName=ext.OfRoi.Name, MarginSettings={ "Type": "Expand", "Superior": 0, "Inferior": 0, "Anterior": 0, "Posterior": 0, "Right": 0, "Left": 0 })
     
     # Add box to external
-    approved_roi_names = [geom.OfRoi.Name for approved_ss in ss.ApprovedStructureSets for geom in approved_ss.ApprovedRoiStructures]
-    approved_roi_names.extend([geom.OfRoi.Name for plan in case.TreatmentPlans for bs in plan.BeamSets if bs.DependentApprovedStructureSet is not None for geom in bs.DependentApprovedStructureSet.ApprovedRoiStructures])
-    if ext.OfRoi.Name in approved_roi_names:
+    if snapshot.is_approved(ext.OfRoi.Name, exam.Name):
         unapproved_ext = create_roi_if_absent("External", "Organ")
         unapproved_ext.CreateMarginGeometry(Examination=exam, SourceRoiName=ext.OfRoi.Name, MarginSettings={ "Type": "Expand", "Superior": 0, "Inferior": 0, "Anterior": 0, "Posterior": 0, "Right": 0, "Left": 0 })
         ext = unapproved_ext
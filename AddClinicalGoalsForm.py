@@ -367,7 +367,7 @@ def add_clinical_goals(gui=True, **kwargs):
 
         ## Add goals   
                 
-        goals["ROI"] = pd.Series(goals["ROI"]).fillna(method="ffill")  # Autofill ROI name (due to vertically merged cells in spreadsheet)
+        goals["ROI"] = pd.Series(goals["ROI"]).ffill()  # Autofill ROI name (due to vertically merged cells in spreadsheet)
     
         invalid_goals_template, empty_spare_template, lg_spare_vol_template, no_ipsi_contra_template, no_nodal_ptv_template = [], [], [], [], []
         roi_regex = "^{}(_[LR])?(\^.+)?( \(\d+\))?$"
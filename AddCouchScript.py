@@ -15,6 +15,8 @@ from pydicom import dcmread  # Read DICOM from file
 from scipy.signal import find_peaks  # Find "peak" values in an array
 from System.Windows.Forms import MessageBox  # I use to display errors
 
+import Extents
+
 
 def add_couch():
     """Add template couch structures at correct location on current exam
@@ -115,8 +117,8 @@ def add_couch():
     
     # The TOP of the couch goes at the 4th peak, so compute where the P-A CENTER of the couch should go
     # Center is half a couch height down
-    outer_couch_bounds = struct_set.RoiGeometries[outer_couch.Name].GetBoundingBox()
-    outer_couch_ht = outer_couch_bounds[1].y - outer_couch_bounds[0].y
+    outer_couch_box = Extents.point_bounds(struct_set.RoiGeometries[outer_couch.Name].GetBoundingBox())
+    outer_couch_ht = outer_couch_box[1, 1] - outer_couch_box[0, 1]
     if supine:
         correct_y += outer_couch_ht / 2
     else:
@@ -126,8 +128,8 @@ def add_couch():
     # x is R-L center (always zero)
     # z is I-S center
     correct_x = 0
-    img_bounds = img_stack.GetBoundingBox()
-    correct_z = (img_bounds[0].z + img_bounds[1].z) / 2
+    img_box = Extents.point_bounds(img_stack.GetBoundingBox())
+    correct_z = img_box[:, 2].mean()
 
     # Center each couch geometry
     for roi in [inner_couch, outer_couch]:  # Iterate over couch ROIs in the applied couch template
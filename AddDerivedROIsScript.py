@@ -3,15 +3,17 @@ clr.AddReference("System.Drawing")
 clr.AddReference("System.Windows.Forms")
 import sys
 from random import randint
-from re import search
 
 import pandas as pd
 from connect import *
 from System.Drawing import *
 from System.Windows.Forms import *
 
+from CaseSnapshot import CaseSnapshot
+from UniqueNames import name_item
 
-case = exam = None
+
+case = exam = snapshot = None
 to_update = []  # List of ROI names whose derived geometries need updating
 targets = {target_type: None for target_type in ["CTV", "GTV", "PTV"]}  # The target of each type that will be used in derived ROI expressions. Set by user when needed
 
@@ -89,22 +91,6 @@ def set_target(target_type):
                 sys.exit()
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
-
 def create_roi_if_absent(roi_name, roi_type="Organ"):
     # Helper function that returns the "latest" UNAPPROVED ROI with the given name, as determined by the copy number in the name
     # If no such ROI is found, return a new ROI with the given name and type
@@ -134,8 +120,9 @@ def create_roi_if_absent(roi_name, roi_type="Organ"):
 
         # Create new ROI
         color = color.replace(";", ",")  # E.g., "255; 1; 2; 3" -> "255, 1, 2, 3"
-        roi_name = name_item(roi_name, [r.Name for r in case.PatientModel.RegionsOfInterest], 16)
+        roi_name = name_item(roi_name, snapshot.roi_names, 16)
         roi = case.PatientModel.CreateRoi(Name=roi_name, Type=roi_type, Color=color)
+        snapshot.add_roi(roi)
     
     return roi
 
@@ -146,35 +133,9 @@ def get_latest_roi(base_roi_name, **kwargs):
     # unapproved_only: If True, consider only the ROIs that are not part of any approved structure set in the case
     # non_empty_only: If True, consider only the ROIs with geometries on the exam
 
-    unapproved_only = kwargs.get("unapproved_only", False)
     non_empty_only = kwargs.get("non_empty_only", False)
-
-    base_roi_name = base_roi_name.lower()
-
-    rois = case.PatientModel.RegionsOfInterest
-    if unapproved_only:
-        approved_roi_names = set(geom.OfRoi.Name for ss in case.PatientModel.StructureSets for approved_ss in ss.ApprovedStructureSets for geom in approved_ss.ApprovedRoiStructures)
-        rois = [roi for roi in rois if roi.Name not in approved_roi_names]
-    if non_empty_only:
-        rois = [roi for roi in rois if case.PatientModel.StructureSets[exam.Name].RoiGeometries[roi.Name].HasContours()]
-    
-    latest_copy_num = copy_num = -1
-    latest_roi = None
-    for roi in rois:
-        roi_name = roi.Name.lower()
-        if roi_name == base_roi_name:
-            copy_num = 0
-        else:
-            m = search(" \((\d+)\)".format(base_roi_name), roi_name)
-            if m:  # There is a copy number
-                grp = m.group()
-                length = min(16 - len(grp), len(base_roi_name))
-                if roi_name[:length] == base_roi_name[:length]:
-                    copy_num = int(m.group(1))
-        if copy_num > latest_copy_num:
-            latest_copy_num = copy_num
-            latest_roi = roi
-    return latest_roi
+    roi_name = snapshot.latest_roi_name(base_roi_name, kwargs.get("unapproved_only", False), non_empty_only, exam.Name if non_empty_only else None)  # Approval is checked on all exams
+    return None if roi_name is None else case.PatientModel.RegionsOfInterest[roi_name]
 
 
 def organ_minus_target(target_type, organ_names):
@@ -317,7 +278,7 @@ def add_derived_rois():
     All ROI names (perhaps excluding targets) are TG-263 compliant
     """
 
-    global case, exam, to_update
+    global case, exam, snapshot, to_update
 
     # Get current objects
     try:
@@ -330,6 +291,7 @@ def add_derived_rois():
     except:
         MessageBox.Show("There are no examinations in the current case. Click OK to abort script.", "No Examinations")
         sys.exit(1)
+    snapshot = CaseSnapshot(case)  # ROI names and approvals, read once
 
     to_update = []
 
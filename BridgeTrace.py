@@ -0,0 +1,318 @@
+"""Opt-in tracing of RS scripting bridge calls
+
+Every property read and method call on an RS object crosses the .NET scripting bridge, which is slow. This module shows where a script spends those calls.
+While tracing is enabled, `connect.get_current` returns transparent proxies. A proxy forwards every attribute read, method call, assignment, index, and iteration to the real RS object, and wraps any RS object it returns in another proxy.
+Each bridge call is recorded with its member path (e.g., "Case.PatientModel.RegionsOfInterest"), the script line that made it, the time it took, and a summary of its arguments.
+
+When the traced function returns (or raises), two files are written and the text report is printed:
+- "<name> bridge trace.folded": One line per distinct Python stack + bridge member, with the total microseconds, in the "folded stacks" format read by flamegraph.pl and speedscope
+- "<name> bridge trace.txt": The most frequent members by calling line, and the most repeated calls (same object, member, and arguments), which are the first candidates for caching
+
+Tracing is off unless a script is run through `run` (or between `enable` and `disable`). Nothing is patched or imported when it is off, so untraced scripts pay nothing.
+
+Example (in the RS script console):
+import BridgeTrace
+BridgeTrace.run("PlanCheckScript", "plan_check")
+"""
+
+import importlib
+import os
+import sys
+import tempfile
+from collections import Counter
+from time import time
+
+
+_PRIMITIVES = (str, bytes, int, float, bool, type(None))  # Values returned as is, without a proxy
+_MAX_ARG_LEN = 40  # Argument reprs are truncated to this many characters in the report
+
+_tracer = None  # Active Tracer, if any
+
+
+class Tracer(object):
+    """Records bridge calls made through proxies
+
+    Attributes
+    ----------
+    calls: dict
+        (member label, caller "file:line") -> [number of calls, total seconds]
+    repeats: Counter
+        Call description (object path, member, and arguments) -> number of calls
+    folded: Counter
+        Folded stack ("frame;frame;...;member label") -> total seconds
+    """
+
+    def __init__(self, get_current):
+        # `get_current`: The real `connect.get_current`
+
+        self._get_current = get_current
+        self.calls = {}
+        self.repeats = Counter()
+        self.folded = Counter()
+        self.start = time()
+
+    def get_current(self, name):
+        # Replacement for `connect.get_current` that returns a proxy
+        return self.wrap(self.timed(name, "get_current({})".format(repr(name)), self._get_current, name), name, name)
+
+    def wrap(self, value, label, path):
+        # Helper function that returns a proxy for an RS value
+        # Primitives are returned as is, and Python containers are returned with their items wrapped
+        if isinstance(value, _PRIMITIVES) or isinstance(value, TracedObject):
+            return value
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.wrap(item, "{}[]".format(label), "{}[{}]".format(path, i)) for i, item in enumerate(value))
+        if isinstance(value, dict):
+            return dict((key, self.wrap(val, "{}[]".format(label), "{}[{}]".format(path, repr(key)))) for key, val in value.items())
+        return TracedObject(value, self, label, path)
+
+    def timed(self, label, call, fn, *args, **kwargs):
+        # Call `fn` with the given arguments, and record the call under `label` (e.g., "Case.PatientModel") and `call` (e.g., "Case.PatientModel['CT 1']")
+        start = time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.record(label, call, time() - start)
+
+    def record(self, label, call, seconds):
+        # Record one bridge call
+        # The caller is the nearest frame outside this module
+
+        stack = []
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_globals.get("__name__") != __name__:
+                stack.append(frame)
+            frame = frame.f_back
+        caller = "{}:{}".format(os.path.basename(stack[0].f_code.co_filename), stack[0].f_lineno) if stack else "?"
+
+        entry = self.calls.setdefault((label, caller), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        self.repeats[call] += 1
+        frames = ["{}.{}".format(f.f_globals.get("__name__"), f.f_code.co_name) for f in reversed(stack)]
+        self.folded[";".join(frames + [label])] += seconds
+
+    def report(self, name, top=25):
+        """Return the text report
+
+        Parameters
+        ----------
+        name: str
+            Title (e.g., the traced function)
+        top: int
+            Number of rows in each table
+        """
+
+        num_calls = sum(count for count, _ in self.calls.values())
+        bridge_secs = sum(secs for _, secs in self.calls.values())
+        lines = ["Bridge trace: {}".format(name), "{} bridge calls, {:.3f} s in the bridge, {:.3f} s total".format(num_calls, bridge_secs, time() - self.start), ""]
+
+        lines.append("Most frequent members")
+        lines.append("{:>9}{:>12}  {:<32}  {}".format("Calls", "Total ms", "Caller", "Member"))
+        for (label, caller), (count, secs) in sorted(self.calls.items(), key=lambda item: (-item[1][0], -item[1][1]))[:top]:
+            lines.append("{:>9}{:>12.1f}  {:<32}  {}".format(count, 1000 * secs, caller, label))
+        lines.append("")
+
+        lines.append("Most repeated calls (same object, member, and arguments)")
+        lines.append("{:>9}  {}".format("Calls", "Call"))
+        for call, count in self.repeats.most_common(top):
+            if count == 1:
+                break
+            lines.append("{:>9}  {}".format(count, call))
+
+        return "\n".join(lines)
+
+    def write(self, name, folder=None):
+        """Write the folded profile and the text report, and print the report
+
+        Parameters
+        ----------
+        name: str
+            Prefix for the file names
+        folder: str
+            Folder to write to
+            Defaults to the temp folder
+
+        Returns
+        -------
+        List of the paths written
+        """
+
+        if folder is None:
+            folder = tempfile.gettempdir()
+        folded_path = os.path.join(folder, "{} bridge trace.folded".format(name))
+        with open(folded_path, "w") as f:
+            for stack, secs in sorted(self.folded.items()):
+                f.write("{} {}\n".format(stack, max(1, int(round(1e6 * secs)))))  # Flame graph tools expect positive integer weights
+        report = self.report(name)
+        report_path = os.path.join(folder, "{} bridge trace.txt".format(name))
+        with open(report_path, "w") as f:
+            f.write(report)
+        print(report)
+        return [folded_path, report_path]
+
+
+def _summarize(args, kwargs):
+    # Helper function that returns a short description of call arguments, e.g., "'PTV', Color='Red'"
+    def short(arg):
+        s = arg._path if isinstance(arg, TracedObject) else repr(arg)
+        return s if len(s) <= _MAX_ARG_LEN else s[:_MAX_ARG_LEN - 3] + "..."
+    return ", ".join([short(arg) for arg in args] + ["{}={}".format(key, short(val)) for key, val in sorted(kwargs.items())])
+
+
+def _unwrap(value):
+    # Helper function that returns the real RS value for a proxy, so that RS methods and assignments receive RS objects
+    if isinstance(value, TracedObject):
+        return value._obj
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(item) for item in value)
+    if isinstance(value, dict):
+        return dict((key, _unwrap(val)) for key, val in value.items())
+    return value
+
+
+class TracedObject(object):
+    """Transparent proxy for an RS object, method, or collection"""
+
+    __slots__ = ("_obj", "_tracer", "_label", "_path")
+
+    def __init__(self, obj, tracer, label, path):
+        # `obj`: The real RS value
+        # `label`: Member path without collection keys (e.g., "Case.PatientModel.RegionsOfInterest[]"), for grouping
+        # `path`: Member path with collection keys (e.g., "Case.PatientModel.RegionsOfInterest['PTV']"), to identify the object
+
+        object.__setattr__(self, "_obj", obj)
+        object.__setattr__(self, "_tracer", tracer)
+        object.__setattr__(self, "_label", label)
+        object.__setattr__(self, "_path", path)
+
+    def __getattr__(self, name):
+        # A method is recorded when it is called, not when it is looked up
+        label, path = "{}.{}".format(self._label, name), "{}.{}".format(self._path, name)
+        start = time()
+        value = getattr(self._obj, name)
+        if callable(value):
+            return TracedObject(value, self._tracer, label, path)
+        self._tracer.record(label, path, time() - start)
+        return self._tracer.wrap(value, label, path)
+
+    def __setattr__(self, name, value):
+        label = "{}.{}=".format(self._label, name)
+        self._tracer.timed(label, "{}.{} = {}".format(self._path, name, _summarize([value], {})), setattr, self._obj, name, _unwrap(value))
+
+    def __call__(self, *args, **kwargs):
+        label = "{}()".format(self._label)
+        call = "{}({})".format(self._path, _summarize(args, kwargs))
+        return self._tracer.wrap(self._tracer.timed(label, call, self._obj, *_unwrap(args), **_unwrap(kwargs)), label, call)
+
+    def __getitem__(self, key):
+        label, path = "{}[]".format(self._label), "{}[{}]".format(self._path, repr(key))
+        return self._tracer.wrap(self._tracer.timed(label, path, self._obj.__getitem__, _unwrap(key)), label, path)
+
+    def __iter__(self):
+        # Each item is one bridge call
+        label = "{}[]".format(self._label)
+        it = iter(self._obj)
+        i = 0
+        while True:
+            path = "{}[{}]".format(self._path, i)
+            try:
+                item = self._tracer.timed(label, path, next, it)
+            except StopIteration:
+                return
+            yield self._tracer.wrap(item, label, path)
+            i += 1
+
+    def __len__(self):
+        return self._tracer.timed("{}.Count".format(self._label), "{}.Count".format(self._path), len, self._obj)
+
+    def __contains__(self, item):
+        return _unwrap(item) in self._obj
+
+    def __bool__(self):
+        return bool(self._obj)
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return self._obj == _unwrap(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._obj)
+
+    def __str__(self):
+        return str(self._obj)
+
+    def __repr__(self):
+        return "<Traced {}>".format(self._path)
+
+    def __format__(self, spec):
+        return format(self._obj, spec)
+
+    def __dir__(self):
+        return dir(self._obj)
+
+
+def enable():
+    """Start tracing: make `connect.get_current` return proxies
+
+    Only modules that import `connect` after this call (or that call `connect.get_current` directly) are traced. `run` re-imports the script module for this reason.
+
+    Returns
+    -------
+    The new Tracer
+    """
+
+    global _tracer
+    import connect
+    disable()
+    _tracer = Tracer(connect.get_current)
+    connect.get_current = _tracer.get_current
+    return _tracer
+
+
+def disable():
+    """Stop tracing: restore the real `connect.get_current`
+
+    Returns
+    -------
+    The Tracer that was active, or None if tracing was off
+    """
+
+    global _tracer
+    import connect
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        connect.get_current = tracer._get_current
+    return tracer
+
+
+def run(module_name, function_name, *args, **kwargs):
+    """Run a script's main function with tracing, then write and print the report
+
+    Parameters
+    ----------
+    module_name: str
+        Script module (e.g., "PlanCheckScript")
+    function_name: str
+        Function in the module (e.g., "plan_check")
+    Other arguments are passed to the function
+
+    Returns
+    -------
+    The function's return value
+    """
+
+    tracer = enable()
+    try:
+        sys.modules.pop(module_name, None)  # Import fresh so that `from connect import *` picks up the tracing `get_current`
+        module = importlib.import_module(module_name)
+        return getattr(module, function_name)(*args, **kwargs)
+    finally:
+        disable()
+        sys.modules.pop(module_name, None)  # Later imports should not get the tracing `get_current`
+        tracer.write("{}.{}".format(module_name, function_name))
@@ -0,0 +1,335 @@
+from collections import OrderedDict
+from re import search
+
+
+MAX_ROI_NAME_LEN = 16  # RS limit on ROI names
+
+
+class RoiInfo(object):
+    """Read-only copy of the properties of one ROI"""
+
+    __slots__ = ("name", "type", "color", "derived_expr", "has_material", "has_contours", "approved_exams")
+
+    def __init__(self, roi):
+        self.name = roi.Name
+        self.type = roi.Type  # E.g., "Organ", "External"
+        color = roi.Color
+        self.color = (color.R, color.G, color.B)
+        self.derived_expr = roi.DerivedRoiExpression  # None if the ROI is not derived
+        self.has_material = roi.RoiMaterial is not None
+        self.has_contours = {}  # Exam name -> True if the ROI has contours on the exam. Only contains the exams that the snapshot has read
+        self.approved_exams = set()  # Names of exams on which the ROI is part of an approved structure set
+
+    @property
+    def is_derived(self):
+        return self.derived_expr is not None
+
+    @property
+    def is_approved(self):
+        # True if the ROI is approved on any exam
+        return bool(self.approved_exams)
+
+
+class BeamSetInfo(object):
+    """Read-only copy of the properties of one beam set"""
+
+    __slots__ = ("name", "plan_name", "exam_name", "machine", "modality", "technique", "num_fx", "beam_names", "is_approved")
+
+    def __init__(self, beam_set, plan_name):
+        self.name = beam_set.DicomPlanLabel
+        self.plan_name = plan_name
+        self.exam_name = beam_set.GetPlanningExamination().Name
+        self.machine = beam_set.MachineReference.MachineName
+        self.modality = beam_set.Modality  # E.g., "Photons"
+        self.technique = beam_set.DeliveryTechnique  # E.g., "DynamicArc"
+        rx = beam_set.FractionationPattern
+        self.num_fx = rx.NumberOfFractions if rx is not None else None
+        self.beam_names = [beam.Name for beam in beam_set.Beams]
+        self.is_approved = beam_set.Review is not None and beam_set.Review.ApprovalStatus == "Approved"
+
+
+class PlanInfo(object):
+    """Read-only copy of the properties of one plan, including its beam sets"""
+
+    __slots__ = ("name", "exam_name", "planned_by", "is_approved", "beam_sets")
+
+    def __init__(self, plan):
+        self.name = plan.Name
+        self.exam_name = plan.GetStructureSet().OnExamination.Name
+        self.planned_by = plan.PlannedBy
+        self.is_approved = plan.Review is not None and plan.Review.ApprovalStatus == "Approved"
+        self.beam_sets = OrderedDict((bs.DicomPlanLabel, BeamSetInfo(bs, self.name)) for bs in plan.BeamSets)
+
+
+class CaseSnapshot(object):
+    """Read-through cache of the RS object model of a case
+
+    Each property access on an RS object crosses the scripting bridge, so scripts that walk the ROIs, geometries, approved structure sets, or plans more than once are slow.
+    The snapshot reads each part of the case the first time it is needed, into plain Python objects, and answers later questions from them.
+    The snapshot does not know when the script changes the case. After changing the case, call `invalidate` for the affected part(s), and the next access reads them again.
+
+    Parts:
+    - "Rois": Name, type, color, derived expression, and material of each ROI
+    - "Contours": Whether each ROI has contours on each exam (read one exam at a time)
+    - "Approvals": The exams on which each ROI is approved
+    - "Plans": Plan and beam set metadata
+    ROIs that the script creates, renames, or deletes can be registered with `add_roi`, `rename_roi`, and `remove_roi` instead of invalidating all ROIs. Approving or unapproving anything requires `invalidate("Approvals")`.
+
+    Example:
+    snapshot = CaseSnapshot(case)
+    empty_names = [roi.name for roi in snapshot.rois if not snapshot.has_contours(roi.name, exam.Name)]
+    case.PatientModel.CreateRoi(Name="Temp", Type="Control")
+    snapshot.invalidate("Rois", "Contours")
+    """
+
+    PARTS = ("Rois", "Contours", "Approvals", "Plans")
+
+    def __init__(self, case):
+        self.case = case
+        self.num_loads = dict.fromkeys(self.PARTS, 0)  # Part -> number of times the part was read from RS
+        self._rois = None  # ROI name -> RoiInfo
+        self._copies = None  # (lowercase name without copy number, length of copy number string) -> list of (copy number, ROI name). Copy number string is, e.g., " (1)"; length 0 means no copy number
+        self._contour_exams = set()  # Names of exams whose HasContours values are in the RoiInfo objects
+        self._approvals_loaded = False
+        self._plans = None  # Plan name -> PlanInfo
+
+    def invalidate(self, *parts):
+        """Discard the cached values of the given part(s) of the case, so that they are read again on next access
+
+        Parameters
+        ----------
+        parts: str
+            Any of "Rois", "Contours", "Approvals", or "Plans"
+            If none are given, discard everything
+        """
+
+        parts = parts or self.PARTS
+        for part in parts:
+            if part not in self.PARTS:
+                raise ValueError("Unknown snapshot part '{}'. Choose from: {}.".format(part, ", ".join(self.PARTS)))
+        if "Rois" in parts:  # Contours and approvals are stored on the RoiInfo objects, so they go too
+            self._rois = None
+            self._copies = None
+            self._contour_exams = set()
+            self._approvals_loaded = False
+        if "Contours" in parts:
+            self._contour_exams = set()
+            if self._rois is not None:
+                for roi in self._rois.values():
+                    roi.has_contours = {}
+        if "Approvals" in parts:
+            self._approvals_loaded = False
+            if self._rois is not None:
+                for roi in self._rois.values():
+                    roi.approved_exams = set()
+        if "Plans" in parts:
+            self._plans = None
+
+    ## ROIs
+
+    def _load_rois(self):
+        if self._rois is None:
+            self._rois = OrderedDict((roi.Name, RoiInfo(roi)) for roi in self.case.PatientModel.RegionsOfInterest)
+            self.num_loads["Rois"] += 1
+        return self._rois
+
+    @property
+    def rois(self):
+        # List of RoiInfo objects, in RS order
+        return list(self._load_rois().values())
+
+    @property
+    def roi_names(self):
+        return list(self._load_rois().keys())
+
+    def roi(self, roi_name):
+        # RoiInfo for the ROI with the given name, or None if there is no such ROI
+        return self._load_rois().get(roi_name)
+
+    def __contains__(self, roi_name):
+        return roi_name in self._load_rois()
+
+    def rois_of_type(self, *roi_types):
+        # List of RoiInfo objects for ROIs of any of the given types (e.g., "External")
+        return [roi for roi in self._load_rois().values() if roi.type in roi_types]
+
+    def add_roi(self, roi):
+        # Register an ROI that the script created, without reading all ROIs again
+        # `roi`: The new RS ROI object
+        rois = self._load_rois()
+        rois[roi.Name] = RoiInfo(roi)
+        if self._copies is not None:
+            self._index_copy(roi.Name)
+
+    def rename_roi(self, old_name, new_name):
+        # Register an ROI that the script renamed
+        rois = self._load_rois()
+        info = rois.pop(old_name)
+        info.name = new_name
+        rois[new_name] = info
+        self._copies = None
+
+    def remove_roi(self, roi_name):
+        # Register an ROI that the script deleted
+        self._load_rois().pop(roi_name, None)
+        self._copies = None
+
+    ## Copies ("Lungs", "Lungs (1)", ...)
+
+    def _index_copy(self, roi_name):
+        # Helper method that adds the ROI name to the copy number index
+        m = search(r" \((\d+)\)$", roi_name)
+        if m:
+            key, copy_num = (roi_name[:m.start()].strip().lower(), len(m.group())), int(m.group(1))
+        else:
+            key, copy_num = (roi_name.lower(), 0), 0
+        self._copies.setdefault(key, []).append((copy_num, roi_name))
+
+    def _load_copies(self):
+        if self._copies is None:
+            self._copies = {}
+            for roi_name in self._load_rois():
+                self._index_copy(roi_name)
+        return self._copies
+
+    def copies(self, base_roi_name):
+        """Return the names of all ROIs that are copies of the base name, by decreasing copy number
+
+        A copy has the base name, or the base name truncated as necessary followed by a copy number (e.g., "Isocenter Na (2)" is a copy of "Isocenter Name A").
+        The base name itself has copy number 0.
+
+        Parameters
+        ----------
+        base_roi_name: str
+            ROI name without a copy number (case insensitive)
+        """
+
+        index = self._load_copies()
+        copies = list(index.get((base_roi_name.lower(), 0), []))
+        for key_len in set(key[1] for key in index if key[1] > 0):  # Lengths of copy number strings in use (e.g., 4 for " (1)", 5 for " (10)")
+            copies.extend(index.get((base_roi_name[:(MAX_ROI_NAME_LEN - key_len)].strip().lower(), key_len), []))
+        return [roi_name for _, roi_name in sorted(copies, reverse=True)]
+
+    def latest_roi_name(self, base_roi_name, unapproved_only=False, non_empty_only=False, exam_name=None):
+        """Return the name of the ROI with the given base name and the largest copy number, or None if there is no such ROI
+
+        Parameters
+        ----------
+        base_roi_name: str
+            ROI name without a copy number (case insensitive)
+        unapproved_only: bool
+            If True, consider only the ROIs that are not approved on the exam (or on any exam, if `exam_name` is None)
+            Defaults to False
+        non_empty_only: bool
+            If True, consider only the ROIs with contours on the exam (`exam_name` is required)
+            Defaults to False
+        exam_name: str
+            Name of the exam on which to check approval and contours
+            Defaults to None
+        """
+
+        for roi_name in self.copies(base_roi_name):
+            if unapproved_only and self.is_approved(roi_name, exam_name):
+                continue
+            if non_empty_only and not self.has_contours(roi_name, exam_name):
+                continue
+            return roi_name
+
+    ## Contours
+
+    def _load_contours(self, exam_name):
+        rois = self._load_rois()
+        if exam_name not in self._contour_exams:
+            geoms = self.case.PatientModel.StructureSets[exam_name].RoiGeometries
+            for geom in geoms:
+                roi = rois.get(geom.OfRoi.Name)
+                if roi is not None:
+                    roi.has_contours[exam_name] = geom.HasContours()
+            self._contour_exams.add(exam_name)
+            self.num_loads["Contours"] += 1
+        return rois
+
+    def has_contours(self, roi_name, exam_name):
+        # True if the ROI has contours on the exam
+        roi = self._load_contours(exam_name).get(roi_name)
+        if roi is None:
+            return False
+        if exam_name not in roi.has_contours:  # ROI was added after the exam was read
+            roi.has_contours[exam_name] = self.case.PatientModel.StructureSets[exam_name].RoiGeometries[roi_name].HasContours()
+        return roi.has_contours[exam_name]
+
+    def set_has_contours(self, roi_name, exam_name, has_contours=True):
+        # Register that the script contoured (or cleared) the ROI on the exam
+        roi = self._load_rois().get(roi_name)
+        if roi is not None:
+            roi.has_contours[exam_name] = has_contours
+
+    def contoured_rois(self, exam_name):
+        # List of RoiInfo objects for ROIs with contours on the exam
+        return [roi for roi in self._load_contours(exam_name).values() if self.has_contours(roi.name, exam_name)]
+
+    def empty_rois(self, exam_name):
+        # List of RoiInfo objects for ROIs without contours on the exam
+        return [roi for roi in self._load_contours(exam_name).values() if not self.has_contours(roi.name, exam_name)]
+
+    ## Approvals
+
+    def _load_approvals(self):
+        # Approved ROIs come from the approved structure sets of each exam, and from the beam sets' dependent approved structure sets (attributed to the planning exam)
+        rois = self._load_rois()
+        if not self._approvals_loaded:
+            for ss in self.case.PatientModel.StructureSets:
+                exam_name = ss.OnExamination.Name
+                for approved_ss in ss.ApprovedStructureSets:
+                    for geom in approved_ss.ApprovedRoiStructures:
+                        roi = rois.get(geom.OfRoi.Name)
+                        if roi is not None:
+                            roi.approved_exams.add(exam_name)
+            for plan in self.case.TreatmentPlans:
+                exam_name = None
+                for bs in plan.BeamSets:
+                    if bs.DependentApprovedStructureSet is None:
+                        continue
+                    if exam_name is None:
+                        exam_name = plan.GetStructureSet().OnExamination.Name
+                    for geom in bs.DependentApprovedStructureSet.ApprovedRoiStructures:
+                        roi = rois.get(geom.OfRoi.Name)
+                        if roi is not None:
+                            roi.approved_exams.add(exam_name)
+            self._approvals_loaded = True
+            self.num_loads["Approvals"] += 1
+        return rois
+
+    def is_approved(self, roi_name, exam_name=None):
+        # True if the ROI is approved on the exam, or on any exam if `exam_name` is None
+        roi = self._load_approvals().get(roi_name)
+        if roi is None:
+            return False
+        if exam_name is None:
+            return roi.is_approved
+        return exam_name in roi.approved_exams
+
+    def approved_roi_names(self, exam_name=None):
+        # Set of names of ROIs approved on the exam, or on any exam if `exam_name` is None
+        return set(roi.name for roi in self._load_approvals().values() if (roi.is_approved if exam_name is None else exam_name in roi.approved_exams))
+
+    ## Plans
+
+    def _load_plans(self):
+        if self._plans is None:
+            self._plans = OrderedDict((plan.Name, PlanInfo(plan)) for plan in self.case.TreatmentPlans)
+            self.num_loads["Plans"] += 1
+        return self._plans
+
+    @property
+    def plans(self):
+        # List of PlanInfo objects, in RS order
+        return list(self._load_plans().values())
+
+    def plan(self, plan_name):
+        # PlanInfo for the plan with the given name, or None if there is no such plan
+        return self._load_plans().get(plan_name)
+
+    def beam_sets(self):
+        # List of BeamSetInfo objects for all beam sets in all plans
+        return [bs for plan in self._load_plans().values() for bs in plan.beam_sets.values()]
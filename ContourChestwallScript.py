@@ -2,69 +2,29 @@ import clr
 clr.AddReference("System.Windows.Forms")
 import sys
 from random import randint
-from re import search
 
 import pandas as pd
 
 from connect import *
 from System.Windows.Forms import MessageBox
 
+from CaseSnapshot import CaseSnapshot
+from UniqueNames import name_item
 
-case = exam = None
+
+case = exam = snapshot = None
 
 
 def get_latest_roi(base_roi_name, **kwargs):
     # Helper function that returns the ROI with the given "base name" and largest copy number
     # kwargs:
-    # unapproved_only: If True, consider only the ROIs that are not part of any approved structure set in the case
+    # unapproved_only: If True, consider only the ROIs that are not part of any approved structure set on the exam
     # non_empty_only: If True, consider only the ROIs with geometries on the exam
 
-    unapproved_only = kwargs.get("unapproved_only", False)
-    non_empty_only = kwargs.get("non_empty_only", False)
-
-    base_roi_name = base_roi_name.lower()
-
-    rois = case.PatientModel.RegionsOfInterest
-    if unapproved_only:
-        approved_roi_names = set(geom.OfRoi.Name for approved_ss in case.PatientModel.StructureSets[exam.Name].ApprovedStructureSets for geom in approved_ss.ApprovedRoiStructures)
-        rois = [roi for roi in rois if roi.Name not in approved_roi_names]
-    if non_empty_only:
-        rois = [roi for roi in rois if case.PatientModel.StructureSets[exam.Name].RoiGeometries[roi.Name].HasContours()]
-    
-    latest_copy_num = copy_num = -1
-    latest_roi = None
-    for roi in rois:
-        roi_name = roi.Name.lower()
-        if roi_name == base_roi_name:
-            copy_num = 0
-        else:
-            m = search(" \((\d+)\)$".format(), roi_name)
-            if m:  # There is a copy number
-                grp = m.group()
-                length = 16 - len(grp)
-                if roi_name[:length] == base_roi_name[:length]:
-                    copy_num = int(m.group(1))
-        if copy_num > latest_copy_num:
-            latest_copy_num = copy_num
-            latest_roi = roi
-    return latest_roi
+    roi_name = snapshot.latest_roi_name(base_roi_name, kwargs.get("unapproved_only", False), kwargs.get("non_empty_only", False), exam.Name)
+    return None if roi_name is None else case.PatientModel.RegionsOfInterest[roi_name]
     
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
 def contour_chestwall():
     """Create Chestwall_L and Chestwall_R geometries on the current examination
 
@@ -76,7 +36,7 @@ def contour_chestwall():
     Left and right lung ROI names are TG-263 compliant.
     """
 
-    global case, exam
+    global case, exam, snapshot
 
     # Get current objects
     try:
@@ -89,13 +49,13 @@ def contour_chestwall():
     except:
         MessageBox.Show("There are no examinations in the current case. Click OK to abort script.", "No Examinations")
         sys.exit(1) 
+    snapshot = CaseSnapshot(case)  # ROI names, geometry states, and approvals, read once
 
     # Determine external ROI name
-    try:
-        case.PatientModel.RegionsOfInterest["External^NoBox"]
+    if "External^NoBox" in snapshot:
         ext_name = "External^NoBox"
-    except:
-        ext_name = [roi.Name for roi in case.PatientModel.RegionsOfInterest if roi.Type == "External"]
+    else:
+        ext_name = [roi.name for roi in snapshot.rois_of_type("External")]
         if not ext_name:
             MessageBox.Show("There is no external geometry on the current exam. Click OK to abort the script.", "No External Geometry")
             sys.exit(1)
@@ -120,8 +80,9 @@ def contour_chestwall():
         # Do any chestwall ROIs already exist?
         chestwall = get_latest_roi(chestwall_name, unapproved_only=True)
         if chestwall is None:
-            chestwall_name = name_item(chestwall_name, [roi.Name for roi in case.PatientModel.RegionsOfInterest], 16)  # Unique name for new chestwall ROI
+            chestwall_name = name_item(chestwall_name, snapshot.roi_names, 16)  # Unique name for new chestwall ROI
             chestwall = case.PatientModel.CreateRoi(Name=chestwall_name, Type="Organ", Color=chestwall_color)  # Create new chestwall ROI  
+            snapshot.add_roi(chestwall)
 
         # Create chestwall geometry based on lung
         margin_a = { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 2, 'Posterior': 2 }  # Expand lung posteriorly, anteriorly, and in the `side` direction
@@ -11,6 +11,9 @@ from connect import *  # Interact w/ RS
 from System.Drawing import *
 from System.Windows.Forms import *
 
+from OptimizationTemplate import apply_state, read_state
+from UniqueNames import beam_name_allocator, name_item
+
 
 def get_tx_technique(bs):
     # Helper function that returns the treatment technique for the given beam set.
@@ -40,165 +43,230 @@ def get_tx_technique(bs):
     return "?"
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
-
-def get_opt_func_args(opt_func):
-    # Helper function that returns a dictionary of arguments to pass into AddOptimizationFunction function
-    # Used for copying objectives and contraints
-    # Code is from the RS 8B Scripting Guideline
-
-    dfp = opt_func.DoseFunctionParameters
-    args = {}
-    args["RoiName"] = opt_func.ForRegionOfInterest.Name
-    args["IsRobust"] = opt_func.UseRobustness
-    args["Weight"] = dfp.Weight
-    if hasattr(dfp, "FunctionType"):
-        if dfp.FunctionType == "UniformEud":
-            args["FunctionType"] = "TargetEud"
-        else:
-            args["FunctionType"] = dfp.FunctionType
-        args["DoseLevel"] = dfp.DoseLevel
-        if "Eud" in dfp.FunctionType:
-            args["EudParameterA"] = dfp.EudParameterA
-        elif "Dvh" in dfp.FunctionType:
-            args["PercentVolume"] = dfp.PercentVolume
-    elif hasattr(dfp, "HighDoseLevel"):
-        # Dose falloff function does not have FunctionType attribute
-        args["FunctionType"] = "DoseFallOff"
-        args["HighDoseLevel"] = dfp.HighDoseLevel
-        args["LowDoseLevel"] = dfp.LowDoseLevel
-        args["LowDoseDistance"] = dfp.LowDoseDistance
-    elif hasattr(dfp, "PercentStdDeviation"):
-        # Uniformity constraint does not have FunctionType attribute
-        args["FunctionType"] = "UniformityConstraint"
-        args["PercentStdDeviation"] = dfp.PercentStdDeviation
-    return args
-
-
-def set_opt_func_args(opt_func, args):
-    # Helper function that sets the DoseFunctionParameters attributes of an optimization function (objective or constraint)
-    # Used for copying objectives and contraints
-    # Code is from the RS 8B Scripting Guideline
-
-    dfp = opt_func.DoseFunctionParameters
-    dfp.Weight = args["Weight"]
-    if args["FunctionType"] == "DoseFallOff":
-        dfp.HighDoseLevel = args["HighDoseLevel"]
-        dfp.LowDoseLevel = args["LowDoseLevel"]
-        dfp.LowDoseDistance = args["LowDoseDistance"]
-    elif args["FunctionType"] == "UniformityConstraint":
-        dfp.PercentStdDeviation = args["PercentStdDeviation"]
+def copy_plan_opt(old_plan_opt, new_plan_opts):
+    # Helper function that copies some optimization parameters, inclusing objectives and constraints, from one plan optimization to one or more others
+    # Only copy the optimization parameters that CRMC ever uses (see OptimizationTemplate)
+    # The source is read once, and all targets are changed in one undo step
+
+    if not isinstance(new_plan_opts, list):
+        new_plan_opts = [new_plan_opts]
+    apply_state(read_state(old_plan_opt), new_plan_opts)
+
+
+class BeamSetSource(object):
+    """Description of a beam set to copy, read once and then added to any number of plans (see `add_beam_set_copy`)
+
+    Everything that does not depend on the target plan is read here, so copying to n plans does not read the source beam set n times.
+    The beams' geometry (isocenters, segments, applicators) is only needed when CopyBeamsFromBeamSet cannot be used, so it is read the first time `beams` is used.
+    """
+
+    def __init__(self, plan, beam_set):
+        # `plan`: The plan that contains `beam_set`
+
+        self.beam_set = beam_set
+        self.name = beam_set.DicomPlanLabel
+        self.imported = beam_set.HasImportedDose()
+        self.exam_name = plan.GetStructureSet().OnExamination.Name
+        self.modality = beam_set.Modality
+        self.tx_technique = get_tx_technique(beam_set)
+        self.patient_position = beam_set.PatientPosition
+        self.num_fx = beam_set.FractionationPattern.NumberOfFractions
+        self.warnings = ""
+
+        # Ensure machine name is recognized
+        self.machine_name = beam_set.MachineReference.MachineName
+        if self.imported:
+            if self.machine_name.endswith("_imported"):
+                self.machine_name = self.machine_name[:-9]
+            else:
+                fx = beam_set.FractionationPattern
+                if fx is None or fx.NumberOfFractions > 5:
+                    self.machine_name = "ELEKTA"
+                elif beam_set.Prescription is not None and beam_set.Prescription.PrimaryDosePrescription.DoseValue >= 600 * fx.NumberOfFractions:
+                    self.machine_name = "SBRT 6MV"
+                else:
+                    self.machine_name = "ELEKTA"
+            self.warnings += "Machine '{}' is not commissioned, so new beam set will use machine '{}'.".format(beam_set.MachineReference.MachineName, self.machine_name)
+
+        patient_setup = beam_set.PatientSetup
+        self.use_setup_beams = patient_setup.UseSetupBeams
+        self.setup_beams = [(sb.GantryAngle, sb.Description) for sb in patient_setup.SetupBeams] if self.use_setup_beams else []  # (Gantry angle, description) of each setup beam
+        self.beam_names = [b.Name for b in beam_set.Beams]
+
+        plan_opt = [opt for opt in plan.PlanOptimizations if opt.OptimizedBeamSets.Count == 1 and opt.OptimizedBeamSets[0].DicomPlanLabel == self.name][0]  # Get PlanOptimizations with a single optimized beam set - the old beam set (assume only one)
+        self.opt_state = read_state(plan_opt) if self.tx_technique == "VMAT" else None  # Copy optimization parameters (the only ones that CRMC ever uses) for VMAT only
+
+        # Rx's, as (AddDosePrescriptionTo* method name, arguments)
+        # Copy all Rx's, not just the primary Rx
+        self.prescriptions = []
+        if beam_set.Prescription is not None:
+            autoscale = self.opt_state["AutoScaleToPrescription"] if self.opt_state is not None else plan_opt.AutoScaleToPrescription  # Assume all Rx's for the beam set have the same autoscale setting
+            for old_rx in beam_set.Prescription.DosePrescriptions:
+                args = {"DoseValue": old_rx.DoseValue, "RelativePrescriptionLevel": old_rx.RelativePrescriptionLevel, "AutoScaleDose": autoscale}
+                if hasattr(old_rx, "OnStructure"):
+                    if old_rx.PrescriptionType == "DoseAtPoint":  # Rx to POI
+                        args["PoiName"] = old_rx.OnStructure.Name
+                        self.prescriptions.append(("AddDosePrescriptionToPoi", args))
+                    else:  # Rx to ROI
+                        args.update({"RoiName": old_rx.OnStructure.Name, "DoseVolume": old_rx.DoseVolume, "PrescriptionType": old_rx.PrescriptionType})
+                        self.prescriptions.append(("AddDosePrescriptionToRoi", args))
+                else:
+                    args["Description"] = old_rx.Description
+                    dsp = old_rx.OnDoseSpecificationPoint
+                    if dsp is not None:  # Rx to site that is not a DSP
+                        args["NameOfDoseSpecificationPoint"] = dsp.Name
+                    self.prescriptions.append(("AddDosePrescriptionToSite", args))
+
+        self._beams = None
+
+    def can_copy_beams(self, exam_name):
+        # True if CopyBeamsFromBeamSet can copy the beams to a plan on the given exam
+        # CopyBeamsFromBeamSet doesn't work for uncommissioned machines
+        return not self.imported and exam_name == self.exam_name
+
+    @property
+    def beams(self):
+        # List of dictionaries describing each beam, for re-creating the beams manually
+        if self._beams is None:
+            self._beams = []
+            for beam in self.beam_set.Beams:
+                iso = beam.Isocenter
+                desc = {"Name": beam.Name, "Position": iso.Position, "IsocenterName": iso.Annotation.Name, "Energy": beam.MachineReference.Energy, "GantryAngle": beam.GantryAngle, "CouchAngle": beam.CouchAngle, "BeamMU": beam.BeamMU, "Description": beam.Description}
+                if self.modality == "Electrons":
+                    applicator = beam.Applicator
+                    desc.update({"ApplicatorName": applicator.ElectronApplicatorName, "InsertName": applicator.Insert.Name, "Contour": applicator.Insert.Contour})
+                elif self.tx_technique != "VMAT":
+                    desc["Segments"] = [(s.CollimatorAngle, s.RelativeWeight, s.JawPositions, s.LeafPositions) for s in beam.Segments]
+                else:
+                    desc.update({"ArcStopGantryAngle": beam.ArcStopGantryAngle, "ArcRotationDirection": beam.ArcRotationDirection, "InitialCollimatorAngle": beam.InitialCollimatorAngle})
+                self._beams.append(desc)
+        return self._beams
+
+
+def next_beam_number(patient):
+    # Helper function that returns the lowest beam number greater than all treatment and setup beam numbers in the patient
+    beam_num = 1
+    for c in patient.Cases:
+        for p in c.TreatmentPlans:
+            for bs in p.BeamSets:
+                for b in bs.Beams:
+                    beam_num = max(beam_num, b.Number + 1)
+                for sb in bs.PatientSetup.SetupBeams:
+                    beam_num = max(beam_num, sb.Number + 1)
+    return beam_num
+
+
+def add_beam_set_copy(source, new_plan, beam_num):
+    """Add a copy of a beam set to a plan
+
+    Do not copy optimization parameters (see `copy_beam_set_to_plans`) or compute dose
+
+    Parameters
+    ----------
+    source: BeamSetSource
+        The beam set to copy
+    new_plan: ScriptObject
+        The plan to which to add the copy
+    beam_num: int
+        Number for the first new beam. Must be unique in the patient. See `next_beam_number`.
+
+    Returns
+    -------
+    Tuple: the new beam set, the name of the new plan's planning exam, and the number for the next new beam
+    """
+
+    ## Create new beam set on new planning exam
+
+    exam_name = new_plan.GetStructureSet().OnExamination.Name
+    new_beam_set_name = name_item(source.name, [beam_set.DicomPlanLabel for beam_set in new_plan.BeamSets])  # Unique beam set name in plan
+    new_beam_set = new_plan.AddNewBeamSet(Name=new_beam_set_name, ExaminationName=exam_name, MachineName=source.machine_name, Modality=source.modality, TreatmentTechnique=source.tx_technique, PatientPosition=source.patient_position, NumberOfFractions=source.num_fx, CreateSetupBeams=source.use_setup_beams, Comment="Copy of {}".format(source.name))
+
+    # Beams created with the beam set may have been numbered automatically
+    for sb in new_beam_set.PatientSetup.SetupBeams:
+        beam_num = max(beam_num, sb.Number + 1)
+
+    ## Copy beam set
+    if source.can_copy_beams(exam_name):
+        new_beam_set.CopyBeamsFromBeamSet(BeamSetToCopyFrom=source.beam_set, BeamsToCopy=source.beam_names)
+    # CopyBeamsFromBeamSet doesn't work for uncommissioned machines, so manually add beams and copy segments
+    # Code modified from RS support's CopyBeamSet script
     else:
-        dfp.DoseLevel = args["DoseLevel"]
-        if "Eud" in dfp.FunctionType:
-            dfp.EudParameterA = args["EudParameterA"]
-        elif "Dvh" in dfp.FunctionType:
-            dfp.PercentVolume = args["PercentVolume"]
-
-
-def copy_plan_opt(old_plan_opt, new_plan_opt):
-    # Helper function that copies some optimization parameters, inclusing objectives and constraints, from one plan optimization to another
-    # Only copy the optimization parameters that CRMC ever uses
-
-    ## Optimization parameters
-
-    with CompositeAction("Copy Select Optimization Parameters"):
-        new_plan_opt.AutoScaleToPrescription = old_plan_opt.AutoScaleToPrescription
-
-        new_plan_opt.OptimizationParameters.Algorithm.MaxNumberOfIterations = old_plan_opt.OptimizationParameters.Algorithm.MaxNumberOfIterations
-        new_plan_opt.OptimizationParameters.Algorithm.OptimalityTolerance = old_plan_opt.OptimizationParameters.Algorithm.OptimalityTolerance
-        
-        new_plan_opt.OptimizationParameters.DoseCalculation.ComputeFinalDose = old_plan_opt.OptimizationParameters.DoseCalculation.ComputeFinalDose
-        new_plan_opt.OptimizationParameters.DoseCalculation.ComputeIntermediateDose = old_plan_opt.OptimizationParameters.DoseCalculation.ComputeIntermediateDose
-        new_plan_opt.OptimizationParameters.DoseCalculation.IterationsInPreparationsPhase = old_plan_opt.OptimizationParameters.DoseCalculation.IterationsInPreparationsPhase
-
-        if get_tx_technique(old_plan_opt.OptimizedBeamSets[0]) == "VMAT":
-            for i, old_tss in enumerate(old_plan_opt.OptimizationParameters.TreatmentSetupSettings):
-                new_tss = new_plan_opt.OptimizationParameters.TreatmentSetupSettings[i]
-                
-                new_tss.SegmentConversion.ArcConversionProperties.MaxLeafTravelDistancePerDegree = old_tss.SegmentConversion.ArcConversionProperties.MaxLeafTravelDistancePerDegree
-                new_tss.SegmentConversion.ArcConversionProperties.UseMaxLeafTravelDistancePerDegree = old_tss.SegmentConversion.ArcConversionProperties.UseMaxLeafTravelDistancePerDegree
-
-                for j, old_bs in enumerate(old_tss.BeamSettings):
-                    old_bs = old_bs.ArcConversionPropertiesPerBeam
-                    new_bs = new_tss.BeamSettings[j].ArcConversionPropertiesPerBeam
-                    if old_bs.NumberOfArcs != new_bs.NumberOfArcs or old_bs.FinalArcGantrySpacing != new_bs.FinalArcGantrySpacing or old_bs.MaxArcDeliveryTime != new_bs.MaxArcDeliveryTime:
-                        new_bs.EditArcBasedBeamOptimizationSettings(CreateDualArcs=old_bs.NumberOfArcs == 2, FinalGantrySpacing=old_bs.FinalArcGantrySpacing, MaxArcDeliveryTime=old_bs.MaxArcDeliveryTime) 
-
-    ## Objectives and constraints
-
-    args_list = []
-
-    # Constraints
-    for opt_func in old_plan_opt.Constraints:
-        args = get_opt_func_args(opt_func)
-        args["IsConstraint"] = False
-        args_list.append(args)
-        
-    # Objectives
-    if old_plan_opt.Objective is not None:
-        for opt_func in old_plan_opt.Objective.ConstituentFunctions:
-            args = get_opt_func_args(opt_func)
-            args["IsConstraint"] = False
-            args_list.append(args)
-    
-    # Create each constraint/objective in new plan opt
-    with CompositeAction("Copy Optimization Functions"):
-        for args in args_list:
-            opt_func = new_plan_opt.AddOptimizationFunction(FunctionType=args["FunctionType"], RoiName=args["RoiName"], IsConstraint=args["IsConstraint"], IsRobust=args["IsRobust"])
-            set_opt_func_args(opt_func, args)
+        beam_names = beam_name_allocator(new_beam_set)
+        for i, beam in enumerate(source.beams):
+            iso_data = new_beam_set.CreateDefaultIsocenterData(Position=beam["Position"])
+            iso_data["Name"] = iso_data["NameOfIsocenterToRef"] = beam["IsocenterName"]
+            if source.modality == "Electrons":
+                new_beam = new_beam_set.CreateElectronBeam(Energy=beam["Energy"], Name=beam["Name"], GantryAngle=beam["GantryAngle"], CouchAngle=beam["CouchAngle"], ApplicatorName=beam["ApplicatorName"], InsertName=beam["InsertName"], IsAddCutoutChecked=True, IsocenterData=iso_data)
+                new_beam.Applicator.Insert.Contour = beam["Contour"]
+                new_beam.BeamMU = beam["BeamMU"]
+                new_beam.Description = beam["Description"]
+            elif source.tx_technique != "VMAT":
+                for coll_angle, rel_weight, jaws, leaves in beam["Segments"]:
+                    name = beam_names.allocate(beam["Name"])
+                    new_beam = new_beam_set.CreatePhotonBeam(Energy=beam["Energy"], Name=name, GantryAngle=beam["GantryAngle"], CouchAngle=beam["CouchAngle"], CollimatorAngle=coll_angle, IsocenterData=iso_data)
+                    new_beam.BeamMU = round(beam["BeamMU"] * rel_weight, 2)
+                    new_beam.CreateRectangularField()
+                    new_beam.Segments[0].JawPositions = jaws
+                    new_beam.Segments[0].LeafPositions = leaves
+                if len(beam["Segments"]) > 1:
+                    new_beam_set.MergeBeamSegments(TargetBeamName=new_beam_set.Beams[i].Name, MergeBeamNames=[b.Name for b in new_beam_set.Beams][(i + 1):])
+                new_beam_set.Beams[i].Description = beam["Description"]
+            else:
+                new_beam = new_beam_set.CreateArcBeam(ArcStopGantryAngle=beam["ArcStopGantryAngle"], ArcRotationDirection=beam["ArcRotationDirection"], Energy=beam["Energy"], Name=beam_names.allocate(beam["Name"]), GantryAngle=beam["GantryAngle"], CouchAngle=beam["CouchAngle"], CollimatorAngle=beam["InitialCollimatorAngle"], IsocenterData=iso_data)
+                new_beam.BeamMU = beam["BeamMU"]
+                new_beam.Description = beam["Description"]
 
+    # Rename and renumber new beams
+    for b in new_beam_set.Beams:
+        b.Number = beam_num
+        b.Name = str(beam_num)
+        beam_num += 1
 
-def copy_beam_set(**kwargs):
-    """Copy the given beam set to a new beam set in the given plan
+    # Manually copy setup beams from old beam set
+    if source.setup_beams:
+        new_beam_set.UpdateSetupBeams(ResetSetupBeams=True, SetupBeamsGantryAngles=[gantry_angle for gantry_angle, _ in source.setup_beams])  # Clear the setup beams created when the beam set was added, to ensure no extraneous setup beams in new beam set
+        new_sbs = new_beam_set.PatientSetup.SetupBeams
+        for i, (_, description) in enumerate(source.setup_beams):
+            new_sb = new_sbs[i]
+            new_sb.Number = beam_num
+            new_sb.Name = str(beam_num)
+            new_sb.Description = description
+            beam_num += 1
+
+    # Copy Rx's
+    if source.prescriptions:
+        with CompositeAction("Copy Prescriptions"):
+            for method_name, args in source.prescriptions:
+                getattr(new_beam_set, method_name)(**args)
+
+    return new_beam_set, exam_name, beam_num
+
+
+def copy_beam_set_to_plans(**kwargs):
+    """Copy the given beam set to a new beam set in each of the given plans
+
+    The source beam set is read once, no matter how many plans it is copied to. Then, each copy only creates the new beam set and writes its beams, setup beams, and Rx's.
+    Optimization parameters are copied to all new beam sets at once, in one undo step (see OptimizationTemplate).
+    Dose computation is deferred until all copies are made. For VMAT beam sets copied to a plan with a different planning exam, dose on additional set is computed once for all the new planning exams.
+
+    See `copy_beam_set` for what is copied.
 
     Keyword Arguments
     -----------------
     old_beam_set_id: str
         BeamSetIdentifier of the beam set to copy
         If None, copy current beam set
-    new_plan_name: str
-        Name of the plan to which to copy the beam set
+    new_plan_names: List[str]
+        Names of the plans to which to copy the beam set
         If None, use the current plan
-    
-    Copy electron or photon (including VMAT) beam sets:
-        - Treatment and setup beams
-            * Unique beam numbers across all cases in current patient
-            * Beam names are same as numbers
-        - AutoScaleToPrescription
-        - For VMAT beam sets, other select optimization settings:
-            * Maximum number of iterations
-            * Optimality tolerance
-            * Calculate intermediate and final doses
-            * Iterations in preparation phase
-            * Max leaf travel distance per degree (and enabled/disabled)
-            * Dual arcs
-            * Max gantry spacing
-            * Max delivery time
-            * Objectives and constraints
-        - Prescriptions
 
-    Unfortunately, dose cannot accurately be copied for VMAT, so we do the next-best things and provide the dose on additional set if the beam set is copied to a plan with a different planning exam.
-
-    Do not optimize or compute dose
+    Returns
+    -------
+    List of the new beam sets, in the order of `new_plan_names`
     """
 
     old_beam_set_id = kwargs.get("old_beam_set_id")
-    new_plan_name = kwargs.get("new_plan_name")
+    new_plan_names = kwargs.get("new_plan_names")
 
     # Get current variables
     try:
@@ -231,149 +299,87 @@ def copy_beam_set(**kwargs):
                 raise ValueError("Invalid argument for `old_beam_set_id`: there is no beam set '{}' in plan '{}'.".format(old_beam_set_name, old_plan_name))
         except:
             raise ValueError("Invalid argument for `old_beam_set_id`: there is no plan '{}' in the current case.".format(old_plan_name))
-    if new_plan_name is None:
-        new_plan = plan  # Copy within same plan
+    if new_plan_names is None:
+        new_plans = [plan]  # Copy within same plan
     else:
-        try:
-            new_plan = case.TreatmentPlans[new_plan_name]
-        except:
-            raise ValueError("Invalid argument for `new_plan_name`: there is no plan '{}' in the current case.".format(new_plan_name))
+        case = get_current("Case")
+        new_plans = []
+        for new_plan_name in new_plan_names:
+            try:
+                new_plans.append(case.TreatmentPlans[new_plan_name])
+            except:
+                raise ValueError("Invalid argument for `new_plan_names`: there is no plan '{}' in the current case.".format(new_plan_name))
 
-    warnings = ""
+    # Alert user and exit script with an error if any plan is approved, before anything is copied
+    for new_plan in new_plans:
+        if new_plan.Review is not None and new_plan.Review.ApprovalStatus == "Approved":
+            MessageBox.Show("Plan '{}' is approved, so a beam set cannot be added. Click OK to abort the script.".format(new_plan.Name), "Plan Is Approved")
+            sys.exit(1)
 
-    # Alert user and exit script with an error if the plan is approved
-    if new_plan.Review is not None and new_plan.Review.ApprovalStatus == "Approved":
-        MessageBox.Show("Plan is approved, so a beam set cannot be added. Click OK to abort the script.", "Plan Is Approved")
-        sys.exit(1)
+    source = BeamSetSource(plan, old_beam_set)
 
-    imported = old_beam_set.HasImportedDose()
-
-    # Ensure machine name is recognized
-    machine_name = old_beam_set.MachineReference.MachineName
-    if imported:
-        if machine_name.endswith("_imported"):
-            machine_name = machine_name[:-9]
-        else:
-            fx = old_beam_set.FractionationPattern
-            if fx is None or fx.NumberOfFractions > 5:
-                machine_name = "ELEKTA"
-            elif old_beam_set.Presciption is not None and old_beam_set.Prescription.PrimaryDosePrescription.DoseValue >= 600 * fx.NumberOfFractions:
-                machine_name = "SBRT 6MV"
-            else:
-                machine_name = "ELEKTA"
-        warnings += "Machine '{}' is not commissioned, so new beam set will use machine '{}'.".format(old_beam_set.MachineReference.MachineName, machine_name)
+    # Unique beam number
+    # Walk the patient once. Each copy then continues from the last number used.
+    beam_num = next_beam_number(patient)
 
-    ## Create new beam set on new planning exam
+    new_beam_sets = []
+    dose_exam_names = []  # New planning exams on which to compute the old beam set's dose
+    for new_plan in new_plans:
+        new_beam_set, exam_name, beam_num = add_beam_set_copy(source, new_plan, beam_num)
+        new_beam_sets.append(new_beam_set)
+        if source.tx_technique == "VMAT" and not source.can_copy_beams(exam_name) and exam_name not in dose_exam_names:
+            dose_exam_names.append(exam_name)
 
-    new_beam_set_name = name_item(old_beam_set.DicomPlanLabel, [beam_set.DicomPlanLabel for beam_set in new_plan.BeamSets])  # Unique beam set name in plan
-    tx_technique = get_tx_technique(old_beam_set)
-    new_beam_set = new_plan.AddNewBeamSet(Name=new_beam_set_name, ExaminationName=new_plan.GetStructureSet().OnExamination.Name, MachineName=machine_name, Modality=old_beam_set.Modality, TreatmentTechnique=tx_technique, PatientPosition=old_beam_set.PatientPosition, NumberOfFractions=old_beam_set.FractionationPattern.NumberOfFractions, CreateSetupBeams=old_beam_set.PatientSetup.UseSetupBeams, Comment="Copy of {}".format(old_beam_set.DicomPlanLabel))
+    # Copy optimization parameters to all new beam sets at once
+    if source.opt_state is not None:
+        new_plan_opts = []
+        for new_plan, new_beam_set in zip(new_plans, new_beam_sets):
+            new_beam_set_name = new_beam_set.DicomPlanLabel
+            new_plan_opts.append([opt for opt in new_plan.PlanOptimizations if opt.OptimizedBeamSets.Count == 1 and opt.OptimizedBeamSets[0].DicomPlanLabel == new_beam_set_name][0])  # Get PlanOptimizations with a single optimized beam set - the new beam set (assume only one)
+        apply_state(source.opt_state, new_plan_opts)
 
-    # Unique beam number
-    beam_num = 1
-    for c in patient.Cases:
-        for p in c.TreatmentPlans:
-            for bs in p.BeamSets:
-                for b in bs.Beams:
-                    beam_num = max(beam_num, b.Number + 1)
-                for sb in bs.PatientSetup.SetupBeams:
-                    beam_num = max(beam_num, sb.Number + 1)
+    # Dose cannot accurately be copied for VMAT, so provide the dose on additional set instead
+    if dose_exam_names:
+        old_beam_set.ComputeDoseOnAdditionalSets(ExaminationNames=dose_exam_names, FractionNumbers=[0] * len(dose_exam_names))
 
-    ## Copy beam set
-    if not imported and plan.GetStructureSet().OnExamination.Name == new_plan.GetStructureSet().OnExamination.Name:
-        new_beam_set.CopyBeamsFromBeamSet(BeamSetToCopyFrom=old_beam_set, BeamsToCopy=[b.Name for b in old_beam_set.Beams])
-    # CopyBeamsFromBeamSet doesn't work for uncommissioned machines, so manually add beams and copy segments
-    # Code modified from RS support's CopyBeamSet script
-    else:
-        for i, beam in enumerate(old_beam_set.Beams):
-            iso_data = new_beam_set.CreateDefaultIsocenterData(Position=beam.Isocenter.Position)
-            iso_data["Name"] = iso_data["NameOfIsocenterToRef"] = beam.Isocenter.Annotation.Name
-            energy = beam.MachineReference.Energy
-            if old_beam_set.Modality == "Electrons":
-                new_beam = new_beam_set.CreateElectronBeam(Energy=energy, Name=beam.Name, GantryAngle=beam.GantryAngle, CouchAngle=beam.CouchAngle, ApplicatorName=beam.Applicator.ElectronApplicatorName, InsertName=beam.Applicator.Insert.Name, IsAddCutoutChecked=True, IsocenterData=iso_data)
-                new_beam.Applicator.Insert.Contour = beam.Applicator.Insert.Contour
-                new_beam.BeamMU = beam.BeamMU
-                new_beam.Description = beam.Description
-            #elif tx_technique == "VMAT":
-                #new_beam = new_beam_set.CreateArcBeam(Energy=energy, Name=beam.Name, ArcRotationDirection=beam.ArcRotationDirection, ArcStopGantryAngle=beam.ArcStopGantryAngle, GantryAngle=beam.GantryAngle, CouchAngle=beam.CouchAngle, CollimatorAngle=beam.InitialCollimatorAngle, IsocenterData=iso_data)
-                
-                """
-                Does not work without license rayWave :(
-                gantry_angles, couch_angles, coll_angles = [], [], []
-                for s in beam.Segments:
-                    gantry_angle = beam.GantryAngle + s.DeltaGantryAngle
-                    if gantry_angle < 0:
-                        gantry_angle += 360
-                    gantry_angles.append(gantry_angle)
-
-                    couch_angle = beam.CouchAngle + s.DeltaCouchAngle
-                    if couch_angle < 0:
-                        couch_angle += 360
-                    couch_angles.append(couch_angle)
-
-                    coll_angles.append(s.CollimatorAngle)
-
-                new_beam.SetArcTrajectory(GantryAngles=gantry_angles, CouchAngles=couch_angles, CollimatorAngles=coll_angles, ArcRotationDirection=new_beam.ArcRotationDirection)
-                """
-                
-            #new_beam.BeamMU = beam.BeamMU
-            elif tx_technique != "VMAT":
-                for s in beam.Segments:
-                    name = name_item(beam.Name, [b.Name for b in new_beam_set.Beams], 16)
-                    new_beam = new_beam_set.CreatePhotonBeam(Energy=energy, Name=name, GantryAngle=beam.GantryAngle, CouchAngle=beam.CouchAngle, CollimatorAngle=s.CollimatorAngle, IsocenterData=iso_data)  
-                    new_beam.BeamMU = round(beam.BeamMU * s.RelativeWeight, 2)
-                    new_beam.CreateRectangularField()
-                    new_beam.Segments[0].JawPositions = s.JawPositions
-                    new_beam.Segments[0].LeafPositions = s.LeafPositions
-                if beam.Segments.Count > 1:
-                    new_beam_set.MergeBeamSegments(TargetBeamName=new_beam_set.Beams[i].Name, MergeBeamNames=[b.Name for b in new_beam_set.Beams][(i + 1):])
-                new_beam_set.Beams[i].Description = beam.Description
+    return new_beam_sets
 
-            else:
-                new_beam = new_beam_set.CreateArcBeam(ArcStopGantryAngle=beam.ArcStopGantryAngle, ArcRotationDirection=beam.ArcRotationDirection, Energy=energy, Name=beam.Name, GantryAngle=beam.GantryAngle, CouchAngle=beam.CouchAngle, CollimatorAngle=beam.InitialCollimatorAngle, IsocenterData=iso_data)
-                new_beam.BeamMU = beam.BeamMU
-                new_beam.Description = beam.Description
 
-                old_beam_set.ComputeDoseOnAdditionalSets(ExaminationNames=[new_plan.GetStructureSet().OnExamination.Name], FractionNumbers=[0])
+def copy_beam_set(**kwargs):
+    """Copy the given beam set to a new beam set in the given plan
 
-    # Rename and renumber new beams
-    for b in new_beam_set.Beams:
-        b.Number = beam_num
-        b.Name = str(beam_num)
-        beam_num += 1
+    Keyword Arguments
+    -----------------
+    old_beam_set_id: str
+        BeamSetIdentifier of the beam set to copy
+        If None, copy current beam set
+    new_plan_name: str
+        Name of the plan to which to copy the beam set
+        If None, use the current plan
+    
+    Copy electron or photon (including VMAT) beam sets:
+        - Treatment and setup beams
+            * Unique beam numbers across all cases in current patient
+            * Beam names are same as numbers
+        - AutoScaleToPrescription
+        - For VMAT beam sets, other select optimization settings:
+            * Maximum number of iterations
+            * Optimality tolerance
+            * Calculate intermediate and final doses
+            * Iterations in preparation phase
+            * Max leaf travel distance per degree (and enabled/disabled)
+            * Dual arcs
+            * Max gantry spacing
+            * Max delivery time
+            * Objectives and constraints
+        - Prescriptions
 
-    # Manually copy setup beams from old beam set
-    if old_beam_set.PatientSetup.UseSetupBeams and old_beam_set.PatientSetup.SetupBeams.Count > 0:
-        old_sbs = old_beam_set.PatientSetup.SetupBeams
-        #new_beam_set.RemoveSetupBeams()
-        new_beam_set.UpdateSetupBeams(ResetSetupBeams=True, SetupBeamsGantryAngles=[sb.GantryAngle for sb in old_sbs])  # Clear the setup beams created when the beam set was added, to ensure no extraneous setup beams in new beam set
-        for i, old_sb in enumerate(old_sbs):
-            new_sb = new_beam_set.PatientSetup.SetupBeams[i]
-            new_sb.Number = beam_num
-            new_sb.Name = str(beam_num)
-            new_sb.Description = old_sb.Description
-            beam_num += 1
+    Unfortunately, dose cannot accurately be copied for VMAT, so we do the next-best things and provide the dose on additional set if the beam set is copied to a plan with a different planning exam.
 
-    old_plan_opt = [opt for opt in plan.PlanOptimizations if opt.OptimizedBeamSets.Count == 1 and opt.OptimizedBeamSets[0].DicomPlanLabel == old_beam_set.DicomPlanLabel][0]  # Get PlanOptimizations with a single optimized beam set - the old beam set (assume only one)
-    new_plan_opt = [opt for opt in new_plan.PlanOptimizations if opt.OptimizedBeamSets.Count == 1 and opt.OptimizedBeamSets[0].DicomPlanLabel == new_beam_set_name][0]  # Get PlanOptimizations with a single optimized beam set - the new beam set (assume only one)
-    
-    # Copy optimization parameters, if applicable
-    if tx_technique == "VMAT":
-        # Copy optimization parameters (the only ones that CRMC ever uses)
-        copy_plan_opt(old_plan_opt, new_plan_opt)
+    Do not optimize or compute dose
 
-    # Copy Rx's
-    if old_beam_set.Prescription is not None:
-        with CompositeAction("Copy Prescriptions"):
-            autoscale = old_plan_opt.AutoScaleToPrescription  # Assume all Rx's for the beam set have the same autoscale setting
-            for old_rx in old_beam_set.Prescription.DosePrescriptions:  # Copy all Rx's, not just the primary Rx
-                if hasattr(old_rx, "OnStructure"):
-                    if old_rx.PrescriptionType == "DoseAtPoint":  # Rx to POI
-                        new_beam_set.AddDosePrescriptionToPoi(PoiName=old_rx.OnStructure.Name, DoseValue=old_rx.DoseValue, RelativePrescriptionLevel=old_rx.RelativePrescriptionLevel, AutoScaleDose=autoscale)
-                    else:  # Rx to ROI
-                        new_beam_set.AddDosePrescriptionToRoi(RoiName=old_rx.OnStructure.Name, DoseVolume=old_rx.DoseVolume, PrescriptionType=old_rx.PrescriptionType, DoseValue=old_rx.DoseValue, RelativePrescriptionLevel=old_rx.RelativePrescriptionLevel, AutoScaleDose=autoscale)
-                elif old_rx.OnDoseSpecificationPoint is None:  # Rx to DSP
-                    new_beam_set.AddDosePrescriptionToSite(Description=old_rx.Description, DoseValue=old_rx.DoseValue, RelativePrescriptionLevel=old_rx.RelativePrescriptionLevel, AutoScaleDose=autoscale)
-                else:  # Rx to site that is not a DSP
-                    new_beam_set.AddDosePrescriptionToSite(Description=old_rx.Description, NameOfDoseSpecificationPoint=old_rx.OnDoseSpecificationPoint.Name, DoseValue=old_rx.DoseValue, RelativePrescriptionLevel=old_rx.RelativePrescriptionLevel, AutoScaleDose=autoscale)
+    To copy a beam set to multiple plans, use `copy_beam_set_to_plans`, which reads the beam set only once.
+    """
 
+    new_plan_name = kwargs.get("new_plan_name")
+    return copy_beam_set_to_plans(old_beam_set_id=kwargs.get("old_beam_set_id"), new_plan_names=None if new_plan_name is None else [new_plan_name])[0]
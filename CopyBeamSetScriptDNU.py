@@ -16,6 +16,8 @@ from System.Drawing import *
 from System.Windows.Forms import *
 
 from CopyPlanWithoutChangesScript import copy_plan_without_changes
+from OptFunctionSchema import get_opt_func_args, set_opt_func_args
+from UniqueNames import name_item
 
 
 case = exam = None
@@ -193,76 +195,6 @@ def get_tx_technique(bs):
     return "?"
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that oks a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
-
-def get_opt_func_args(opt_func):
-    # Helper function that returns a dictionary of arguments to pass into AddOptimizationFunction function
-    # Used for copying objectives and contraints
-    # Code is from the RS 8B Scripting Guideline
-
-    dfp = opt_func.DoseFunctionParameters
-    args = {}
-    args["RoiName"] = opt_func.ForRegionOfInterest.Name
-    args["IsRobust"] = opt_func.UseRobustness
-    args["Weight"] = dfp.Weight
-    if hasattr(dfp, "FunctionType"):
-        if dfp.FunctionType == "UniformEud":
-            args["FunctionType"] = "TargetEud"
-        else:
-            args["FunctionType"] = dfp.FunctionType
-        args["DoseLevel"] = dfp.DoseLevel
-        if "Eud" in dfp.FunctionType:
-            args["EudParameterA"] = dfp.EudParameterA
-        elif "Dvh" in dfp.FunctionType:
-            args["PercentVolume"] = dfp.PercentVolume
-    elif hasattr(dfp, "HighDoseLevel"):
-        # Dose falloff function does not have FunctionType attribute
-        args["FunctionType"] = "DoseFallOff"
-        args["HighDoseLevel"] = dfp.HighDoseLevel
-        args["LowDoseLevel"] = dfp.LowDoseLevel
-        args["LowDoseDistance"] = dfp.LowDoseDistance
-    elif hasattr(dfp, "PercentStdDeviation"):
-        # Uniformity constraint does not have FunctionType attribute
-        args["FunctionType"] = "UniformityConstraint"
-        args["PercentStdDeviation"] = dfp.PercentStdDeviation
-    return args
-
-
-def set_opt_func_args(opt_func, args):
-    # Helper function that sets the DoseFunctionParameters attributes of an optimization function (objective or constraint)
-    # Used for copying objectives and contraints
-    # Code is from the RS 8B Scripting Guideline
-
-    dfp = opt_func.DoseFunctionParameters
-    dfp.Weight = args["Weight"]
-    if args["FunctionType"] == "DoseFallOff":
-        dfp.HighDoseLevel = args["HighDoseLevel"]
-        dfp.LowDoseLevel = args["LowDoseLevel"]
-        dfp.LowDoseDistance = args["LowDoseDistance"]
-    elif args["FunctionType"] == "UniformityConstraint":
-        dfp.PercentStdDeviation = args["PercentStdDeviation"]
-    else:
-        dfp.DoseLevel = args["DoseLevel"]
-        if "Eud" in dfp.FunctionType:
-            dfp.EudParameterA = args["EudParameterA"]
-        elif "Dvh" in dfp.FunctionType:
-            dfp.PercentVolume = args["PercentVolume"]
-
-
 def copy_plan_opt(old_plan_opt, new_plan_opt):
     # Helper function that copies some optimization parameters, inclusing objectives and constraints, from one plan optimization to another
     # Only copy the optimization parameters that CRMC ever uses
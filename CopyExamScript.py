@@ -2,42 +2,20 @@
 import clr
 clr.AddReference("System.Windows.Forms")
 import sys
+sys.path.append(r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\RayStation")
 
-from datetime import datetime
-from os import listdir, makedirs
-from shutil import rmtree  # Easy function for deleting nonempty directories
+from os import listdir
 
-import pydicom  # Manipulate DICOM files/data
 from connect import *  # Interact w/ RS
 from System.Windows.Forms import *  # GUI
 
+from DicomFiles import patch_header
+from DicomStaging import StagingArea
+from DicomUIDs import UidAllocator
+from UniqueNames import name_item
 
-case = None
-
-
-def compute_new_id(study_or_series):
-    # Helper function that creates a unique DICOM StudyInstanceUID or SeriesInstanceUID for an examination
-    # `study_or_series`: either "Study" or "Series"
-    
-    all_ids = [e.GetAcquisitionDataFromDicom()["{}Module".format(study_or_series)]["{}InstanceUID".format(study_or_series)] for e in case.Examinations]
-    all_ids.sort(key=lambda id: int(id.split(".")[-1]))
-    dot_idx = all_ids[-1].rfind(".")
-    return "{}{}".format(all_ids[-1][:(dot_idx + 1)], int(all_ids[-1][(dot_idx + 1):]) + 1)
 
-
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
+case = None
 
 
 def copy_exam(exam_name=None):
@@ -79,35 +57,39 @@ def copy_exam(exam_name=None):
         except:
             raise ValueError("There is no examination '{}' in the current case.")
 
-    # Create empty directory for exported DICOM files
-    base_path = r"\\vs20filesvr01\groups\CANCER\Physics\Temp\CopyExamScript"
-    folder = r"{}\{}".format(base_path, datetime.now().strftime("%m-%d-%Y %H_%M_%S"))
-    makedirs(folder)  # Create directory
+    # Export to a local staging folder that is deleted automatically once the new exam is imported
+    with StagingArea("CopyExamScript") as staging:
+        folder = staging.path
 
-    # Export exam and beam sets
-    patient.Save()  # Error if you attempt to export when there are unsaved modifications
-    export_args = {"ExportFolderPath": folder, "Examinations": [exam.Name], "IgnorePreConditionWarnings": False}
-    try:
-        case.ScriptableDicomExport(**export_args)
-    except:
-        export_args["IgnorePreConditionWarnings"] = True
-        case.ScriptableDicomExport(**export_args)  # Retry the export, ignoring warnings
-
-    # Compute new study and series IDs
-    new_study_id = compute_new_id("Study")
-    new_series_id = compute_new_id("Series")
-
-    for f in listdir(folder):
-        f = r"{}\{}".format(folder, f)  # Absolute path to file
-        dcm = pydicom.dcmread(f)  # Read DICOM data
-        dcm.StudyInstanceUID = new_study_id
-        dcm.SeriesInstanceUID = new_series_id
-        dcm.save_as(f, write_like_original=False)  # Overwrite original DICOM file
-
-    # Find and import the edited DICOM files
-    study = patient_db.QueryStudiesFromPath(Path=folder, SearchCriterias={"PatientID": patient.PatientID})[0]  # There is only one study in the directory
-    series = patient_db.QuerySeriesFromPath(Path=folder, SearchCriterias=study)  # Series belonging to the study
-    patient.ImportDataFromPath(Path=folder, SeriesOrInstances=series, CaseName=case.CaseName)  # Import into current case
+        # Export exam and beam sets
+        patient.Save()  # Error if you attempt to export when there are unsaved modifications
+        export_args = {"ExportFolderPath": folder, "Examinations": [exam.Name], "IgnorePreConditionWarnings": False}
+        try:
+            case.ScriptableDicomExport(**export_args)
+        except:
+            export_args["IgnorePreConditionWarnings"] = True
+            case.ScriptableDicomExport(**export_args)  # Retry the export, ignoring warnings
+        staging.record("Export")
+
+        # Compute new study and series IDs
+        uids = UidAllocator(case)
+        new_study_id = uids.new_uid(uids.exam_uids[exam.Name]["Study"], "Study")
+        new_series_id = uids.new_uid(uids.exam_uids[exam.Name]["Series"], "Series")
+
+        def edit(dcm):
+            dcm.StudyInstanceUID = new_study_id
+            dcm.SeriesInstanceUID = new_series_id
+
+        for f in listdir(folder):
+            patch_header(r"{}\{}".format(folder, f), edit)  # Only the header is rewritten
+        staging.record("Change UIDs")
+
+        # Find and import the edited DICOM files
+        study = patient_db.QueryStudiesFromPath(Path=folder, SearchCriterias={"PatientID": patient.PatientID})[0]  # There is only one study in the directory
+        series = patient_db.QuerySeriesFromPath(Path=folder, SearchCriterias=study)  # Series belonging to the study
+        patient.ImportDataFromPath(Path=folder, SeriesOrInstances=series, CaseName=case.CaseName)  # Import into current case
+        staging.record("Import")
+        print(staging.report())
 
     # The exam that was just imported
     new_exam = [e for e in case.Examinations if e.Series[0].ImportedDicomUID == new_series_id][0]  
@@ -135,7 +117,4 @@ def copy_exam(exam_name=None):
         if abs(poi.Point.x) < 1000:
             case.PatientModel.StructureSets[new_exam.Name].PoiGeometries[i].Point = poi.Point
 
-    # Delete the temporary directory and all its contents
-    rmtree(folder)
-
     return new_exam.Name
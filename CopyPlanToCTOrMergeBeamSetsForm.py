@@ -24,11 +24,16 @@ clr.AddReference("System.Windows.Forms")
 from random import choice
 from re import IGNORECASE, search
 from string import ascii_uppercase
+from time import time
+
+import numpy as np
 from System.Drawing import *
 from System.Windows.Forms import *
 
 from connect import *
 
+from UniqueNames import name_item
+
 
 case = None
 
@@ -290,19 +295,116 @@ def TreatmentTechnique(bs):
     return TT
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
+def copy_arc_conversion_settings(from_po, to_po):
+    # Helper function that copies the final arc gantry spacing of each beam from one plan optimization to another
+    for from_settings, to_settings in zip(from_po.OptimizationParameters.TreatmentSetupSettings[0].BeamSettings, to_po.OptimizationParameters.TreatmentSetupSettings[0].BeamSettings):
+        to_settings.ArcConversionPropertiesPerBeam.FinalArcGantrySpacing = from_settings.ArcConversionPropertiesPerBeam.FinalArcGantrySpacing
+
+
+class SegmentSnapshot(object):
+    """Control point data of one beam, read once from the source beam
+
+    Attributes
+    ----------
+    name: str
+        Beam name
+    mu: float
+        Beam MU
+    leaves: np.ndarray
+        Leaf positions, shape (number of segments, 2 banks, number of leaf pairs)
+    jaws: np.ndarray
+        Jaw positions, shape (number of segments, 4)
+    dose_rates: np.ndarray
+        Dose rate of each segment
+    weights: np.ndarray
+        Relative weight of each segment
+    """
+
+    def __init__(self, beam):
+        # `beam`: RS beam to read
+        
+        self.name = beam.Name
+        self.mu = beam.BeamMU
+        leaves, jaws, dose_rates, weights = [], [], [], []
+        for s in beam.Segments:  # Read each segment property once
+            leaves.append([list(bank) for bank in s.LeafPositions])
+            jaws.append(list(s.JawPositions))
+            dose_rates.append(s.DoseRate)
+            weights.append(s.RelativeWeight)
+        self.leaves = np.array(leaves, dtype=float).reshape(len(leaves), 2, -1) if leaves else np.zeros((0, 2, 0))
+        self.jaws = np.array(jaws, dtype=float).reshape(len(jaws), 4) if jaws else np.zeros((0, 4))
+        self.dose_rates = np.array(dose_rates, dtype=float)
+        self.weights = np.array(weights, dtype=float)
+
+    def __len__(self):
+        return self.leaves.shape[0]
+
+    def validate(self, segments):
+        # Return an error message if the target beam's segments cannot hold this snapshot, or None if they can
+        # `segments`: List of the target beam's RS segments
+        if len(segments) != len(self):
+            return "Beam '{}' has {} segments, but its copy has {}.".format(self.name, len(self), len(segments))
+        if segments:
+            num_leaf_pairs = len(list(segments[0].LeafPositions[0]))
+            if num_leaf_pairs != self.leaves.shape[2]:
+                return "Beam '{}' has {} leaf pairs, but its copy has {}.".format(self.name, self.leaves.shape[2], num_leaf_pairs)
+        return None
+
+    def write(self, beam, segments):
+        # Write the snapshot to the target beam
+        # `segments`: List of the target beam's RS segments (cached handles, so that no beam or segment is looked up again)
+        # Leaf and jaw positions are written into the target segment's own (.NET) arrays, which are then assigned back, so RS always gets its native array types
+        beam.BeamMU = self.mu
+        for j, s in enumerate(segments):
+            leaves = s.LeafPositions
+            for bank_idx, bank in enumerate(self.leaves[j]):
+                for leaf_idx, pos in enumerate(bank):
+                    leaves[bank_idx][leaf_idx] = float(pos)
+            s.LeafPositions = leaves
+            jaws = s.JawPositions
+            for jaw_idx, pos in enumerate(self.jaws[j]):
+                jaws[jaw_idx] = float(pos)
+            s.JawPositions = jaws
+            s.DoseRate = float(self.dose_rates[j])
+            s.RelativeWeight = float(self.weights[j])
+
+
+def transfer_segments(snapshots, target_beams):
+    """Copy control point data from source beam snapshots to target beams
+
+    Validate every beam before writing anything, then write all beams in one undo step.
+
+    Parameters
+    ----------
+    snapshots: list of SegmentSnapshot
+        Source beams, in order
+    target_beams: list
+        Target RS beams, in the same order
+
+    Returns
+    -------
+    List of (beam name, number of segments, seconds) for each beam written
+
+    Raises
+    ------
+    ValueError if the number of beams, segments, or leaf pairs differs
+    """
 
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
+    if len(snapshots) != len(target_beams):
+        raise ValueError("There are {} source beams but {} target beams.".format(len(snapshots), len(target_beams)))
+    target_segments = [list(beam.Segments) for beam in target_beams]  # Cached segment handles
+    for snapshot, segments in zip(snapshots, target_segments):
+        error = snapshot.validate(segments)
+        if error is not None:
+            raise ValueError(error)
+
+    timings = []
+    with CompositeAction("Copy segments"):
+        for snapshot, beam, segments in zip(snapshots, target_beams, target_segments):
+            start = time()
+            snapshot.write(beam, segments)
+            timings.append((snapshot.name, len(snapshot), time() - start))
+    return timings
 
 
 # -----------------------
@@ -432,15 +534,15 @@ def copy_plan_to_ct_or_merge_beam_sets(**kwargs):
     
     poIndex = 0
     opoIndex = 0
+    originalPlanCTName = originalPlan.GetStructureSet().OnExamination.Name
+    dummy = None  # Dummy PTV for VMAT segment creation, if needed
+    copy_report = []  # How each VMAT beam set's control points were created
 
     reg = None
 
     examination = case.Examinations[replanCTName]
     ext = [roi for roi in case.PatientModel.RegionsOfInterest if roi.Type == "External"][0]
     if mode == "copy":
-        originalPlanCTName = \
-            originalPlan.GetStructureSet().OnExamination.Name
-
         # Does a registration exist? We will use this to maintain copy vs merge state
         reg = case.GetTransformForExaminations(
             FromExamination=originalPlanCTName,
@@ -613,116 +715,134 @@ def copy_plan_to_ct_or_merge_beam_sets(**kwargs):
 
         # must be a VMAT
         else:
-            for beam in bs.Beams:
-                CABargs = {
-                    "ArcStopGantryAngle": beam.ArcStopGantryAngle,
-                    "ArcRotationDirection": beam.ArcRotationDirection,
-                    "Energy": beam.MachineReference.Energy,
-                    "Name": beam.Name,
-                    "GantryAngle": beam.GantryAngle,
-                    "CouchAngle": beam.CouchAngle,
-                    "CollimatorAngle": beam.InitialCollimatorAngle,
-                    }
-
-                iso = beam.Isocenter.Position
-                isocenter = {
-                    "x":iso.x,
-                    "y":iso.y,
-                    "z":iso.z
-                }
-
-                # check if copy or merge
-                if reg is not None:
-                    iso = case.TransformPointFromExaminationToExamination(
-                        FromExamination=originalPlanCTName,
-                        ToExamination=replanCTName,
-                        Point=isocenter
-                    )
+            bs_start = time()
+            vmat_path = None
+            fallback_reason = None
+
+            # Fast path: if the new beam set is on the same exam, copy the beams with their control points, and reuse the arc conversion settings
+            # The new beam set was created with the original beam set's machine, so the machines always match
+            # CopyBeamsFromBeamSet fails for, e.g., uncommissioned machines. Then delete any beams it added, and fall back to creating segments with a dummy optimization
+            if replanCTName == originalPlanCTName:
+                try:
+                    rpbs.CopyBeamsFromBeamSet(BeamSetToCopyFrom=bs, BeamsToCopy=[beam.Name for beam in bs.Beams])
+                except Exception as e:
+                    fallback_reason = str(e)
+                    for beam_name in [beam.Name for beam in rpbs.Beams]:
+                        rpbs.DeleteBeam(BeamName=beam_name)
+                else:
+                    copy_arc_conversion_settings(originalPlan.PlanOptimizations[opoIndex], replan.PlanOptimizations[poIndex])
+                    vmat_path = "copied control points"
+
+            if vmat_path is None:
+                for beam in bs.Beams:
+                    CABargs = {
+                        "ArcStopGantryAngle": beam.ArcStopGantryAngle,
+                        "ArcRotationDirection": beam.ArcRotationDirection,
+                        "Energy": beam.MachineReference.Energy,
+                        "Name": beam.Name,
+                        "GantryAngle": beam.GantryAngle,
+                        "CouchAngle": beam.CouchAngle,
+                        "CollimatorAngle": beam.InitialCollimatorAngle,
+                        }
+
+                    iso = beam.Isocenter.Position
                     isocenter = {
                         "x":iso.x,
                         "y":iso.y,
                         "z":iso.z
                     }
-                CABargs["IsocenterData"] = bs.CreateDefaultIsocenterData(Position=isocenter)
-                iso_name = name_item(CABargs["IsocenterData"]["Name"], [b.Isocenter.Annotation.Name for b_set in replan.BeamSets for b in b_set.Beams if b_set.DicomPlanLabel != bs.DicomPlanLabel], 16)
-                CABargs["IsocenterData"]["NameOfIsocenterToRef"] = CABargs["IsocenterData"]["Name"] = iso_name
-
-                newBeam = rpbs.CreateArcBeam(**CABargs)
-                if rpbs.Beams.Count > 1:
-                    newBeam.SetIsocenter(Name=rpbs.Beams[0].Isocenter.Annotation.Name)
 
-            # we cannot create controlpoints directly
-            po = replan.PlanOptimizations[poIndex]
+                    # check if copy or merge
+                    if reg is not None:
+                        iso = case.TransformPointFromExaminationToExamination(
+                            FromExamination=originalPlanCTName,
+                            ToExamination=replanCTName,
+                            Point=isocenter
+                        )
+                        isocenter = {
+                            "x":iso.x,
+                            "y":iso.y,
+                            "z":iso.z
+                        }
+                    CABargs["IsocenterData"] = bs.CreateDefaultIsocenterData(Position=isocenter)
+                    iso_name = name_item(CABargs["IsocenterData"]["Name"], [b.Isocenter.Annotation.Name for b_set in replan.BeamSets for b in b_set.Beams if b_set.DicomPlanLabel != bs.DicomPlanLabel], 16)
+                    CABargs["IsocenterData"]["NameOfIsocenterToRef"] = CABargs["IsocenterData"]["Name"] = iso_name
+
+                    newBeam = rpbs.CreateArcBeam(**CABargs)
+                    if rpbs.Beams.Count > 1:
+                        newBeam.SetIsocenter(Name=rpbs.Beams[0].Isocenter.Annotation.Name)
+
+                # we cannot create controlpoints directly
+                po = replan.PlanOptimizations[poIndex]
     
-            # remove an roi named "dummyPTV" if it exists
-            try:
-                roi = case.PatientModel.RegionsOfInterest["dummyPTV"]
-                roi.DeleteRoi()
-            except:
-                pass
-
-            # create OUR dummyPTV roi
-            with CompositeAction("Create dummy"):
-                dummy = case.PatientModel.CreateRoi(Name="dummyPTV", Color="Red"
-                        , Type="Ptv", TissueName=None, RoiMaterial=None)
-
-                dummy.CreateSphereGeometry(Radius=2,
-                                        Examination=examination,
-                                        Center=isocenter)
-
-            # remove any existing optimization objectives
-            if po.Objective != None:
-                for f in po.Objective.ConstituentFunctions:
-                    f.DeleteFunction()
-
-            # add OUR optimization objectives
-            with CompositeAction("Add objective"):
-                function = po.AddOptimizationFunction(
-                    FunctionType="UniformDose",
-                    RoiName="dummyPTV",
-                    IsConstraint=False,
-                    RestrictAllBeamsIndividually=False,
-                    RestrictToBeam=None,
-                    IsRobust=False,
-                    RestrictToBeamSet=None,
-                    )
-
-                if rx is not None:
-                    function.DoseFunctionParameters.DoseLevel = rx.DoseValue
-                function.DoseFunctionParameters.Weight = 90
-
-            # set the arc spacing and create the segments
-            #with CompositeAction("Dummy optimization"):
-            po.OptimizationParameters.Algorithm.MaxNumberOfIterations = 2
-            po.OptimizationParameters.DoseCalculation.IterationsInPreparationsPhase = \
-                1
-            for (i, settings) in \
-                enumerate(originalPlan.PlanOptimizations[opoIndex].OptimizationParameters.TreatmentSetupSettings[0].BeamSettings):
-                replan.PlanOptimizations[poIndex].OptimizationParameters.TreatmentSetupSettings[0].BeamSettings[i].ArcConversionPropertiesPerBeam.FinalArcGantrySpacing = \
-                    settings.ArcConversionPropertiesPerBeam.FinalArcGantrySpacing
-            try:
-                po.RunOptimization()
-            except Exception as e:  # External geometry may have holes
-                if search("The external ROI contains holes", str(e)):
-                    # Ask if user wants to remove holes and retry the computation
-                    res = MessageBox.Show("Dose could not be computed on image set '{}' because the external geometry contains holes. Would you like to Remove Holes and try again?".format(replanCTName), "Holy External!", MessageBoxButtons.YesNo)
-                    if res == DialogResult.Yes:
-                        case.PatientModel.StructureSets[replanCTName].SimplifyContours(RoiNames=[ext.Name], RemoveHoles3D=True, RemoveSmallContours=False, ReduceMaxNumberOfPointsInContours=False, ResolveOverlappingContours=False)
-                        po.RunOptimization()
+                # remove an roi named "dummyPTV" if it exists
+                try:
+                    roi = case.PatientModel.RegionsOfInterest["dummyPTV"]
+                    roi.DeleteRoi()
+                except:
+                    pass
+
+                # create OUR dummyPTV roi
+                with CompositeAction("Create dummy"):
+                    dummy = case.PatientModel.CreateRoi(Name="dummyPTV", Color="Red"
+                            , Type="Ptv", TissueName=None, RoiMaterial=None)
+
+                    dummy.CreateSphereGeometry(Radius=2,
+                                            Examination=examination,
+                                            Center=isocenter)
+
+                # remove any existing optimization objectives
+                if po.Objective != None:
+                    for f in po.Objective.ConstituentFunctions:
+                        f.DeleteFunction()
+
+                # add OUR optimization objectives
+                with CompositeAction("Add objective"):
+                    function = po.AddOptimizationFunction(
+                        FunctionType="UniformDose",
+                        RoiName="dummyPTV",
+                        IsConstraint=False,
+                        RestrictAllBeamsIndividually=False,
+                        RestrictToBeam=None,
+                        IsRobust=False,
+                        RestrictToBeamSet=None,
+                        )
+
+                    if rx is not None:
+                        function.DoseFunctionParameters.DoseLevel = rx.DoseValue
+                    function.DoseFunctionParameters.Weight = 90
+
+                # set the arc spacing and create the segments
+                #with CompositeAction("Dummy optimization"):
+                po.OptimizationParameters.Algorithm.MaxNumberOfIterations = 2
+                po.OptimizationParameters.DoseCalculation.IterationsInPreparationsPhase = \
+                    1
+                copy_arc_conversion_settings(originalPlan.PlanOptimizations[opoIndex], po)
+                try:
+                    po.RunOptimization()
+                except Exception as e:  # External geometry may have holes
+                    if search("The external ROI contains holes", str(e)):
+                        # Ask if user wants to remove holes and retry the computation
+                        res = MessageBox.Show("Dose could not be computed on image set '{}' because the external geometry contains holes. Would you like to Remove Holes and try again?".format(replanCTName), "Holy External!", MessageBoxButtons.YesNo)
+                        if res == DialogResult.Yes:
+                            case.PatientModel.StructureSets[replanCTName].SimplifyContours(RoiNames=[ext.Name], RemoveHoles3D=True, RemoveSmallContours=False, ReduceMaxNumberOfPointsInContours=False, ResolveOverlappingContours=False)
+                            po.RunOptimization()
+
+                # lets copy the old segments to the new segments
+                snapshots = [SegmentSnapshot(beam) for beam in bs.Beams]
+                try:
+                    timings = transfer_segments(snapshots, list(rpbs.Beams))
+                except ValueError as e:
+                    MessageBox.Show("Segments could not be copied to beam set '{}': {}".format(rpbs.DicomPlanLabel, e), "Segments Not Copied")
+                    sys.exit(1)
+                for beam_name, num_segments, secs in timings:
+                    print("Copied {} segments of beam '{}' in {:.2f} s".format(num_segments, beam_name, secs))
+                vmat_path = "dummy optimization"
+                if fallback_reason is not None:
+                    vmat_path += " (copying control points failed: {})".format(fallback_reason)
 
             poIndex += 1
-
-            # lets copy the old segments to the new segments
-            for (i, beam) in enumerate(bs.Beams):
-                rpbs.Beams[i].BeamMU = beam.BeamMU
-
-                for (j, s) in enumerate(beam.Segments):
-                    rpbs.Beams[i].Segments[j].LeafPositions = \
-                        s.LeafPositions
-                    rpbs.Beams[i].Segments[j].JawPositions = s.JawPositions
-                    rpbs.Beams[i].Segments[j].DoseRate = s.DoseRate
-                    rpbs.Beams[i].Segments[j].RelativeWeight = \
-                        s.RelativeWeight
+            copy_report.append("Beam set '{}': {} ({:.1f} s)".format(rpbs.DicomPlanLabel, vmat_path, time() - bs_start))
 
     # lets compute the beams
     for bs in replan.BeamSets:
@@ -737,6 +857,10 @@ def copy_plan_to_ct_or_merge_beam_sets(**kwargs):
             MessageBox.Show("Electron BeamSet - set histories, prescription and compute.", "Electron Beam Set")
 
     # Delete dummy PTV
-    dummy.DeleteRoi()
+    if dummy is not None:
+        dummy.DeleteRoi()
+
+    for line in copy_report:
+        print(line)
 
     return replanName
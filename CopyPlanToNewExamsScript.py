@@ -10,7 +10,8 @@ sys.path.append(r"{}\Scripts\RayStation".format(t_path))
 from connect import *
 from System.Windows.Forms import MessageBox
 
-from CopyBeamSetScript import copy_beam_set
+from CopyBeamSetScript import copy_beam_set_to_plans
+from UniqueNames import name_item
 
 
 def get_tx_technique(beam_set):
@@ -33,21 +34,6 @@ def get_tx_technique(beam_set):
                 return "ApplicatorAndCutout"
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
 def copy_plan_to_new_exams():
     """Copy current plan to all other exams in the same frame of reference as the planning exam
 
@@ -66,6 +52,7 @@ def copy_plan_to_new_exams():
     old_struct_set = plan.GetStructureSet()
     planning_exam = old_struct_set.OnExamination
     planning_exam_for = planning_exam.EquipmentInfo.FrameOfReference
+    new_plans = []
     for new_exam in case.Examinations:
         if new_exam.Name == planning_exam.Name or new_exam.EquipmentInfo.FrameOfReference != planning_exam_for:
             continue
@@ -98,15 +85,27 @@ def copy_plan_to_new_exams():
         if not new_struct_set.RoiGeometries[ext.Name].HasContours():
             ext.CreateExternalGeometry(Examination=new_exam)
         new_plan.SetDefaultDoseGrid(VoxelSize=dg.VoxelSize)
+        new_plans.append(new_plan)
 
-        # Copy beam sets
-        for beam_set in plan.BeamSets:
-            copy_beam_set(old_beam_set_id=beam_set.BeamSetIdentifier(), new_plan_name=new_plan.Name)
+    if not new_plans:
+        return
+
+    # Copy beam sets
+    # Each beam set is read once and copied to all new plans
+    new_plan_names = [new_plan.Name for new_plan in new_plans]
+    for beam_set in plan.BeamSets:
+        copy_beam_set_to_plans(old_beam_set_id=beam_set.BeamSetIdentifier(), new_plan_names=new_plan_names)
 
     # Copy clinical goals
+    goals = []  # AddClinicalGoal arguments for each clinical goal, read once
     for func in plan.TreatmentCourse.EvaluationSetup.EvaluationFunctions:
-        try:
-            new_plan.TreatmentCourse.EvaluationSetup.AddClinicalGoal(RoiName=func.ForRegionOfInterest.Name, GoalCriteria=func.PlanningGoal.GoalCriteria, GoalType=func.PlanningGoal.Type, AcceptanceLevel=func.PlanningGoal.AcceptanceLevel, ParameterValue=func.PlanningGoal.ParameterValue, IsComparativeGoal=func.PlanningGoal.IsComparativeGoal, Priority=func.PlanningGoal.Priority)
-        except:  # Clinical goal already exists (e.g., previous run of this script was stopped prematurely)
-            continue
+        goal = func.PlanningGoal
+        goals.append({"RoiName": func.ForRegionOfInterest.Name, "GoalCriteria": goal.GoalCriteria, "GoalType": goal.Type, "AcceptanceLevel": goal.AcceptanceLevel, "ParameterValue": goal.ParameterValue, "IsComparativeGoal": goal.IsComparativeGoal, "Priority": goal.Priority})
+    for new_plan in new_plans:
+        eval_setup = new_plan.TreatmentCourse.EvaluationSetup
+        for goal in goals:
+            try:
+                eval_setup.AddClinicalGoal(**goal)
+            except:  # Clinical goal already exists (e.g., previous run of this script was stopped prematurely)
+                continue
         
\ No newline at end of file
@@ -2,15 +2,7 @@ import sys
 
 from connect import *  # Interact w/ RS
 
-
-def name_item(item, l, max_len=sys.maxsize):
-    copy_num = 0
-    old_item = item
-    while item in l:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
+from UniqueNames import name_item
 
 
 def copy_plan_without_changes(old_plan_name=None):
@@ -5,19 +5,20 @@ z_path = r"\\vs19msqapp\MOSAIQ_APP\ESCAN"
 import clr
 clr.AddReference("System.Windows.Forms")
 
-import os
-import shutil
 import sys
+sys.path.append(r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\RayStation")
 
 from connect import *  # Interact w/ RS
 from System.Windows.Forms import *  # For GUI
 
+from DicomStaging import StagingArea
+
 
 def create_qa_plan():
     """Create and export a DQA plan for the current beam set
     
-    Export DICOM files to "Z:\TreatmentPlans\DQA"
-    If export folder with the computed name already exists, delete and recreate it
+    Export DICOM files to a local staging folder, then copy them to "Z:\TreatmentPlans\DQA" in one step
+    If export folder with the computed name already exists, replace it
 
     Detailed example of the code that names the new QA plan:
     Existing QA plans are "Test" and "Rectal Boost DQA"
@@ -62,19 +63,21 @@ def create_qa_plan():
         if res == DialogResult.No:
             sys.exit()
 
-    # Create export folder
+    # Export folder name
     patient.Save()  # Must save before any DICOM export
     pt_name = ", ".join(patient.Name.split("^")[:2])  # e.g., "Jones, Bill"
     qa_folder_name = "{} {}".format(pt_name, qa_plan_name)  # e.g., "Jones, Bill Prostate DQA"
     qa_folder_name = r"{}\TreatmentPlans\DQA\{}".format(z_path, qa_folder_name)  # Absolute path to export folder
-    if os.path.isdir(qa_folder_name):
-        shutil.rmtree(qa_folder_name)
-    os.mkdir(qa_folder_name)
     
-    # Export QA plan
-    try:
-        qa_plan.ScriptableQADicomExport(ExportFolderPath=qa_folder_name, QaPlanIdentity="Patient", ExportBeamSet=True, ExportBeamSetDose=True, ExportBeamSetBeamDose=True, IgnorePreConditionWarnings=False)
-    except SystemError as e:
-        res = MessageBox.Show("{}\nProceed?".format(e), "Create QA Plan", MessageBoxButtons.YesNo)
-        if res == DialogResult.Yes:
-            qa_plan.ScriptableQADicomExport(ExportFolderPath=qa_folder_name, QaPlanIdentity="Patient", ExportBeamSet=True, ExportBeamSetDose=True, ExportBeamSetBeamDose=True, IgnorePreConditionWarnings=True)
+    # Export QA plan to a local staging folder, then copy to the network export folder in one step
+    with StagingArea("CreateQAPlanScript") as staging:
+        try:
+            qa_plan.ScriptableQADicomExport(ExportFolderPath=staging.path, QaPlanIdentity="Patient", ExportBeamSet=True, ExportBeamSetDose=True, ExportBeamSetBeamDose=True, IgnorePreConditionWarnings=False)
+        except SystemError as e:
+            res = MessageBox.Show("{}\nProceed?".format(e), "Create QA Plan", MessageBoxButtons.YesNo)
+            if res == DialogResult.No:
+                sys.exit()
+            qa_plan.ScriptableQADicomExport(ExportFolderPath=staging.path, QaPlanIdentity="Patient", ExportBeamSet=True, ExportBeamSetDose=True, ExportBeamSetBeamDose=True, IgnorePreConditionWarnings=True)
+        staging.record("Export")
+        staging.transfer(qa_folder_name)  # Replaces the folder if it already exists
+        print(staging.report())
@@ -2,9 +2,12 @@ import clr
 clr.AddReference("System.Windows.Forms")
 import sys
 
+import numpy as np
 from connect import *  # Interact w/ RS
 from System.Windows.Forms import MessageBox
 
+from CaseSnapshot import CaseSnapshot
+
 
 def delete_empty_rois():
     """Delete all ROIs in the current case that are empty on all exams
@@ -18,17 +21,33 @@ def delete_empty_rois():
         MessageBox.Show("There is no case loaded. Click OK to abort script.", "No Case Loaded")
         sys.exit(1)  # Exit script with an error
 
-    roi_names = [roi.Name for roi in case.PatientModel.RegionsOfInterest]
-    approved_roi_names = [geom.OfRoi.Name for ss in case.PatientModel.StructureSets for approved_ss in ss.ApprovedStructureSets for geom in approved_ss.ApprovedRoiStructures]
-    approved_roi_names.extend([geom.OfRoi.Name for plan in case.TreatmentPlans for bs in plan.BeamSets if bs.DependentApprovedStructureSet is not None for geom in bs.DependentApprovedStructureSet.ApprovedRoiStructures])
-    empty_approved_roi_names = []  # Names of ROIs that could not be deleted because they are approved
+    snapshot = CaseSnapshot(case)
+    roi_names = snapshot.roi_names
+    approved_roi_names = snapshot.approved_roi_names()  # Approved on any exam, including beam sets' dependent approved structure sets
+
+    # Emptiness matrix: ROIs x exams
+    # 1 = has contours, 0 = empty, -1 = not checked because the ROI already has contours on another exam
+    # Read each structure set's geometry collection once, and check the exam that most recently had contours first, since most ROIs are contoured on the same (e.g., planning) exam
+    geoms = [ss.RoiGeometries for ss in case.PatientModel.StructureSets]
+    contours = np.full((len(roi_names), len(geoms)), -1, dtype=np.int8)
+    exam_order = list(range(len(geoms)))
+    for i, roi_name in enumerate(roi_names):
+        for j in exam_order:
+            contours[i, j] = geoms[j][roi_name].HasContours()
+            if contours[i, j]:
+                exam_order.remove(j)
+                exam_order.insert(0, j)
+                break
+    is_empty = ~np.any(contours == 1, axis=1)
+
+    # Delete all deletable empty ROIs in one batch, after the scan
+    empty_roi_names = [roi_name for roi_name, empty in zip(roi_names, is_empty) if empty]
+    empty_approved_roi_names = [roi_name for roi_name in empty_roi_names if roi_name in approved_roi_names]  # Names of ROIs that could not be deleted because they are approved
+    rois = case.PatientModel.RegionsOfInterest
     with CompositeAction("Delete empty ROIs"):
-        for roi_name in roi_names:
-            if not any(ss.RoiGeometries[roi_name].HasContours() for ss in case.PatientModel.StructureSets):
-                if roi_name in approved_roi_names:
-                    empty_approved_roi_names.append(roi_name)
-                else:
-                    case.PatientModel.RegionsOfInterest[roi_name].DeleteRoi()
+        for roi_name in empty_roi_names:
+            if roi_name not in approved_roi_names:
+                rois[roi_name].DeleteRoi()
     
     # Alert user if any empty ROIs were not deleted
     if empty_approved_roi_names:
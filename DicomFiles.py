@@ -0,0 +1,28 @@
+import os
+from shutil import copyfileobj
+
+from pydicom import dcmread
+
+
+def patch_header(path, edit):
+    """Change header elements of a DICOM file without decoding or rewriting its pixel data in memory
+
+    Only the header (everything before Pixel Data) is parsed. The edited header is written to a temporary file, the remaining bytes of the original file are streamed after it unchanged, and the temporary file replaces the original.
+
+    Parameters
+    ----------
+    path: str
+        Absolute path to the DICOM file
+    edit: function
+        Function that takes the header Dataset and modifies it in place
+        E.g., `lambda dcm: setattr(dcm, "InstanceNumber", 5)`
+    """
+
+    tmp_path = "{}.tmp".format(path)
+    with open(path, "rb") as f:
+        dcm = dcmread(f, stop_before_pixels=True)  # File position is now the start of the Pixel Data element
+        edit(dcm)
+        with open(tmp_path, "wb") as out:
+            dcm.save_as(out)
+            copyfileobj(f, out)  # Pixel Data and anything after it
+    os.replace(tmp_path, path)
@@ -0,0 +1,194 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from hashlib import md5
+
+import numpy as np
+from pydicom import dcmread
+
+
+CACHE_VERSION = 1
+HEADER_TAGS = ["SOPInstanceUID", "StudyInstanceUID", "SeriesInstanceUID", "InstanceNumber", "ImagePositionPatient", "SliceThickness"]
+
+
+class SliceRecord(object):
+    """Header data for one image slice file"""
+
+    __slots__ = ("path", "sop_uid", "instance_num", "position", "thickness")
+
+    def __init__(self, path, sop_uid, instance_num, position, thickness):
+        self.path = path  # Absolute path to the DICOM file
+        self.sop_uid = sop_uid  # SOPInstanceUID
+        self.instance_num = instance_num  # InstanceNumber (int or None)
+        self.position = position  # ImagePositionPatient as a list [x, y, z] (mm)
+        self.thickness = thickness  # SliceThickness (mm, or None)
+
+    @property
+    def z(self):
+        return self.position[2]
+
+
+class SliceTable(object):
+    """The slices of one series, sorted by z-coordinate (inferior to superior)"""
+
+    def __init__(self, series_uid, study_uid, slices):
+        self.series_uid = series_uid
+        self.study_uid = study_uid
+        self.slices = sorted(slices, key=lambda s: s.z)
+        self.z = np.array([s.z for s in self.slices])
+        self._idx = {s.sop_uid: i for i, s in enumerate(self.slices)}  # SOPInstanceUID -> index in `slices`
+
+    def __len__(self):
+        return len(self.slices)
+
+    def __iter__(self):
+        return iter(self.slices)
+
+    @property
+    def bottom(self):
+        # Most inferior slice
+        return self.slices[0]
+
+    @property
+    def top(self):
+        # Most superior slice
+        return self.slices[-1]
+
+    def index(self, sop_uid):
+        # Position of the slice with the given SOPInstanceUID in `slices`
+        return self._idx[sop_uid]
+
+    def neighbors(self, sop_uid):
+        # Return a 2-tuple (slice below, slice above) of the slice with the given SOPInstanceUID
+        # Either element is None at the edge of the series
+
+        i = self._idx[sop_uid]
+        below = self.slices[i - 1] if i > 0 else None
+        above = self.slices[i + 1] if i < len(self.slices) - 1 else None
+        return below, above
+
+    @property
+    def spacing(self):
+        # Median distance (mm) between adjacent slices
+        if len(self.slices) < 2:
+            return None
+        return float(np.median(np.diff(self.z)))
+
+
+class SeriesIndex(object):
+    """Index of the image series in a folder of exported DICOM files
+
+    The folder is scanned once, reading only the headers. Files without an Image Position (Patient), such as RT Struct or RT Plan files, are ignored.
+    The header data is cached in a JSON file outside the folder (so RS does not try to import it). On the next scan of the same folder, only files whose modification time or size changed are read again.
+    A folder that is only scanned once (e.g., a temporary export folder) should not be cached: pass `cache_path=False`.
+
+    Example:
+    index = SeriesIndex(export_path)
+    ct = index[index.series_uids[0]]
+    top_slice_path = ct.top.path
+    """
+
+    def __init__(self, folder, cache_path=None):
+        # `folder`: Absolute path to the folder of DICOM files
+        # `cache_path`: Absolute path to the JSON cache file. Defaults to a file (named from a hash of the folder path) in the user's temp folder. False to not use a cache
+
+        self.folder = os.path.abspath(folder)
+        if cache_path is False:
+            cache_path = None
+        elif cache_path is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), "DicomSeriesIndex")
+            cache_path = os.path.join(cache_dir, "{}.json".format(md5(self.folder.lower().encode("utf-8")).hexdigest()))
+        self.cache_path = cache_path  # None if there is no cache
+        self.num_read = 0  # Number of files whose headers were read in the last scan (the rest came from the cache)
+        self.series = OrderedDict()  # SeriesInstanceUID -> SliceTable
+        self.scan()
+
+    def __getitem__(self, series_uid):
+        return self.series[series_uid]
+
+    def __contains__(self, series_uid):
+        return series_uid in self.series
+
+    def __iter__(self):
+        return iter(self.series.values())
+
+    @property
+    def series_uids(self):
+        return list(self.series.keys())
+
+    def _load_cache(self):
+        # Helper method that returns the cached file entries, or an empty dictionary if there is no valid cache
+        if self.cache_path is None:
+            return {}
+        try:
+            with open(self.cache_path, "r") as f:
+                cache = json.load(f)
+            if cache.get("Version") == CACHE_VERSION and cache.get("Folder") == self.folder:
+                return cache["Files"]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def _save_cache(self, files):
+        # Helper method that writes the file entries to the cache file
+        # A cache that cannot be written is not an error: the next scan just reads every file again
+        if self.cache_path is None:
+            return
+        try:
+            cache_dir = os.path.dirname(self.cache_path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(self.cache_path, "w") as f:
+                json.dump({"Version": CACHE_VERSION, "Folder": self.folder, "Files": files}, f)
+        except (IOError, OSError):
+            pass
+
+    def _read_header(self, path):
+        # Helper method that returns the cache entry for the DICOM file at `path`
+        dcm = dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+        self.num_read += 1
+        if "ImagePositionPatient" not in dcm:  # Not an image
+            return {"Series": None}
+        return {
+            "Series": dcm.SeriesInstanceUID,
+            "Study": dcm.get("StudyInstanceUID"),
+            "SOP": dcm.SOPInstanceUID,
+            "InstanceNumber": int(dcm.InstanceNumber) if dcm.get("InstanceNumber") is not None else None,
+            "Position": [float(val) for val in dcm.ImagePositionPatient],
+            "Thickness": float(dcm.SliceThickness) if dcm.get("SliceThickness") is not None else None
+        }
+
+    def scan(self):
+        """(Re)build the index from the folder, reading only files that changed since the cached scan
+
+        Returns
+        -------
+        The number of files whose headers were read
+        """
+
+        cached = self._load_cache()
+        files = {}
+        self.num_read = 0
+        for f in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, f)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entry = cached.get(f)
+            if entry is None or entry["MTime"] != stat.st_mtime or entry["Size"] != stat.st_size:
+                entry = self._read_header(path)
+                entry["MTime"], entry["Size"] = stat.st_mtime, stat.st_size
+            files[f] = entry
+        self._save_cache(files)
+
+        # Group slices by series
+        slices = OrderedDict()
+        study_uids = {}
+        for f, entry in files.items():
+            if entry["Series"] is None:
+                continue
+            slices.setdefault(entry["Series"], []).append(SliceRecord(os.path.join(self.folder, f), entry["SOP"], entry["InstanceNumber"], entry["Position"], entry["Thickness"]))
+            study_uids[entry["Series"]] = entry["Study"]
+        self.series = OrderedDict((series_uid, SliceTable(series_uid, study_uids[series_uid], series_slices)) for series_uid, series_slices in slices.items())
+        return self.num_read
@@ -0,0 +1,96 @@
+import os
+import tempfile
+from shutil import copytree, rmtree
+from time import time
+
+
+class StagingArea(object):
+    """Local temporary folder for DICOM export/import workflows
+
+    RS exports to, and imports from, the local folder, and all pydicom work happens there. Files are only copied to a network folder, in one bulk step, when a network destination is actually needed.
+    The local folder is deleted when the `with` block exits, even if the script raised an error.
+    The number of files and bytes in the folder after each stage are recorded in `stats`.
+
+    Example:
+    with StagingArea("CreateQAPlanScript") as staging:
+        qa_plan.ScriptableQADicomExport(ExportFolderPath=staging.path, ...)
+        staging.record("Export")
+        staging.transfer(r"\\\\vs19msqapp\\MOSAIQ_APP\\ESCAN\\TreatmentPlans\\DQA\\Jones, Bill Prostate DQA")
+    """
+
+    def __init__(self, name):
+        # `name`: Prefix for the temporary folder name (e.g., the script name)
+        self.name = name
+        self.path = None
+        self.stats = []  # List of dictionaries with keys "Stage", "Files", "Bytes", and "Seconds"
+        self._last_time = None
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix="{} ".format(self.name))
+        self._last_time = time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        rmtree(self.path, ignore_errors=True)
+        return False  # Do not suppress errors
+
+    def filepath(self, filename):
+        # Helper method that returns the absolute path to a file in the staging folder
+        return os.path.join(self.path, filename)
+
+    def _measure(self, folder):
+        # Helper method that returns a 2-tuple (number of files, total size in bytes) for all files in `folder`
+        num_files = num_bytes = 0
+        for dirpath, _, filenames in os.walk(folder):
+            for f in filenames:
+                num_files += 1
+                num_bytes += os.path.getsize(os.path.join(dirpath, f))
+        return num_files, num_bytes
+
+    def record(self, stage, folder=None):
+        """Record the number of files and bytes in the staging folder (or `folder`), and the time since the last recorded stage
+
+        Parameters
+        ----------
+        stage: str
+            Name of the stage that just finished (e.g., "Export")
+        folder: str
+            Absolute path to the folder to measure
+            Defaults to the staging folder
+
+        Returns
+        -------
+        The dictionary that was added to `stats`
+        """
+
+        num_files, num_bytes = self._measure(self.path if folder is None else folder)
+        now = time()
+        stat = {"Stage": stage, "Files": num_files, "Bytes": num_bytes, "Seconds": now - self._last_time}
+        self._last_time = now
+        self.stats.append(stat)
+        return stat
+
+    def transfer(self, dest):
+        """Copy the contents of the staging folder to `dest` in one bulk step
+
+        If `dest` already exists, it is replaced.
+
+        Parameters
+        ----------
+        dest: str
+            Absolute path to the destination folder (e.g., on a network share)
+
+        Returns
+        -------
+        The dictionary that was added to `stats`
+        """
+
+        if os.path.isdir(dest):
+            rmtree(dest)
+        copytree(self.path, dest)
+        return self.record("Transfer", dest)
+
+    def report(self):
+        # Helper method that returns a human-readable summary of `stats`
+        lines = ["{}: {} file(s), {:.1f} MB, {:.1f} s".format(stat["Stage"], stat["Files"], stat["Bytes"] / 1e6, stat["Seconds"]) for stat in self.stats]
+        return "\n".join(lines)
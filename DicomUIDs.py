@@ -0,0 +1,109 @@
+from uuid import uuid4
+
+
+MAX_UID_LEN = 64  # DICOM UIDs are at most 64 characters
+
+
+def uuid_uid():
+    # Helper function that returns a new UUID-derived DICOM UID (root "2.25", see DICOM PS3.5 Annex B.2)
+    # E.g., "2.25.329800735698586629295641978511506172918"
+
+    return "2.25.{}".format(uuid4().int)
+
+
+class UidAllocator(object):
+    """Hand out DICOM UIDs that are not used anywhere in a case
+
+    All study, series, and SOP instance UIDs in the case are gathered once, into sets, when the allocator is created. Every UID handed out is added to the sets, so UIDs are also unique among themselves.
+    A new UID is the template UID with its last component incremented past the largest value already used with the same prefix, so each UID is O(1) after the first for that prefix.
+    If there is no template, or the incremented UID would be too long, the new UID is UUID-derived ("2.25.x").
+
+    Example:
+    uids = UidAllocator(case)
+    new_study_id = uids.new_uid(uids.exam_uids[exam.Name]["Study"], "Study")
+    new_series_ids = uids.new_uids(10, old_series_id, "Series")
+    """
+
+    def __init__(self, case=None):
+        self.uids = {"Study": set(), "Series": set(), "SOP": set()}
+        self.all_uids = set()  # Union of all UID types
+        self.exam_uids = {}  # Exam name -> {"Study": StudyInstanceUID, "Series": SeriesInstanceUID}
+        self._next_suffix = {}  # Prefix -> next last-component value to try
+        if case is not None:
+            self.load_case(case)
+
+    def load_case(self, case):
+        # Gather the UIDs of all exams in `case`
+        # Call GetAcquisitionDataFromDicom ONCE for each exam, for speed
+
+        for exam in case.Examinations:
+            dcm = exam.GetAcquisitionDataFromDicom()
+            self.exam_uids[exam.Name] = {"Study": dcm["StudyModule"]["StudyInstanceUID"], "Series": dcm["SeriesModule"]["SeriesInstanceUID"]}
+            for uid_type, uid in self.exam_uids[exam.Name].items():
+                self.register(uid, uid_type)
+            for series in exam.Series:
+                self.register(series.ImportedDicomUID, "Series")
+                for slice_id in series.ImageStack.ImportedDicomSliceUIDs:
+                    self.register(slice_id, "SOP")
+
+    def __contains__(self, uid):
+        return uid in self.all_uids
+
+    def register(self, uid, uid_type="SOP"):
+        # Mark `uid` as used
+        # `uid_type`: "Study", "Series", or "SOP"
+
+        if uid is None:
+            return
+        self.uids[uid_type].add(uid)
+        self.all_uids.add(uid)
+
+        # Keep the per-prefix counter ahead of registered UIDs
+        prefix, suffix = self._split(uid)
+        if prefix in self._next_suffix and suffix is not None and suffix >= self._next_suffix[prefix]:
+            self._next_suffix[prefix] = suffix + 1
+
+    def _split(self, uid):
+        # Helper method that returns a 2-tuple (prefix, last component as an int) of `uid`
+        # If the last component is not an integer, the second element is None
+
+        dot_idx = uid.rfind(".")
+        try:
+            return uid[:dot_idx], int(uid[(dot_idx + 1):])
+        except ValueError:
+            return uid[:dot_idx], None
+
+    def new_uid(self, template=None, uid_type="SOP"):
+        """Return a new UID that is not used in the case, and mark it as used
+
+        Parameters
+        ----------
+        template: str
+            UID whose last component is incremented to get the new UID
+            If None, generate a UUID-derived UID
+            Defaults to None
+        uid_type: str
+            "Study", "Series", or "SOP"
+            Defaults to "SOP"
+        """
+
+        uid = None
+        if template is not None:
+            prefix, suffix = self._split(template)
+            if suffix is not None:
+                if prefix not in self._next_suffix:  # First UID with this prefix: one scan for the largest used suffix
+                    used = [s for p, s in (self._split(u) for u in self.all_uids) if p == prefix and s is not None]
+                    self._next_suffix[prefix] = max(used + [suffix]) + 1
+                uid = "{}.{}".format(prefix, self._next_suffix[prefix])
+                if len(uid) > MAX_UID_LEN:
+                    uid = None
+        if uid is None:
+            uid = uuid_uid()
+            while uid in self.all_uids:
+                uid = uuid_uid()
+        self.register(uid, uid_type)
+        return uid
+
+    def new_uids(self, n, template=None, uid_type="SOP"):
+        # Return a list of `n` new UIDs (see `new_uid`)
+        return [self.new_uid(template, uid_type) for _ in range(n)]
@@ -1,62 +1,45 @@
 import clr
 clr.AddReference("System.Windows.Forms")
 from math import ceil
-from os import listdir, makedirs, write
-from os.path import isdir
-from shutil import copy2, rmtree
 import sys
 sys.path.append(r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\RayStation")
 
 from connect import *
-from datetime import datetime
 from pydicom import dcmread
 from System.Windows.Forms import *
 
+from DicomFiles import patch_header
+from DicomSeriesIndex import SeriesIndex
+from DicomStaging import StagingArea
+from DicomUIDs import UidAllocator
+from UniqueNames import name_item
+
 
 case = None
 
 
-def compute_new_ids(exam):
-    # Helper function that creates a unique DICOM StudyInstanceUID and SeriesInstanceUID for an examination
-    # Return a 2-tuple of (new StudyInstanceUID, new SeriesInstanceUID)
-    
-    dcm = exam.GetAcquisitionDataFromDicom()
-    new_ids = []
-    for id_type in ["Study", "Series"]:
-        module_key = "{}Module".format(id_type)
-        id_key = "{}InstanceUID".format(id_type)
-        all_ids = [e.GetAcquisitionDataFromDicom()[module_key][id_key] for e in case.Examinations]
-        new_id = dcm[module_key][id_key]
-        while new_id in all_ids:
-            dot_idx = new_id.rfind(".")
-            new_id = "{}.{}".format(new_id[:dot_idx], int(new_id[(dot_idx + 1):]) + 1)
-        new_ids.append(new_id)
-    return new_ids
-
-
-def copy_dicom_files(export_path, exam, dist, sup=True):
-    # Helper function that copies the inferior or superior slice's DICOM file at `export_path` according to the expansion (`dist`) needed
+def copy_dicom_files(export_path, slices, dist, uid_alloc, sup=True, instance_num_offset=0, uids=None):
+    # Helper function that synthesizes copies of the inferior or superior slice's DICOM file at `export_path` according to the expansion (`dist`) needed
     # `export_path`: Absolute path to the exported DICOM files for this run of the script
-    # `exam`: The examination to be extended
+    # `slices`: SliceTable (from a SeriesIndex of `export_path`) of the exported exam
     # `dist`: The distance to extend (cm)
+    # `uid_alloc`: UidAllocator that hands out the new slices' SOP Instance UIDs, so they are unique in the case and in the export folder
     # `sup`: True if exam should be extended in superior direction, False for inferior
-    # Set SOP Instance UID (also use for filename), Slice Location, z-coordinate of Image Position (Patient), and Instance Number in the copied slice DICOM files
-    # Return the distance by which the exam was expanded
+    # `instance_num_offset`: Number of slices already added below the original slices (only used for `sup`)
+    # `uids`: Dictionary of DICOM keyword -> value to set in every new slice (e.g., new StudyInstanceUID and SeriesInstanceUID)
+    # The edge slice is read once. Each new slice is the same dataset with a new SOP Instance UID (also used for filename), Slice Location, z-coordinate of Image Position (Patient), and Instance Number, written exactly once
+    # Return the number of slices added
 
-    # Info for computing slice UIDs for new filenames
-    # In RS, slices are ordered superior to inferior, smallest ID to largest
-    if sup:
-        slice_id = exam.Series[0].ImageStack.ImportedDicomSliceUIDs[-1]  # E.g., "1.2.840.113704.1.111.2528.1583439123.410"
-    else:  # Inf
-        slice_id = list(exam.Series[0].ImageStack.ImportedDicomSliceUIDs)[0]
-    
-    # Split slice ID into first part (used for all new slice IDs) and second part (incremented/decremented for each new slice ID)
-    dot_idx = slice_id.rfind(".")
-    part_1, part_2 = slice_id[:dot_idx], int(slice_id[(dot_idx + 1):])
+    # New slice UIDs (and filenames) are allocated from the edge slice's UID (e.g., "1.2.840.113704.1.111.2528.1583439123.410")
+    edge_slice = slices.top if sup else slices.bottom
+    for s in slices:  # Exported UIDs are normally in the case already, but make sure
+        uid_alloc.register(s.sop_uid, "SOP")
 
     # Get DICOM data for top (for sup) or bottom (for inf) slice
-    dcm_filepath = r"{}\CT{}.dcm".format(export_path, slice_id)
-    dcm = dcmread(dcm_filepath)
+    dcm = dcmread(edge_slice.path)
+    if uids is not None:
+        for keyword, val in uids.items():
+            setattr(dcm, keyword, val)
 
     # Slice data
     slice_thickness = dcm.SliceThickness
@@ -65,45 +48,31 @@ def copy_dicom_files(export_path, exam, dist, sup=True):
 
     # `copy_instance_num` = InstanceNumber for next slice
     if sup:
-        copy_instance_num = len(listdir(export_path))  # We will increment the largest slice ID (see above)
+        copy_instance_num = instance_num_offset + len(slices)  # Instance numbers continue after the top slice
     else:
-        copy_instance_num = num_copies + 1  # We will decrement the smallest slice ID (see above)
+        copy_instance_num = num_copies + 1  # Instance numbers count down to 1 below the bottom slice
 
     # Make `num_copies` copies of top slice
     for _ in range(num_copies):
         if sup:
-            part_2 += 1  # Last part of slice UID (filename) is 1 more than previous slice (filename)
             copy_instance_num += 1
             slice_loc += slice_thickness
         else:
-            part_2 -= 1  # Last part of slice UID (filename) is 1 less than previous slice (filename)
             copy_instance_num -= 1
             slice_loc -= slice_thickness
 
-        # Copy DICOM file to appropriate new filename
-        instance_id = "{}.{}".format(part_1, part_2)
-        copy_dcm_filepath = r"{}\CT{}.dcm".format(export_path, instance_id) 
-        copy2(dcm_filepath, copy_dcm_filepath)
-
-        # Change instance data in new slice
-        copy_dcm = dcmread(copy_dcm_filepath)
-        copy_dcm.SOPInstanceUID = instance_id
-        copy_dcm.SliceLocation = slice_loc
-        copy_dcm.ImagePositionPatient[2] = slice_loc
-        copy_dcm.InstanceNumber = copy_instance_num
-
-        # Overwrite copied DICOM file
-        copy_dcm.save_as(copy_dcm_filepath)
-
-    # Renumber the old instances if we added slices to the beginning
-    if not sup:
-        copy_instance_num = num_copies + 1
-        for f in listdir(export_path)[num_copies:]:  # Ignore the copies, as they already have the correct instance number
-            f = r"{}\{}".format(export_path, f)
-            dcm = dcmread(f)
-            dcm.InstanceNumber = copy_instance_num
-            dcm.save_as(f)
-            copy_instance_num += 1
+        # Change instance data in the in-memory slice
+        instance_id = uid_alloc.new_uid(edge_slice.sop_uid, "SOP")
+        dcm.SOPInstanceUID = instance_id
+        dcm.file_meta.MediaStorageSOPInstanceUID = instance_id
+        dcm.SliceLocation = slice_loc
+        dcm.ImagePositionPatient[2] = slice_loc
+        dcm.InstanceNumber = copy_instance_num
+
+        # Write new DICOM file with the appropriate filename
+        dcm.save_as(r"{}\CT{}.dcm".format(export_path, instance_id))
+
+    return num_copies
 
 
 def get_tx_technique(bs):
@@ -130,21 +99,6 @@ def get_tx_technique(bs):
                 return "ApplicatorAndCutout"
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
 def extend_5_cm():
     """Extend the current exam so that the target is at least 5 cm from the superior and inferior edges of the exam
 
@@ -204,45 +158,59 @@ def extend_5_cm():
     sup_dist = abs(img_sup - target_sup)
 
     if inf_dist < 5 or sup_dist < 5:  # Target is < 5 cm from top or bottom of exam
-        # Create export directory
-        base_path = r"\\vs20filesvr01\groups\CANCER\Physics\Temp\Extend2CmScript"
-        export_path = r"{}\{}".format(base_path, datetime.now().strftime("%m-%d-%Y %H_%M_%S"))
-        makedirs(export_path)
-        
-        # Export exam
-        # Note that we could also export the structure set, 
-        # but there is no way to access a structure set's UID from RS, 
-        # and exporting every structure set so we could get the UID from the DICOM would unnecessary slow down the script.
-        # Instead, after importing the new exam (later), we simply copy all ROI and POI geometries from the old exam to the new exam
-        patient.Save()  # Error if you attempt to export when there are unsaved modifications
-        try:
-            case.ScriptableDicomExport(ExportFolderPath=export_path, Examinations=[exam.Name], IgnorePreConditionWarnings=False)
-        except:
-            case.ScriptableDicomExport(ExportFolderPath=export_path, Examinations=[exam.Name], IgnorePreConditionWarnings=True)
-
-        # Compute new study and series IDs so RS doesn't think the new exam is the same as the old
-        study_id, series_id = compute_new_ids(exam)
-
-        # Add slices to top, if necessary
-        if sup_dist < 5:
-            copy_dicom_files(export_path, exam, sup_dist)
-        
-        # Add slices to top, if necessary
-        if inf_dist < 5:
-            copy_dicom_files(export_path, exam, inf_dist, False)
-
-        # Change study and series UIDs in all files so RS doesn't think the new exam is the same as the old
-        for f in listdir(export_path):
-            f = r"{}\{}".format(export_path, f)  # Absolute path
-            dcm = dcmread(f)
-            dcm.StudyInstanceUID = study_id
-            dcm.SeriesInstanceUID = series_id
-            dcm.save_as(f)
-
-        # Import new exam
-        study = patient_db.QueryStudiesFromPath(Path=export_path, SearchCriterias={"PatientID": patient.PatientID})[0]  # There is only one study in the directory
-        series = patient_db.QuerySeriesFromPath(Path=export_path, SearchCriterias=study)  # Series belonging to the study
-        patient.ImportDataFromPath(Path=export_path, CaseName=case.CaseName, SeriesOrInstances=series)
+        # Export to a local staging folder that is deleted automatically once the new exam is imported
+        with StagingArea("Extend5CmScript") as staging:
+            export_path = staging.path
+
+            # Export exam
+            # Note that we could also export the structure set, 
+            # but there is no way to access a structure set's UID from RS, 
+            # and exporting every structure set so we could get the UID from the DICOM would unnecessary slow down the script.
+            # Instead, after importing the new exam (later), we simply copy all ROI and POI geometries from the old exam to the new exam
+            patient.Save()  # Error if you attempt to export when there are unsaved modifications
+            try:
+                case.ScriptableDicomExport(ExportFolderPath=export_path, Examinations=[exam.Name], IgnorePreConditionWarnings=False)
+            except:
+                case.ScriptableDicomExport(ExportFolderPath=export_path, Examinations=[exam.Name], IgnorePreConditionWarnings=True)
+            staging.record("Export")
+
+            # Compute new study and series IDs so RS doesn't think the new exam is the same as the old
+            uid_alloc = UidAllocator(case)
+            study_id = uid_alloc.new_uid(uid_alloc.exam_uids[exam.Name]["Study"], "Study")
+            series_id = uid_alloc.new_uid(uid_alloc.exam_uids[exam.Name]["Series"], "Series")
+            uids = {"StudyInstanceUID": study_id, "SeriesInstanceUID": series_id}
+            index = SeriesIndex(export_path, cache_path=False)  # Headers only. No cache, since the export folder is temporary
+            slices = index[index.series_uids[0]]  # There is only one series in the directory
+            orig_files = [s.path for s in slices]
+
+            # Add slices to bottom, if necessary
+            num_inf_copies = 0
+            if inf_dist < 5:
+                num_inf_copies = copy_dicom_files(export_path, slices, inf_dist, uid_alloc, False, uids=uids)
+
+            # Add slices to top, if necessary
+            if sup_dist < 5:
+                copy_dicom_files(export_path, slices, sup_dist, uid_alloc, instance_num_offset=num_inf_copies, uids=uids)
+
+            # Change study and series UIDs in the original files so RS doesn't think the new exam is the same as the old
+            # Renumber the original instances if we added slices to the beginning
+            # Only the headers are rewritten
+            def edit(dcm):
+                dcm.StudyInstanceUID = study_id
+                dcm.SeriesInstanceUID = series_id
+                if num_inf_copies:
+                    dcm.InstanceNumber = int(dcm.InstanceNumber) + num_inf_copies
+
+            for f in orig_files:
+                patch_header(f, edit)
+            staging.record("Extend")
+
+            # Import new exam
+            study = patient_db.QueryStudiesFromPath(Path=export_path, SearchCriterias={"PatientID": patient.PatientID})[0]  # There is only one study in the directory
+            series = patient_db.QuerySeriesFromPath(Path=export_path, SearchCriterias=study)  # Series belonging to the study
+            patient.ImportDataFromPath(Path=export_path, CaseName=case.CaseName, SeriesOrInstances=series)
+            staging.record("Import")
+            print(staging.report())
         
         # Select new exam
         new_exam = [e for e in case.Examinations if e.Series[0].ImportedDicomUID == series_id][0]
@@ -277,8 +245,5 @@ def extend_5_cm():
             if abs(poi.Point.x) < 1000:  # Empty POI geometry if infinite coordinates
                 case.PatientModel.StructureSets[new_exam.Name].PoiGeometries[i].Point = poi.Point
 
-        # Delete the temporary directory and all its contents
-        rmtree(export_path)
-
     else:
         MessageBox.Show("The target ('{}') is at least 5 cm from the inferior and superior edges of the planning exam. No action is necessary.".format(target.OfRoi.Name), "Exam OK")
@@ -0,0 +1,117 @@
+"""Bounding boxes of geometries, images, and dose grids as NumPy arrays
+
+A box is a 2 x 3 array: the low corner and the high corner, in RS patient coordinates (x, y, z), in cm.
+The bounds of n geometries are an n x 2 x 3 array, so unions, containment checks, and dose grid sizes are single vectorized operations instead of per-ROI dictionary folds.
+
+Example (dose grid that covers the image and every geometry on the exam):
+_, bounds = geometry_bounds(case.PatientModel.StructureSets[exam.Name])
+box = union_box(bounds[finite(bounds)], point_bounds(exam.Series[0].ImageStack.GetBoundingBox()))
+corner, num_voxels = grid_extents(box, plan.GetDoseGrid().VoxelSize)
+"""
+
+import numpy as np
+
+
+MAX_COORD = 1000  # Larger coordinates (cm) are treated as infinite. Nothing will ever be over 1000...
+
+
+def to_array(point):
+    # Helper function that converts an RS point (e.g., {"x": 1, "y": 2, "z": 3}) to a length-3 array
+    return np.array([point.x, point.y, point.z], dtype=float)
+
+
+def to_point(arr):
+    # Helper function that converts a length-3 array to an RS point dictionary
+    return {"x": float(arr[0]), "y": float(arr[1]), "z": float(arr[2])}
+
+
+def point_bounds(bounds):
+    # Helper function that converts an RS bounding box (list of the min and max points, as returned by `GetBoundingBox`) to a 2 x 3 array
+    return np.array([to_array(bounds[0]), to_array(bounds[1])])
+
+
+def geometry_bounds(struct_set, roi_names=None):
+    """Return the bounding boxes of geometries on a structure set, in one pass
+
+    Parameters
+    ----------
+    struct_set: ScriptObject
+        The structure set
+    roi_names: List[str]
+        Names of the geometries to include. Each must have contours.
+        If None, include every geometry with contours.
+
+    Returns
+    -------
+    Tuple: the ROI names, and an n x 2 x 3 array of their bounding boxes
+    """
+
+    names, bounds = [], []
+    if roi_names is None:
+        for geom in struct_set.RoiGeometries:
+            if geom.HasContours():
+                names.append(geom.OfRoi.Name)
+                bounds.append(point_bounds(geom.GetBoundingBox()))
+    else:
+        geoms = struct_set.RoiGeometries
+        for roi_name in roi_names:
+            names.append(roi_name)
+            bounds.append(point_bounds(geoms[roi_name].GetBoundingBox()))
+    return names, np.array(bounds).reshape(-1, 2, 3)
+
+
+def finite(bounds):
+    # Helper function that returns a boolean mask of the boxes in the n x 2 x 3 array `bounds` with no infinite (or huge) coordinates
+    return (np.isfinite(bounds) & (np.abs(bounds) <= MAX_COORD)).all(axis=(1, 2))
+
+
+def union_box(bounds, *boxes):
+    """Return the smallest box that contains all the given boxes
+
+    Parameters
+    ----------
+    bounds: numpy.ndarray
+        n x 2 x 3 array of boxes. May be empty.
+    Other arguments are 2 x 3 boxes to include
+
+    Returns
+    -------
+    2 x 3 array
+    """
+
+    boxes = np.concatenate([np.asarray(bounds, dtype=float).reshape(-1, 2, 3)] + [np.asarray(box, dtype=float).reshape(1, 2, 3) for box in boxes])
+    return np.array([boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)])
+
+
+def outside(bounds, box):
+    # Helper function that returns a boolean mask of the boxes in `bounds` (an n x 2 x 3 array, or a single 2 x 3 box) that extend outside the 2 x 3 `box`
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 2, 3)
+    return ((bounds[:, 0] < box[0]) | (bounds[:, 1] > box[1])).any(axis=1)
+
+
+def grid_box(dg):
+    # Helper function that returns the 2 x 3 box covered by a dose grid (the corner is the low corner)
+    corner = to_array(dg.Corner)
+    return np.array([corner, corner + to_array(dg.NrVoxels) * to_array(dg.VoxelSize)])
+
+
+def grid_extents(box, voxel_size):
+    """Return the dose grid corner and number of voxels that cover a box
+
+    The corner is the box's low corner. The number of voxels along each axis is rounded up, so the grid covers the whole box.
+
+    Parameters
+    ----------
+    box: numpy.ndarray
+        2 x 3 box
+    voxel_size: dict
+        Voxel size along each axis (e.g., the VoxelSize of an RS dose grid)
+
+    Returns
+    -------
+    Tuple: the corner and the number of voxels, as RS point dictionaries (for, e.g., `UpdateDoseGrid`)
+    """
+
+    sizes = to_array(voxel_size)
+    num_voxels = np.ceil((box[1] - box[0]) / sizes - 1e-6).astype(int)  # Tolerance so that floating point error does not add a voxel
+    return to_point(box[0]), dict(zip("xyz", (int(n) for n in num_voxels)))
@@ -5,11 +5,10 @@ clr.AddReference("System.Windows.Forms")
 
 import os
 import re
-import shutil
 import sys
+from collections import OrderedDict
 sys.path.append(r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\RayStation")
 
-import pydicom  # Read/write/manipulate DICOM data
 from connect import *  # Interact w/ RS
 
 # For GUI
@@ -17,88 +16,18 @@ from System.Drawing import *
 from System.Windows.Forms import *
 
 from CopyPlanToCTOrMergeBeamSetsForm import copy_plan_to_ct_or_merge_beam_sets
+from DicomFiles import patch_header
+from DicomSeriesIndex import SeriesIndex
+from DicomStaging import StagingArea
+from DicomUIDs import UidAllocator
 from PrepareExamsScript import prepare_exams
+from SliceGeometry import analyze_series, get_exam_z_positions
+from UniqueNames import name_item
 
 
 case = None  # Global so multiple functions can easily access it
 
 
-class FixMobiusSliceSpacingErrorForm(Form):
-    """Form that gets a non-negative floating point value from the user
-
-    Show user an example of where to find the value to enter
-    Submit button is disabled if text field value is invalid
-    """
-
-    def __init__(self):
-        # Set up Form
-        self.AutoSize = True
-        self.AutoSizeMode = AutoSizeMode.GrowAndShrink  # Adapt form size to controls
-        self.FormBorderStyle = FormBorderStyle.FixedToolWindow  # User cannot resize form
-        self.StartPosition = FormStartPosition.CenterScreen  # Start form in middle of screen
-        self.Text = "Fix Mobius Slice Spacing Error"
-        self.MinimumSize = Size(TextRenderer.MeasureText(self.Text, SystemFonts.CaptionFont).Width + 100, 0)
-
-        self.float = ""  # The value
-        x = y = 15
-
-        # Instructions for user
-        instrs = Label()
-        instrs.AutoSize = True
-        instrs.AutoSizeMode = AutoSizeMode.GrowAndShrink
-        instrs.Location = Point(x, y)
-        instrs.Text = "Enter the value that caused the error. In the below screenshot, this value is 405.5."
-        instrs_width = TextRenderer.MeasureText(instrs.Text, instrs.Font).Width
-        instrs.MinimumSize = Size(instrs_width, 0)
-
-        # Screenshot example of where to find the value in Mobius
-        pb = PictureBox()
-        pb.AutoSize = True
-        pb.Image = Image.FromFile(r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Images\FixMobiusSliceSpacingErrorImage.png")
-        y = instrs.Location.Y + instrs.Height
-        pb.Location = Point(x, y)
-
-        # Prompt for value
-        val_lbl = Label()
-        val_lbl.AutoSize = True
-        val_lbl.AutoSizeMode = AutoSizeMode.GrowAndShrink
-        y = pb.Location.Y + pb.Height + 80
-        val_lbl.Location = Point(x, y)
-        val_lbl_width = TextRenderer.MeasureText(val_lbl.Text, val_lbl.Font).Width
-        val_lbl.Text = "Value:"
-
-        # Input field for value
-        self.tb = TextBox()
-        self.tb.TextChanged += self.set_submit_enabled
-        x = val_lbl.Location.X + val_lbl_width + 40
-        self.tb.Location = Point(x, y)
-
-        # Submit button
-        self.submit_btn = Button()
-        self.submit_btn.AutoSize = True
-        self.submit_btn.AutoSizeMode = AutoSizeMode.GrowAndShrink
-        self.submit_btn.Click += self.submit_clicked
-        self.submit_btn.Enabled = False
-        x = val_lbl.Location.X
-        y = self.tb.Location.Y + self.tb.Height + 15
-        self.submit_btn.Location = Point(x, y)
-        self.submit_btn.Text = "Submit"
-        self.AcceptButton = self.submit_btn
-
-        self.Controls.AddRange([instrs, pb, val_lbl, self.tb, self.submit_btn])
-        self.ShowDialog()  # Display Form
-
-    def set_submit_enabled(self, sender, event):
-        try:
-            self.float = float(self.tb.Text)
-            self.submit_btn.Enabled = True
-        except:
-            self.submit_btn.Enabled = False
-
-    def submit_clicked(self, sender, event):
-        self.DialogResult = DialogResult.OK
-
-
 class ChooseGatedGroupForm(Form):
     def __init__(self, grps):
         # Set up Form
@@ -161,18 +90,6 @@ def compute_new_id(study_or_series):
         new_id = "{}{}".format(new_id[:(dot_idx + 1)], int(new_id[(dot_idx + 1):]) + 1)
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    print(max_len)
-    copy_num = 0
-    old_item = item
-    while item in l:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-        print(item)
-    return item[:max_len]
-
-
 def fix_mobius_slice_spacing_error():
     """Create a new plan that does not give a slice spacing error in Mobius
 
@@ -181,8 +98,8 @@ def fix_mobius_slice_spacing_error():
 
     Assume planning exam is an average of gated images and that Rx is dose to volume
 
-    Get problem slice location from a user GUI
-    Export images, remove problematic slices, re-import, create new AVG, and copy plan (including Rx and Clinical Goals) onto new AVG
+    Detect the non-uniform slice spacing in each gated image stack (no user input needed)
+    Export images, remove the fewest slices that make the spacing uniform, re-import, create new AVG, and copy plan (including Rx and Clinical Goals) onto new AVG
     The external copy function performs a dummy optimization to create control points. Optimization settings are not copied to the new plan
     The user must export the new plan to Mobius
     """
@@ -209,72 +126,69 @@ def fix_mobius_slice_spacing_error():
     struct_set = plan.GetStructureSet()
     planning_exam = struct_set.OnExamination
 
-    # Get offending slice location from user
-    form = FixMobiusSliceSpacingErrorForm()
-    if form.DialogResult != DialogResult.OK:
-        sys.exit()  # User exited Form
-    slice_loc = form.float
-
-    # Create export folder
-    folder = r"\\vs20filesvr01\groups\CANCER\Physics\Temp\FixMobiusSliceSpacingErrorScript"
-    # Delete folder if it already exists
-    if os.path.isdir(folder):
-        shutil.rmtree(folder)
-    os.mkdir(folder)
-
     # Select gated images only
     gated_grps = [grp for grp in case.ExaminationGroups if grp.Type == "Collection4dct" and grp.Items[0].Examination.EquipmentInfo.FrameOfReference == planning_exam.EquipmentInfo.FrameOfReference]  # 4DCT group in same FoR as planning exam
     if not gated_grps:
         MessageBox.Show("There is no 4DCT gated group in the same FoR as the planning exam. Click OK to abort the script.")
         sys.exit(1)
     elif len(gated_grps) == 1:
-        grp = grps[0]
+        grp = gated_grps[0]
     else:  # Found multiple gated groups, so user chooses the correct one from a GUI
         form = ChooseGatedGroupForm(gated_grps)
+        form.ShowDialog()
         if form.DialogResult != DialogResult.OK:
             sys.exit()
         grp = case.ExaminationGroups[form.grp]
-    gated = [item.Examination.Name for item in grp]
+    gated_exams = [item.Examination for item in grp.Items]
+    gated = [exam.Name for exam in gated_exams]
 
-    # Export gated images
-    patient.Save()  # Must save changes before export
-    try:
-        case.ScriptableDicomExport(ExportFolderPath=folder, Examinations=gated, IgnorePreConditionWarnings=False)
-    except SystemError as e:
-        res = MessageBox.Show("The script generated the following warning(s): {}. Continue?".format(e), "Warnings", MessageBoxButtons.YesNo)
-        if res == DialogResult.No:
-            sys.exit(1)
-        case.ScriptableDicomExport(ExportFolderPath=folder, Examinations=gated, IgnorePreConditionWarnings=True)
-
-    # Compute new series IDs
-    all_series_ids = [exam.Series[0].ImportedDicomUID for exam in case.Examinations]
-    ids = {}
-    for exam in gated:
-        old_series_id = new_series_id = exam.Series[0].ImportedDicomUID
-        dot_idx = new_series_id.rfind(".")
-        first_part = new_series_id[:dot_idx]
-        second_part = int(new_series_id[(dot_idx + 1):])
-        while new_series_id in all_series_ids:
-            second_part += 1
-            new_series_id = "{}.{}".format(first_part, second_part)
-        ids[old_series_id] = (new_series_id, exam.Name)
-    
-    # Delete all slices up to and including the offending slice
-    # Change Series Instance UID and Series Instance UID so RayStation doesn't think these are the same images. 
-    for f in os.listdir(folder):
-        path = os.path.join(folder, f)  # Make absolute path to DICOM file
-        dcm = pydicom.dcmread(path)
-        slice_loc_dcm = float(dcm.ImagePositionPatient[2])
-        if slice_loc_dcm >= slice_loc:  # Delete file if it is in the problematic region
-            os.remove(path)
-        else:
-            dcm.SeriesInstanceUID = ids[dcm.SeriesInstanceUID]
-            dcm.save_as(path)  # Overwrite original DICOM file
-    
-    # Import images w/o bad slices
-    study_id = planning_exam.GetAcquisitionDataFromDicom()["StudyModule"]["StudyInstanceUID"]
-    series = patient_db.QuerySeriesFromPath(Path=folder, SearchCriterias={"PatientID": patient.PatientID, "StudyInstanceUID": study_id})
-    patient.ImportDataFromPath(Path=folder, SeriesOrInstances=series, CaseName=case.CaseName)
+    # Check slice spacing of all phases at once, from the image stacks already in RS
+    spacing = analyze_series(OrderedDict((exam.Name, get_exam_z_positions(exam)) for exam in gated_exams))
+    if not any(res["Errors"] for res in spacing.values()):
+        MessageBox.Show("The gated images in group '{}' have uniform slice spacing, so Mobius should not give a slice spacing error. Click OK to abort the script.".format(grp.Name), "No Slice Spacing Error")
+        sys.exit()
+
+    # Export to a local staging folder that is deleted automatically once the new images are imported
+    with StagingArea("FixMobiusSliceSpacingErrorScript") as staging:
+        folder = staging.path
+
+        # Export gated images
+        patient.Save()  # Must save changes before export
+        try:
+            case.ScriptableDicomExport(ExportFolderPath=folder, Examinations=gated, IgnorePreConditionWarnings=False)
+        except SystemError as e:
+            res = MessageBox.Show("The script generated the following warning(s): {}. Continue?".format(e), "Warnings", MessageBoxButtons.YesNo)
+            if res == DialogResult.No:
+                sys.exit(1)
+            case.ScriptableDicomExport(ExportFolderPath=folder, Examinations=gated, IgnorePreConditionWarnings=True)
+        staging.record("Export")
+
+        # Compute new series IDs
+        uid_alloc = UidAllocator(case)
+        ids = {}
+        for exam in gated_exams:
+            old_series_id = exam.Series[0].ImportedDicomUID
+            ids[old_series_id] = uid_alloc.new_uid(old_series_id, "Series")
+
+        # Delete the fewest slices that make the slice spacing uniform, computed from the exported headers
+        # Change Series Instance UID so RayStation doesn't think these are the same images
+        index = SeriesIndex(folder, cache_path=False)  # Headers only. No cache, since the export folder is temporary
+        spacing = analyze_series(OrderedDict((slices.series_uid, slices.z) for slices in index))
+        for slices in index:
+            drop = set(spacing[slices.series_uid]["Drop"])
+            for i, s in enumerate(slices):
+                if i in drop:  # Delete file if it is in the problematic region
+                    os.remove(s.path)
+                else:  # Only the header is rewritten
+                    patch_header(s.path, lambda dcm: setattr(dcm, "SeriesInstanceUID", ids[slices.series_uid]))
+        staging.record("Remove slices")
+
+        # Import images w/o bad slices
+        study_id = planning_exam.GetAcquisitionDataFromDicom()["StudyModule"]["StudyInstanceUID"]
+        series = patient_db.QuerySeriesFromPath(Path=folder, SearchCriterias={"PatientID": patient.PatientID, "StudyInstanceUID": study_id})
+        patient.ImportDataFromPath(Path=folder, SeriesOrInstances=series, CaseName=case.CaseName)
+        staging.record("Import")
+        print(staging.report())
 
     # Rename imported exam
     avg_name = prepare_exams(study_id)
@@ -292,7 +206,7 @@ def fix_mobius_slice_spacing_error():
             new_plan.GetStructureSet().PoiGeometries[poi_geom.OfPoi.Name].Point = poi_geom.Point
 
     # Crop ROI geometries to FOV
-    fov_name = name_item("Field-Of-View", roi_names)
+    fov_name = name_item("Field-Of-View", [r.Name for r in case.PatientModel.RegionsOfInterest], 16)
     fov = case.PatientModel.CreateRoi(Name=fov_name, Type="FieldOfView")
     fov.CreateFieldOfViewROI(ExaminationName=new_exam.Name)
     for geom_name in geom_names:  # Intersect FOV and each geometry on exam, if possible
@@ -308,5 +222,3 @@ def fix_mobius_slice_spacing_error():
     for i, bs in enumerate(new_plan.BeamSets):
         bs.ComputeDose(ComputeBeamDoses=True, DoseAlgorithm=plan.BeamSets[i].AccurateDoseAlgorithm.DoseAlgorithm)
 
-    # Delete temp folder
-    shutil.rmtree(folder)
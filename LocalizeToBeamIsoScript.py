@@ -8,6 +8,8 @@ from connect import *
 from System.Drawing import *
 from System.Windows.Forms import *
 
+from UniqueNames import name_item
+
 
 class ChooseBeamForm(Form):
     # Helper class that allows user to choose which beam's isocenter to localize to
@@ -54,20 +56,6 @@ class ChooseBeamForm(Form):
         self.DialogResult = DialogResult.OK
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l`
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    copy_num = 0
-    old_item = item
-    while item in l:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
 def same_coords(point_1, point_2):
     # Helper function that returns whether the given points (dictionaries or ExpandoObjects) have the same coordinates
 
@@ -0,0 +1,92 @@
+class OptFunctionSchema(object):
+    """Parameters of one type of optimization function (objective or constraint)
+
+    The attributes of a function's DoseFunctionParameters depend only on its type. So they are worked out (including one `dir` call) the first time a type is seen, and then reused for every function of that type. See `function_schema`.
+    """
+
+    __slots__ = ("function_type", "param_names", "dose_param_names")
+
+    def __init__(self, function_type, param_names, dose_param_names):
+        self.function_type = function_type  # FunctionType argument to AddOptimizationFunction (e.g., "TargetEud" for a "UniformEud" function)
+        self.param_names = param_names  # DoseFunctionParameters attributes to copy, besides Weight (e.g., ["DoseLevel", "PercentVolume"])
+        self.dose_param_names = dose_param_names  # DoseFunctionParameters attributes that are dose values (e.g., ["HighDoseLevel", "LowDoseLevel"]), for scaling
+
+
+_schemas = {}  # Function type key -> OptFunctionSchema
+
+ADD_FUNCTION_ARG_NAMES = ("FunctionType", "RoiName", "IsConstraint", "IsRobust", "RestrictAllBeamsIndividually", "RestrictToBeam", "RestrictToBeamSet")  # Arguments in `get_opt_func_args` output that are for AddOptimizationFunction, not DoseFunctionParameters
+
+
+def _function_key(dfp):
+    # Helper function that returns the type of a function from its DoseFunctionParameters, with as few reads as possible
+    # Dose falloff functions and uniformity constraints do not have a FunctionType attribute
+    function_type = getattr(dfp, "FunctionType", None)
+    if function_type is not None:
+        return function_type
+    if hasattr(dfp, "HighDoseLevel"):
+        return "DoseFallOff"
+    if hasattr(dfp, "PercentStdDeviation"):
+        return "UniformityConstraint"
+    return None
+
+
+def function_schema(dfp):
+    """Return the OptFunctionSchema for the type of an optimization function
+
+    Parameters
+    ----------
+    dfp: ScriptObject
+        The function's DoseFunctionParameters
+
+    Returns
+    -------
+    The OptFunctionSchema, or None if the function type is not recognized
+    """
+
+    key = _function_key(dfp)
+    if key is None:
+        return None
+    if key not in _schemas:
+        # Parameters to copy are from the RS 8B Scripting Guideline
+        if key == "DoseFallOff":
+            param_names = ["HighDoseLevel", "LowDoseLevel", "LowDoseDistance"]
+        elif key == "UniformityConstraint":
+            param_names = ["PercentStdDeviation"]
+        else:
+            param_names = ["DoseLevel"]
+            if "Eud" in key:
+                param_names.append("EudParameterA")
+            elif "Dvh" in key:
+                param_names.append("PercentVolume")
+        dose_param_names = [] if key == "UniformityConstraint" else [attr for attr in dir(dfp) if "DoseLevel" in attr]  # The only reflective pass for this type
+        _schemas[key] = OptFunctionSchema("TargetEud" if key == "UniformEud" else key, param_names, dose_param_names)
+    return _schemas[key]
+
+
+def get_opt_func_args(opt_func):
+    # Helper function that returns a dictionary of arguments to pass into AddOptimizationFunction function
+    # Used for copying objectives and contraints
+
+    dfp = opt_func.DoseFunctionParameters
+    args = {}
+    args["RoiName"] = opt_func.ForRegionOfInterest.Name
+    args["IsRobust"] = opt_func.UseRobustness
+    args["Weight"] = dfp.Weight
+    schema = function_schema(dfp)
+    if schema is not None:
+        args["FunctionType"] = schema.function_type
+        for param_name in schema.param_names:
+            args[param_name] = getattr(dfp, param_name)
+    return args
+
+
+def set_opt_func_args(opt_func, args):
+    # Helper function that sets the DoseFunctionParameters attributes of an optimization function (objective or constraint) from `get_opt_func_args` output
+    # Used for copying objectives and contraints
+    # The parameters are the arguments that are not AddOptimizationFunction arguments, so no attributes are looked up
+
+    dfp = opt_func.DoseFunctionParameters
+    dfp.Weight = args["Weight"]
+    for name, value in args.items():
+        if name not in ADD_FUNCTION_ARG_NAMES and name != "Weight":
+            setattr(dfp, name, value)
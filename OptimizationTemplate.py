@@ -0,0 +1,174 @@
+"""Optimization state of a plan optimization, as a JSON-compatible dictionary
+
+`read_state` reads everything CRMC copies between plan optimizations, in a single pass over the source: algorithm and dose calculation settings, arc conversion settings, and every objective and constraint (with its robustness flag and weight).
+`apply_state` re-applies a state to any number of plan optimizations, all in one undo step.
+Since the state is plain data, it can also be saved to a file (`write_template`) and applied later without a live source plan (`read_template`). The file is indented with sorted keys, so two templates can be compared with any text diff tool.
+
+Example (copy the current beam set's optimization to two other beam sets):
+plan = get_current("Plan")
+state = read_state(plan.PlanOptimizations[0])
+apply_state(state, [plan.PlanOptimizations[1], plan.PlanOptimizations[2]])
+"""
+
+import json
+
+from connect import *  # Interact w/ RS
+
+from OptFunctionSchema import ADD_FUNCTION_ARG_NAMES, get_opt_func_args, set_opt_func_args
+
+
+STATE_VERSION = 1
+
+# Settings copied from OptimizationParameters.Algorithm and OptimizationParameters.DoseCalculation
+ALGORITHM_SETTINGS = ["MaxNumberOfIterations", "OptimalityTolerance"]
+DOSE_CALCULATION_SETTINGS = ["ComputeFinalDose", "ComputeIntermediateDose", "IterationsInPreparationsPhase"]
+
+
+def read_state(plan_opt):
+    """Return the optimization state of a plan optimization
+
+    Parameters
+    ----------
+    plan_opt: ScriptObject
+        The PlanOptimization to read
+
+    Returns
+    -------
+    Dictionary with keys:
+    - "Version": STATE_VERSION
+    - "AutoScaleToPrescription": bool
+    - "Algorithm" and "DoseCalculation": Setting name -> value
+    - "TreatmentSetupSettings": For a VMAT beam set, a list with one dictionary per treatment setup: "MaxLeafTravelDistancePerDegree", "UseMaxLeafTravelDistancePerDegree", and "Beams" (a list of "NumberOfArcs", "FinalArcGantrySpacing", and "MaxArcDeliveryTime" dictionaries). Otherwise, an empty list.
+    - "Functions": List of `get_opt_func_args` dictionaries, constraints first, each with "IsConstraint"
+    """
+
+    params = plan_opt.OptimizationParameters  # Read once
+    algorithm, dose_calc = params.Algorithm, params.DoseCalculation
+    state = {
+        "Version": STATE_VERSION,
+        "AutoScaleToPrescription": plan_opt.AutoScaleToPrescription,
+        "Algorithm": dict((name, getattr(algorithm, name)) for name in ALGORITHM_SETTINGS),
+        "DoseCalculation": dict((name, getattr(dose_calc, name)) for name in DOSE_CALCULATION_SETTINGS),
+        "TreatmentSetupSettings": [],
+        "Functions": []
+    }
+
+    # Arc conversion settings only apply to VMAT
+    beam_set = plan_opt.OptimizedBeamSets[0]
+    if beam_set.Modality == "Photons" and beam_set.PlanGenerationTechnique == "Imrt" and beam_set.DeliveryTechnique == "DynamicArc":
+        for tss in params.TreatmentSetupSettings:
+            arc_props = tss.SegmentConversion.ArcConversionProperties
+            beams = []
+            for beam_settings in tss.BeamSettings:
+                beam_props = beam_settings.ArcConversionPropertiesPerBeam
+                beams.append({"NumberOfArcs": beam_props.NumberOfArcs, "FinalArcGantrySpacing": beam_props.FinalArcGantrySpacing, "MaxArcDeliveryTime": beam_props.MaxArcDeliveryTime})
+            state["TreatmentSetupSettings"].append({"MaxLeafTravelDistancePerDegree": arc_props.MaxLeafTravelDistancePerDegree, "UseMaxLeafTravelDistancePerDegree": arc_props.UseMaxLeafTravelDistancePerDegree, "Beams": beams})
+
+    for opt_func in plan_opt.Constraints:
+        args = get_opt_func_args(opt_func)
+        args["IsConstraint"] = True
+        state["Functions"].append(args)
+    objective = plan_opt.Objective
+    if objective is not None:
+        for opt_func in objective.ConstituentFunctions:
+            args = get_opt_func_args(opt_func)
+            args["IsConstraint"] = False
+            state["Functions"].append(args)
+
+    return state
+
+
+def _apply_arc_settings(tss_states, params):
+    # Helper function that applies the arc conversion settings in `tss_states` to OptimizationParameters `params`
+    # Settings are matched by index. Treatment setups and beams beyond those in the state (or in the target) are left alone.
+    # EditArcBasedBeamOptimizationSettings is only called for beams whose settings differ, since it is slow
+
+    for tss_state, tss in zip(tss_states, params.TreatmentSetupSettings):
+        arc_props = tss.SegmentConversion.ArcConversionProperties
+        arc_props.MaxLeafTravelDistancePerDegree = tss_state["MaxLeafTravelDistancePerDegree"]
+        arc_props.UseMaxLeafTravelDistancePerDegree = tss_state["UseMaxLeafTravelDistancePerDegree"]
+        for beam_state, beam_settings in zip(tss_state["Beams"], tss.BeamSettings):
+            beam_props = beam_settings.ArcConversionPropertiesPerBeam
+            if beam_props.NumberOfArcs != beam_state["NumberOfArcs"] or beam_props.FinalArcGantrySpacing != beam_state["FinalArcGantrySpacing"] or beam_props.MaxArcDeliveryTime != beam_state["MaxArcDeliveryTime"]:
+                beam_props.EditArcBasedBeamOptimizationSettings(CreateDualArcs=beam_state["NumberOfArcs"] == 2, FinalGantrySpacing=beam_state["FinalArcGantrySpacing"], MaxArcDeliveryTime=beam_state["MaxArcDeliveryTime"])
+
+
+def apply_state(state, plan_opts, clear_functions=False):
+    """Apply an optimization state to one or more plan optimizations, in a single undo step
+
+    Parameters
+    ----------
+    state: dict
+        Optimization state, from `read_state` or `read_template`
+    plan_opts: List[ScriptObject]
+        The PlanOptimizations to change
+    clear_functions: bool
+        True to delete the existing objectives and constraints of each plan optimization before adding those in the state, False to keep them
+
+    Returns
+    -------
+    Number of optimization functions added
+    """
+
+    if state.get("Version") != STATE_VERSION:
+        raise ValueError("Unsupported optimization state version: {}".format(state.get("Version")))
+
+    # AddOptimizationFunction arguments are the same for every target, so build them once
+    add_args = []
+    for args in state["Functions"]:
+        add_args.append(dict((name, args[name]) for name in ADD_FUNCTION_ARG_NAMES if name in args))
+
+    num_added = 0
+    with CompositeAction("Apply Optimization State"):
+        for plan_opt in plan_opts:
+            plan_opt.AutoScaleToPrescription = state["AutoScaleToPrescription"]
+
+            params = plan_opt.OptimizationParameters  # Read once per target
+            algorithm, dose_calc = params.Algorithm, params.DoseCalculation
+            for name, value in state["Algorithm"].items():
+                setattr(algorithm, name, value)
+            for name, value in state["DoseCalculation"].items():
+                setattr(dose_calc, name, value)
+            _apply_arc_settings(state["TreatmentSetupSettings"], params)
+
+            if clear_functions:
+                plan_opt.ClearConstituentFunctions()
+
+            for args, func_args in zip(state["Functions"], add_args):
+                opt_func = plan_opt.AddOptimizationFunction(**func_args)
+                set_opt_func_args(opt_func, args)
+                num_added += 1
+
+    return num_added
+
+
+def write_template(state, path):
+    """Write an optimization state to a JSON file, for use as an optimization template
+
+    Parameters
+    ----------
+    state: dict
+        Optimization state, from `read_state`
+    path: str
+        Absolute path to the JSON file
+    """
+
+    with open(path, "w") as f:
+        json.dump(state, f, indent=4, sort_keys=True)
+
+
+def read_template(path):
+    """Return the optimization state in a JSON file written by `write_template`
+
+    Parameters
+    ----------
+    path: str
+        Absolute path to the JSON file
+
+    Returns
+    -------
+    The optimization state, for `apply_state`
+    """
+
+    with open(path, "r") as f:
+        return json.load(f)
@@ -17,8 +17,12 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, KeepTogethe
 from reportlab.lib.units import inch
 from System.Windows.Forms import *
 
+import Extents
+from CaseSnapshot import CaseSnapshot
+from UniqueNames import name_item
 
-case = plan = exam = struct_set = None
+
+case = plan = exam = struct_set = snapshot = None  # `snapshot` is a CaseSnapshot of `case`. Temporary ROIs are always deleted, so the snapshot's ROIs stay valid
 
 
 # ReportLab Paragraph styles
@@ -59,7 +63,7 @@ def get_contour_coords(geom):
     if hasattr(geom.PrimaryShape, "Contours"):
         coords = [c for coord in geom.PrimaryShape.Contours for c in coord]  # Flatten contours array
     else:  
-        copy_name = name_item(geom.OfRoi.Name, [roi.Name for roi in case.PatientModel.RegionsOfInterest])  # Unique ROI name
+        copy_name = name_item(geom.OfRoi.Name, snapshot.roi_names)  # Unique ROI name
         copy = case.PatientModel.CreateRoi(Name=copy_name, Color=geom.OfRoi.Color, Type=geom.OfRoi.Type)  # Create ROI w/ same color and type as geom's ROI
         copy.CreateAlgebraGeometry(Examination=exam, ExpressionA={ 'Operation': "Union", 'SourceRoiNames': [geom.OfRoi.Name], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ExpressionB={ 'Operation': "Union", 'SourceRoiNames': [], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ResultOperation="None", ResultMarginSettings={ 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0})  # Copy is same as geom's ROI
         geom = case.PatientModel.StructureSets[exam.Name].RoiGeometries[copy_name]  # Change geom value so that correct contours are returned
@@ -99,24 +103,9 @@ def format_num(num):
     return str(round(num, 2)).rstrip("0").rstrip(".")
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
 def will_gantry_collide(r, couch_bounds, ext_bounds, iso, likelihood):
     # Helper function that returns whether a geometry will likely collide with the gantry, using radius `r`
-    cyl_name = name_item("Cylinder_{}".format(r), [roi.Name for roi in case.PatientModel.RegionsOfInterest], 16)
+    cyl_name = name_item("Cylinder_{}".format(r), snapshot.roi_names, 16)
     cyl = case.PatientModel.CreateRoi(Name=cyl_name, Type="Control")
     cyl.CreateCylinderGeometry(Radius=r, Axis={"x": 0, "y": 0, "z": 1}, Length=30, Examination=exam, Center=iso)
     cyl_bounds = struct_set.RoiGeometries[cyl_name].GetBoundingBox()
@@ -224,7 +213,7 @@ def plan_check():
     Iteratively make changed according to PlanChecks' errors/warnings and run PlanCheck again.
     """
 
-    global case, plan, exam, struct_set
+    global case, plan, exam, struct_set, snapshot
 
     # Get current variables
     try:
@@ -249,6 +238,7 @@ def plan_check():
         sys.exit(1)  # Exit script with an error
     struct_set = plan.GetStructureSet()  # Structure set on planning exam
     exam = struct_set.OnExamination  # Planning exam
+    snapshot = CaseSnapshot(case)  # Read ROI properties and planning exam geometry states once
 
     # Need to determine plan types now so that we know if ANY plan types are ____
     # Example: Minimum dose grid voxel size depends on whether ANY beam set is SBRT
@@ -311,7 +301,7 @@ def plan_check():
     green_msgs_section = []
 
     # External ROI exists
-    ext = [roi for roi in case.PatientModel.RegionsOfInterest if roi.Type == "External"]
+    ext = snapshot.rois_of_type("External")
     if not ext:
         msg = "There is no external ROI."
         red_msgs.append(msg)
@@ -321,7 +311,7 @@ def plan_check():
         green_msgs_section.append(msg)
 
         # External is named "External", and no ROI of any other type is named "External"
-        if ext.Name != "External":
+        if ext.name != "External":
             msg = "External ROI is not named 'External'."
             red_msgs.append(msg)
         else:
@@ -329,9 +319,9 @@ def plan_check():
             green_msgs_section.append(msg)
 
     # ROI named "External" is of type "External"
-    external_type = [roi.Type for roi in case.PatientModel.RegionsOfInterest if roi.Name == "External" and roi.Type != "External"]
-    if external_type:
-        msg = "The ROI named 'External' is of type {}.".format(external_type[0])
+    external = snapshot.roi("External")
+    if external is not None and external.type != "External":
+        msg = "The ROI named 'External' is of type {}.".format(external.type)
         red_msgs.append(msg)
     else:
         msg = "The ROI named 'External' is of type 'External'."
@@ -378,8 +368,7 @@ def plan_check():
         green_msgs_section.append(msg)
 
     # Couch ROIs exist
-    roi_names = [roi.Name for roi in case.PatientModel.RegionsOfInterest]
-    missing_couch_rois = [couch_name for couch_name in couch_names if couch_name not in roi_names]
+    missing_couch_rois = [couch_name for couch_name in couch_names if couch_name not in snapshot]
     if not is_vmat_hn:
         if missing_couch_rois:
             msg = "Couch ROI(s) are missing:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;{}".format("<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;".join(missing_couch_rois))
@@ -422,7 +411,7 @@ def plan_check():
 
     if ext:
         # External has geometry on planning exam
-        if not struct_set.RoiGeometries[ext.Name].HasContours():
+        if not snapshot.has_contours(ext.name, exam.Name):
             msg = "There is no external geometry on the planning exam."
             red_msgs.append(msg)
         else:
@@ -434,8 +423,7 @@ def plan_check():
     chk_for_body_site = [case.BodySite, case.CaseName, case.Comments, case.Diagnosis, plan.Comments, plan.Name] + [beam_set.DicomPlanLabel for beam_set in plan.BeamSets]  # Fields to check for prostate keywords
     if any(site in attr for attr in chk_for_body_site for site in ["pros", "pb", "bed", "fossa"]):  # It's a prostate plan
         pros_rois = ["Bladder", "Rectum", "Colon_Sigmoid", "Bag_Bowel"]  # ROIs that must be present if this is a prostate plan
-        roi_names = [roi.Name for roi in case.PatientModel.RegionsOfInterest]
-        missing_pros_rois = [pros_roi for pros_roi in pros_rois if pros_roi not in roi_names]
+        missing_pros_rois = [pros_roi for pros_roi in pros_rois if pros_roi not in snapshot]
         if missing_pros_rois:
             msg = "Important prostate plan ROI(s) are missing:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;{}".format("<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;".join(missing_pros_rois))
             red_msgs.append(msg)
@@ -444,7 +432,7 @@ def plan_check():
             green_msgs_section.append(msg)
 
     # Empty geometries on planning exam
-    empty_geom_names = [geom.OfRoi.Name for geom in struct_set.RoiGeometries if not geom.HasContours() and geom.OfRoi.Name != ext.Name]  # No external should be error (taken care of above), not warning
+    empty_geom_names = [roi.name for roi in snapshot.empty_rois(exam.Name) if not ext or roi.name != ext.name]  # No external should be error (taken care of above), not warning
     if empty_geom_names:
         msg = "The following ROIs are empty on the planning exam:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;{}".format("<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;".join(empty_geom_names))
         yellow_msgs.append(msg)
@@ -453,7 +441,7 @@ def plan_check():
         green_msgs_section.append(msg)
 
     # ROIs that have been updated since last voxel volume computation: have contours but no volume in dose grid
-    dose_stats_missing = [geom.OfRoi.Name for geom in struct_set.RoiGeometries if geom.OfRoi.Name not in couch_names and geom.HasContours() and dose_dist.GetDoseGridRoi(RoiName=geom.OfRoi.Name).RoiVolumeDistribution is None]
+    dose_stats_missing = [roi.name for roi in snapshot.contoured_rois(exam.Name) if roi.name not in couch_names and dose_dist.GetDoseGridRoi(RoiName=roi.name).RoiVolumeDistribution is None]
     if dose_stats_missing:
         msg = "Dose statistics need updating."
         yellow_msgs.append(msg)
@@ -466,8 +454,7 @@ def plan_check():
     # Ignore coordinates outside the planning exam
     dg = plan.GetDoseGrid()
     if ext and dose_dist.DoseValues is not None and len(set(dg.VoxelSize.values())) == 1:  # External exists, dose grid is defined, and dose grid voxel sizes are uniform
-        ext_geom = struct_set.RoiGeometries[ext.Name]
-        if ext_geom.HasContours():
+        if snapshot.has_contours(ext.name, exam.Name):
             # Min and max coordinates of image
             img_stack = exam.Series[0].ImageStack
             exam_min, exam_max = img_stack.GetBoundingBox()
@@ -475,7 +462,7 @@ def plan_check():
             # Min and max coordinates in dose grid, defined by a box geometry
             dg_min = dg.Corner
             dg_max = {dim: coord + dg.NrVoxels[dim] * dg.VoxelSize[dim] for dim, coord in dg_min.items()}
-            box_name = name_item("DoseGrid", [roi.Name for roi in case.PatientModel.RegionsOfInterest], 16)
+            box_name = name_item("DoseGrid", snapshot.roi_names, 16)
             box = case.PatientModel.CreateRoi(Name=box_name, Type="Control")
             box_min = {dim: max(coord, exam_min[dim]) for dim, coord in dg_min.items()}
             box_max = {dim: min(coord, exam_max[dim]) for dim, coord in dg_max.items()}
@@ -484,9 +471,9 @@ def plan_check():
             box.CreateBoxGeometry(Size=box_sz, Examination=exam, Center=box_ctr, VoxelSize=plan.GetDoseGrid().VoxelSize.x)
 
             # Voxel indices of planning exam, and external w/ 3 mm margin
-            ext_prv03_name = name_item("External_PRV03", [roi.Name for roi in case.PatientModel.RegionsOfInterest], 16)
+            ext_prv03_name = name_item("External_PRV03", snapshot.roi_names + [box_name], 16)
             ext_prv03 = case.PatientModel.CreateRoi(Name=ext_prv03_name, Type="Control")
-            ext_prv03.SetMarginExpression(SourceRoiName=ext.Name, MarginSettings={ 'Type': "Expand", 'Superior': 0.3, 'Inferior': 0.3, 'Anterior': 0.3, 'Posterior': 0.3, 'Right': 0.3, 'Left': 0.3 })
+            ext_prv03.SetMarginExpression(SourceRoiName=ext.name, MarginSettings={ 'Type': "Expand", 'Superior': 0.3, 'Inferior': 0.3, 'Anterior': 0.3, 'Posterior': 0.3, 'Right': 0.3, 'Left': 0.3 })
             ext_prv03.UpdateDerivedGeometry(Examination=exam)
             dose_dist.UpdateDoseGridStructures()
             box_vi = set(dose_dist.GetDoseGridRoi(RoiName=box_name).RoiVolumeDistribution.VoxelIndices)  # Voxel indices of box geometry ("voxel indices" of image)
@@ -497,11 +484,11 @@ def plan_check():
             ext_prv03.DeleteRoi()
 
             stray_contours = []  # Geometries that extend outside external
-            for geom in struct_set.RoiGeometries:
-                if geom.HasContours() and geom.OfRoi.Type not in ["Bolus", "Control", "External", "FieldOfView", "Fixation", "Support"] and geom.OfRoi.RoiMaterial is None:  # Ignore the external contour, any other external contours, FOV or support (e.g., couch) contours, and ROIs with a material defined
-                    geom_vi = set(dose_dist.GetDoseGridRoi(RoiName=geom.OfRoi.Name).RoiVolumeDistribution.VoxelIndices).intersection(box_vi)  # Voxel indices of the geometry that are inside the image
+            for roi in snapshot.contoured_rois(exam.Name):
+                if roi.type not in ["Bolus", "Control", "External", "FieldOfView", "Fixation", "Support"] and not roi.has_material:  # Ignore the external contour, any other external contours, FOV or support (e.g., couch) contours, and ROIs with a material defined
+                    geom_vi = set(dose_dist.GetDoseGridRoi(RoiName=roi.name).RoiVolumeDistribution.VoxelIndices).intersection(box_vi)  # Voxel indices of the geometry that are inside the image
                     if not geom_vi.issubset(ext_vi):
-                        stray_contours.append(geom.OfRoi.Name)
+                        stray_contours.append(roi.name)
             
             if stray_contours:
                 msg = "The following contours extend outside the external:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;{}".format("<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;".join(stray_contours))
@@ -511,8 +498,8 @@ def plan_check():
                 green_msgs_section.append(msg)
 
         # External extends to couch w/o gap or overlap
-        if "SBRT" in plan_types.values() and not missing_couch_rois and struct_set.RoiGeometries[outer_couch_name].HasContours() and struct_set.RoiGeometries[inner_couch_name].HasContours():
-            ext_bottom = struct_set.RoiGeometries[ext.Name].GetBoundingBox()[1].y  # Bottom of external
+        if "SBRT" in plan_types.values() and not missing_couch_rois and snapshot.has_contours(outer_couch_name, exam.Name) and snapshot.has_contours(inner_couch_name, exam.Name):
+            ext_bottom = struct_set.RoiGeometries[ext.name].GetBoundingBox()[1].y  # Bottom of external
             couch_top = struct_set.RoiGeometries[outer_couch_name].GetBoundingBox()[0].y
             diff = round(ext_bottom - couch_top, 2)
             if diff < -0.3:
@@ -526,9 +513,9 @@ def plan_check():
                 green_msgs_section.append(msg)
 
     # No gap between adjacent boli
-    boli = [geom for geom in struct_set.RoiGeometries if geom.HasContours() and geom.OfRoi.Type == "Bolus" and geom.OfRoi.DerivedRoiExpression is None]  # Non-derived bolus geometries
+    boli = [struct_set.RoiGeometries[roi.name] for roi in snapshot.contoured_rois(exam.Name) if roi.type == "Bolus" and not roi.is_derived]  # Non-derived bolus geometries
     if boli:  # Plan has bolus
-        ext_coords = get_contour_coords(struct_set.RoiGeometries[ext.Name])  # All coordinates in External geometry
+        ext_coords = get_contour_coords(struct_set.RoiGeometries[ext.name])  # All coordinates in External geometry
         gap_btwn_boli = []  # List of tuples of adjacent boli w/ a gap; e.g., [("Bolus 1", "Bolus 2"), ("Bolus 3", "Bolus 4")]
         
         # Iterate over each bolus, finding the adjacent (closest) bolus, as determined by smallest distance between closest two points that are also part of External
@@ -566,10 +553,10 @@ def plan_check():
 
     # Dose grid doesn't extend outside image
     dg = plan.GetDoseGrid()
-    dg_high = {coord: dg.Corner[coord] + dg.NrVoxels[coord] * sz for coord, sz in dg.VoxelSize.items()}  # Max coordinates of dose grid (dose grid corner is min coordinates)
+    dg_box = Extents.grid_box(dg)  # Min and max coordinates of dose grid (dose grid corner is min coordinates)
     if "SBRT" in plan_types.values() or "SRS" in plan_types.values():
-        img_bounds = exam.Series[0].ImageStack.GetBoundingBox()
-        if any(img_bounds[0][coord] < val for coord, val in dg.Corner.items()) or any(img_bounds[1][coord] > val for coord, val in dg_high.items()):
+        img_box = Extents.point_bounds(exam.Series[0].ImageStack.GetBoundingBox())
+        if Extents.outside(dg_box, img_box)[0]:  # Dose grid extends past the image
             msg = "Dose grid extends outside planning exam."
             yellow_msgs.append(msg)
         else:
@@ -578,12 +565,9 @@ def plan_check():
 
     # Dose grid includes all contours (except perhaps FOV)
     # A contour extends outside dose grid if any of its min coords are less than dose grid min coordinates, or any of its max coordinates are greater than dose grid max coordinates
-    outside_dg = []  # Geometries that extend outside dose grid
-    for geom in struct_set.RoiGeometries:  # Ignore empty geometries
-        if geom.HasContours() and geom.OfRoi.Type != "FieldOfView" and not (geom.OfRoi.Type in ["Bolus", "Fixation", "Support"] and geom.OfRoi.RoiMaterial is not None):  # Ignore FOV, and bolus/fixation/support with material override
-            bounds = geom.GetBoundingBox()  # [{"x": min x-coord, "y": min y-coord, "z": min z-coord}, {"x": max x-coord, "y": max y-coord, "z": max z-coord}]
-            if any(bounds[0][coord] < val for coord, val in dg.Corner.items()) or any(bounds[1][coord] > val for coord, val in dg_high.items()):
-                outside_dg.append(geom.OfRoi.Name)
+    check_names = [roi.name for roi in snapshot.contoured_rois(exam.Name) if roi.type != "FieldOfView" and not (roi.type in ["Bolus", "Fixation", "Support"] and roi.has_material)]  # Ignore empty geometries, FOV, and bolus/fixation/support with material override
+    check_names, bounds = Extents.geometry_bounds(struct_set, check_names)
+    outside_dg = [name for name, is_outside in zip(check_names, Extents.outside(bounds, dg_box)) if is_outside]  # Geometries that extend outside dose grid
     if outside_dg:
         msg = "Dose grid does not include all of the following geometries:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;{}.\nPlease review slices.".format("<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;".join(outside_dg))
         yellow_msgs.append(msg)
@@ -629,7 +613,7 @@ def plan_check():
         failing_goals = []
         for func in plan.TreatmentCourse.EvaluationSetup.EvaluationFunctions:
             roi = func.ForRegionOfInterest
-            if struct_set.RoiGeometries[roi.Name].HasContours() and roi.Name not in dose_stats_missing and not func.EvaluateClinicalGoal():
+            if snapshot.has_contours(roi.Name, exam.Name) and roi.Name not in dose_stats_missing and not func.EvaluateClinicalGoal():
                 goal_criteria = "At least" if func.PlanningGoal.GoalCriteria == "AtLeast" else "At most"
                 goal_val = func.GetClinicalGoalValue()  # nan if empty or out-of-date geometry
 
@@ -694,12 +678,12 @@ def plan_check():
         green_msgs_section.append(msg)
 
         # Bounds of couch and external
-        if not missing_couch_rois and struct_set.RoiGeometries[outer_couch_name].HasContours():
+        if not missing_couch_rois and snapshot.has_contours(outer_couch_name, exam.Name):
             couch_bounds = struct_set.RoiGeometries[outer_couch_name].GetBoundingBox()
         else:
             couch_bounds = None
-        if ext and struct_set.RoiGeometries[ext.Name].HasContours():
-            ext_bounds = struct_set.RoiGeometries[ext.Name].GetBoundingBox()
+        if ext and snapshot.has_contours(ext.name, exam.Name):
+            ext_bounds = struct_set.RoiGeometries[ext.name].GetBoundingBox()
         else:
             ext_bounds = None
 
@@ -822,7 +806,7 @@ def plan_check():
                     roi = bs_rx.OnStructure  # PTV
                     dsp_roi = "PTV"
                 else:  # Rx to point
-                    roi_name = name_item("IDL_80%", [r.Name for r in case.PatientModel.RegionsOfInterest])  # We'll create an ROI w/ this name
+                    roi_name = name_item("IDL_80%", snapshot.roi_names)  # We'll create an ROI w/ this name
                     roi = case.PatientModel.CreateRoi(Name=roi_name, Type="Control")  # Create ROI
                     roi.CreateRoiGeometryFromDose(DoseDistribution=dose_dist, ThresholdLevel=0.8 * bs_rx.DoseValue)  # Set geometry to isodose line for 80% of the Rx
                     dsp_roi = "80% isodose line"
@@ -955,7 +939,7 @@ def plan_check():
         if bs_rx is not None and beam_set.FractionationPattern is not None and beam_set.FractionDose.DoseValues is not None:
             # Max dose
             dose_per_fx = float(bs_rx.DoseValue) / beam_set.FractionationPattern.NumberOfFractions
-            max_dose = int(round(beam_set.FractionDose.GetDoseStatistic(RoiName=ext.Name, DoseType="Max") / dose_per_fx * 100))
+            max_dose = int(round(beam_set.FractionDose.GetDoseStatistic(RoiName=ext.name, DoseType="Max") / dose_per_fx * 100))
             if plan_type in ["SRS", "SBRT"]:
                 if max_dose > 125:
                     if max_dose > 140:
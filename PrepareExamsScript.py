@@ -4,20 +4,7 @@ import sys
 
 from connect import *  # Interact w/ RS
 
-
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
+from UniqueNames import exam_name_allocator, name_item
 
 
 def prepare_exams(study_id=None):
@@ -76,6 +63,7 @@ def prepare_exams(study_id=None):
                         exams = [exam]
 
     # Prepare exams: fix imaging system name & add dates to exam names
+    exam_names = exam_name_allocator(case)
     gated = []  # List of gated exams to include in new 4DCT group
     date = None
     avg = mip = non_gated = None
@@ -85,47 +73,48 @@ def prepare_exams(study_id=None):
         dcm = dcm_data[exam.Name]
         desc = dcm["SeriesModule"]["SeriesDescription"] if dcm["SeriesModule"]["SeriesDescription"] is not None else dcm["StudyModule"]["StudyDescription"]  # Exam description is either series description (preferred) or study description
         date = dcm["StudyModule"]["StudyDateTime"].ToString("d")
-        series_id = dcm["SeriesModule"]["SeriesInstanceUID"]
-        other_exam_names = [exam_.Name for exam_ in case.Examinations if dcm_data[exam_.Name]["SeriesModule"]["SeriesInstanceUID"] != series_id]
+        exam_names.discard(exam.Name)  # Exam may keep its own name
 
         # Rename exam
         if "Non-Gated" in desc:
             non_gated = exam
-            exam.Name = name_item("3D {}".format(date), other_exam_names)
+            exam.Name = exam_names.allocate("3D {}".format(date))
         elif "AVG" in desc:
             avg = exam
-            exam.Name = name_item("AVG (Tx Planning) {}".format(date), other_exam_names)
+            exam.Name = exam_names.allocate("AVG (Tx Planning) {}".format(date))
         elif "MIP" in desc:
             mip = exam
-            exam.Name = name_item("MIP {}".format(date), other_exam_names)
+            exam.Name = exam_names.allocate("MIP {}".format(date))
         elif "Gated" in desc:
             pct = int(desc[(desc.index(",") + 2):-3])  # e.g., 10
             if pct == 0:
-                exam.Name = name_item("Gated {}% (Max Inhale) {}".format(pct, date), other_exam_names)
+                exam.Name = exam_names.allocate("Gated {}% (Max Inhale) {}".format(pct, date))
             elif pct == 50:
-                exam.Name = name_item("Gated {}% (Max Exhale) {}".format(pct, date), other_exam_names)
+                exam.Name = exam_names.allocate("Gated {}% (Max Exhale) {}".format(pct, date))
             else:
-                exam.Name = name_item("Gated {}% {}".format(pct, date), other_exam_names)
+                exam.Name = exam_names.allocate("Gated {}% {}".format(pct, date))
             gated.append(exam.Name)  # Only include exam if it had to be renamed (is new)
         # Add plan or case name to exam name, if necessary
         else:
             names_to_chk = [plan_.Name for plan_ in case.TreatmentPlans if plan_.GetStructureSet().OnExamination.Name == exam.Name] + [case.CaseName]
             if not any(re.search(name, exam.Name) for name in names_to_chk):  # No plan or case name in exam name
-                exam.Name = name_item("{} {}".format(names_to_chk[0], exam.Name), other_exam_names)
+                exam.Name = exam_names.allocate("{} {}".format(names_to_chk[0], exam.Name))
         # Add date to exam name, if necessary
         if not re.search("(\d{1,2}[/\-\. ]\d{1,2}[/\-\. ](\d{2}|\d{4}))|(\d{6}|\d{8})", exam.Name):  # E.g., 1/26/1999, 03/04/2020, 3/04/2020, 4/5/20, 7-8-21, 8-09-2021, 20200613, 210313
-            exam.Name = name_item("{} {}".format(exam.Name, date), other_exam_names)
+            exam_names.discard(exam.Name)
+            exam.Name = exam_names.allocate("{} {}".format(exam.Name, date))
+        exam_names.add(exam.Name)  # In case the exam was not renamed
 
     # Create gated group from found gated exams
     if gated:
         grp_name = name_item("4D Phases {}".format(date), [grp.Name for grp in case.ExaminationGroups])
         case.CreateExaminationGroup(ExaminationGroupName=grp_name, ExaminationGroupType="Collection4dct", ExaminationNames=sorted(gated))  # Sort the exam names to ensure phases are in order
         if avg is None:  # Create AVG, if necessary
-            avg_name = name_item("AVG (Tx Planning) {}".format(date), [exam_.Name for exam_ in case.Examinations])
+            avg_name = exam_names.allocate("AVG (Tx Planning) {}".format(date))
             case.Create4DCTProjection(ExaminationName=avg_name, ExaminationGroupName=grp_name, ProjectionMethod="AverageIntensity")
             avg = case.Examinations[avg_name]
         if mip is None:  # Create MIP, if necessary
-            mip_name = name_item("MIP {}".format(date), [exam_.Name for exam_ in case.Examinations])
+            mip_name = exam_names.allocate("MIP {}".format(date))
             case.Create4DCTProjection(ExaminationName=mip_name, ExaminationGroupName=grp_name, ProjectionMethod="MaximumIntensity")
 
     # Deform from 3D to AVG
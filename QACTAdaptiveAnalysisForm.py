@@ -3,8 +3,15 @@ import clr
 clr.AddReference("System.Drawing")
 clr.AddReference("System.Windows.Forms")
 
+import csv
+import io
+import json
+import os
 import re
 import sys
+import tempfile
+from collections import OrderedDict
+from hashlib import md5
 
 from connect import *  # Interact w/ RS
 
@@ -12,8 +19,14 @@ from connect import *  # Interact w/ RS
 from System.Drawing import *
 from System.Windows.Forms import *
 
+import numpy as np
 
-case = plan = None
+import Extents
+from CaseSnapshot import CaseSnapshot
+from UniqueNames import name_item
+
+
+case = plan = snapshot = reg_index = None
 
 
 def add_date_to_exam_name(exam):
@@ -28,6 +41,333 @@ def add_date_to_exam_name(exam):
             exam.Name = "{} {}".format(exam.Name, dcm["StudyModule"]["StudyDateTime"].ToString("d"))    
 
 
+def index_dose_evaluations(exam_names):
+    """Return the evaluation doses of the current plan's beam sets on the given exams, indexed by exam and beam set
+
+    One pass over the planning fraction's evaluations, so each later lookup is a dictionary lookup instead of a nested scan.
+    Doses are matched to beam sets by beam set identifier, since a beam set name is only unique within a plan.
+    RS keeps one evaluation dose per beam set per exam in a fraction evaluation (recomputing replaces it). If there is more than one anyway, the newest cannot be told apart, so that exam and beam set are left out.
+
+    Parameters
+    ----------
+    exam_names: List[str]
+        Names of the exams (e.g., QACTs) whose evaluation doses to include
+
+    Returns
+    -------
+    Dictionary of (exam name, beam set name) -> the evaluation dose of that beam set on that exam
+    """
+
+    exam_names = set(exam_names)
+    beam_set_names = dict((bs.BeamSetIdentifier(), bs.DicomPlanLabel) for bs in plan.BeamSets)  # Beam set identifier -> name
+    index, ambiguous = {}, set()
+    for fe in case.TreatmentDelivery.FractionEvaluations:
+        if fe.FractionNumber != 0:  # `compute_eval_doses` computes on the planning fraction
+            continue
+        for doe in fe.DoseOnExaminations:
+            exam_name = doe.OnExamination.Name
+            if exam_name not in exam_names:
+                continue
+            for dose_eval in doe.DoseEvaluations:
+                beam_set = getattr(dose_eval, "ForBeamSet", None)  # None for, e.g., summed or perturbed doses
+                if beam_set is None:
+                    continue
+                bs_name = beam_set_names.get(beam_set.BeamSetIdentifier())
+                if bs_name is None:  # Beam set in another plan
+                    continue
+                key = (exam_name, bs_name)
+                if key in index:
+                    ambiguous.add(key)
+                index[key] = dose_eval
+    for key in ambiguous:
+        print("Multiple evaluation doses of beam set '{}' on exam '{}'. Skipping them.".format(key[1], key[0]))
+        del index[key]
+    return index
+
+
+def compute_eval_doses(exam_names):
+    """Compute the dose of each of the current plan's beam sets on each of the given exams, and update dose grid structures for the new evaluation doses
+
+    Each beam set's dose is computed on all the exams in a single ComputeDoseOnAdditionalSets call. Works for one or several QACTs.
+
+    Parameters
+    ----------
+    exam_names: List[str]
+        Names of the exams (e.g., QACTs) on which to compute dose
+
+    Returns
+    -------
+    Dictionary of (exam name, beam set name) -> the new evaluation dose (see `index_dose_evaluations`)
+    """
+
+    for bs in plan.BeamSets:
+        bs.ComputeDoseOnAdditionalSets(ExaminationNames=exam_names, FractionNumbers=[0] * len(exam_names))
+
+    # Update dose grid structures once per new evaluation dose
+    index = index_dose_evaluations(exam_names)
+    for dose_eval in index.values():
+        dose_eval.UpdateDoseGridStructures()
+    return index
+
+
+TARGET_TYPES = ["Ctv", "Gtv", "Ptv"]  # ROI types reported as targets in the trend table. "Organ" ROIs are reported as OARs
+TREND_STORE_VERSION = 1
+
+
+class RegistrationIndex(object):
+    """Rigid and deformable registrations in the case, indexed by exam names
+
+    Built in one pass over the case's registrations, so each lookup is a set or dictionary lookup instead of a search of `case.Registrations`.
+    """
+
+    def __init__(self, case):
+        self.rigid = set()  # (reference exam name, floating exam name) of each rigid registration
+        for reg in case.Registrations:
+            src = reg.RegistrationSource
+            self.rigid.add((src.FromExamination.Name, src.ToExamination.Name))
+        self.deformable = {}  # (reference exam name, target exam name) -> name of the structure registration group with that deformable registration
+        self.group_names = []  # Names of all structure registration groups
+        for srg in case.PatientModel.StructureRegistrationGroups:
+            self.group_names.append(srg.Name)
+            for dsr in srg.DeformableStructureRegistrations:
+                self.deformable.setdefault((dsr.FromExamination.Name, dsr.ToExamination.Name), srg.Name)
+
+
+def possible_qacts(tpct, ext_name):
+    # Helper function that returns the exams that can be used as QACTs for the TPCT
+    # Possible QACTs are not the TPCT, not registered to TPCT in opposite direction, and not in same frame of reference as TPCT
+    # If the external is approved, a possible QACT must also have external contours
+
+    ext_approved = snapshot.is_approved(ext_name)
+    tpct_for = tpct.EquipmentInfo.FrameOfReference
+    qacts = []
+    for exam in case.Examinations:
+        if exam.Name == tpct.Name:  # Exam is the TPCT
+            continue
+        if exam.EquipmentInfo.FrameOfReference == tpct_for:  # Exam is in same FoR as TPCT
+            continue
+        if (exam.Name, tpct.Name) in reg_index.rigid:  # Exam is registered to TPCT
+            continue
+        if ext_approved and not snapshot.has_contours(ext_name, exam.Name):
+            continue
+        qacts.append(exam)
+    return qacts
+
+
+def group_by_unapproved(roi_names, exam_names):
+    # Helper function that groups ROIs by the exams on which they are not approved, so that each group can be copied or deformed in one call
+    # Returns an OrderedDict of tuple of exam names -> list of ROI names. ROIs approved on every exam are left out
+    groups = OrderedDict()
+    for roi_name in roi_names:
+        targets = tuple(exam_name for exam_name in exam_names if not snapshot.is_approved(roi_name, exam_name))
+        if targets:
+            groups.setdefault(targets, []).append(roi_name)
+    return groups
+
+
+def prepare_qacts(tpct, qacts, ext_name, copy_geoms, deform_geoms, review=True):
+    """Register the TPCT to each QACT, and copy and deform ROI geometries from the TPCT to the QACTs
+
+    Steps 2-6 of `qact_adaptive_analysis`.
+    A geometry that is approved on a QACT is not copied to, or deformed onto, that QACT. ROIs that go to the same QACTs are copied (or deformed) in one call.
+
+    Parameters
+    ----------
+    tpct: ScriptObject
+        The TPCT
+    qacts: List[ScriptObject]
+        The QACTs
+    ext_name: str
+        Name of the external ROI, which is created on any QACT that does not have it
+    copy_geoms, deform_geoms: List[str]
+        Names of the ROIs to copy, and to deform
+    review: bool
+        True to let the user review each newly computed rigid registration
+
+    Returns
+    -------
+    Tuple: the FOV ROI that copied geometries were cropped to (None if no geometries were copied), and a dictionary of QACT name -> "Existing" or "Computed" (the rigid registration)
+    """
+
+    qact_names = [qact.Name for qact in qacts]
+    reg_status = {}
+    for qact in qacts:
+        if not snapshot.has_contours(ext_name, qact.Name):
+            case.PatientModel.RegionsOfInterest[ext_name].CreateExternalGeometry(Examination=qact)
+            snapshot.set_has_contours(ext_name, qact.Name)
+
+        # Compute rigid registration, if necessary
+        if (tpct.Name, qact.Name) in reg_index.rigid:
+            reg_status[qact.Name] = "Existing"
+            continue
+        case.ComputeRigidImageRegistration(FloatingExaminationName=qact.Name, ReferenceExaminationName=tpct.Name, HighWeightOnBones=True)
+        reg_index.rigid.add((tpct.Name, qact.Name))
+        reg_status[qact.Name] = "Computed"
+
+        if review:
+            # Navigate to registration & allow user to make changes
+            ui = get_current("ui")
+            ui.TitleBar.MenuItem["Patient Modeling"].Button_Patient_Modeling.Click()
+            ui = get_current("ui")  # New UI so that "Image Registration" tab is available
+            ui.TabControl_Modules.TabItem["Image Registration"].Select()
+            ui.ToolPanel.TabItem["Registrations"].Select()
+            ui = get_current("ui")  # New UI so that list of registrations is available
+            [tree_item for tree_item in ui.ToolPanel.RegistrationList.TreeItem if qact.Name in re.match(r"<.+'((.+(, )?)+)'>", str(tree_item)).group(1).split(", ")][0].Select()
+            ui.ToolPanel.TabItem["Scripting"].Select()
+            await_user_input("Review the rigid registration and make any necessary changes.")
+
+    # Geometries approved on a QACT are not copied to, or deformed onto, that QACT
+    copy_groups = group_by_unapproved(copy_geoms, qact_names)
+    deform_groups = group_by_unapproved(deform_geoms, qact_names)
+
+    # Deformable registration, only to the QACTs that geometries are deformed onto
+    # One structure registration group for all QACTs that don't already have a deformable registration
+    deform_qact_names = [qact_name for qact_name in qact_names if any(qact_name in targets for targets in deform_groups)]
+    missing = [qact_name for qact_name in deform_qact_names if (tpct.Name, qact_name) not in reg_index.deformable]
+    if missing:
+        grp_name = "{} to {}".format(tpct.Name, missing[0]) if len(missing) == 1 else "{} to {} QACTs".format(tpct.Name, len(missing))
+        grp_name = name_item(grp_name, reg_index.group_names)
+        case.PatientModel.CreateHybridDeformableRegistrationGroup(RegistrationGroupName=grp_name, ReferenceExaminationName=tpct.Name, TargetExaminationNames=missing)
+        reg_index.group_names.append(grp_name)
+        for qact_name in missing:
+            reg_index.deformable[(tpct.Name, qact_name)] = grp_name
+
+    # Deform POI geometries
+    #poi_names = [geom.OfPoi.Name for geom in case.PatientModel.StructureSets[tpct.Name].PoiGeometries if abs(geom.Point.x) < 1000]  # POI w/ no geometry has infinite coordinates
+    #case.MapPoiGeometriesDeformably(PoiGeometryNames=poi_names, StructureRegistrationGroupNames=[grp_name], ReferenceExaminationNames=[tpct.Name], TargetExaminationNames=[qact.Name])
+
+    # Copy ROI geometries, one call per group of QACTs
+    fov = None
+    if copy_groups:
+        for targets, roi_names in copy_groups.items():
+            case.PatientModel.CopyRoiGeometries(SourceExamination=tpct, TargetExaminationNames=list(targets), RoiNames=roi_names)
+        # Crop to FOV
+        unapproved_fov_names = [roi.name for roi in snapshot.rois_of_type("FieldOfView") if not roi.is_approved]
+        if unapproved_fov_names:
+            fov = case.PatientModel.RegionsOfInterest[unapproved_fov_names[0]]
+        else:
+            fov = case.PatientModel.CreateRoi(Name=name_item("Field-Of-View", snapshot.roi_names, 16), Type="FieldOfView")
+            snapshot.add_roi(fov)
+        for qact in qacts:
+            roi_names = [roi_name for targets, group_roi_names in copy_groups.items() if qact.Name in targets for roi_name in group_roi_names]
+            if not roi_names:
+                continue
+            fov.CreateFieldOfViewROI(ExaminationName=qact.Name)
+            for roi_name in roi_names:  # Intersect FOV and each geometry on exam, if possible
+                case.PatientModel.RegionsOfInterest[roi_name].CreateAlgebraGeometry(Examination=qact, ExpressionA={ 'Operation': "Union", 'SourceRoiNames': [roi_name], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ExpressionB={ 'Operation': "Union", 'SourceRoiNames': [fov.Name], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ResultOperation="Intersection", ResultMarginSettings={ 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 })
+
+    # Deform ROI geometries, one call per group of QACTs
+    for targets, roi_names in deform_groups.items():
+        case.MapRoiGeometriesDeformably(RoiGeometryNames=roi_names, StructureRegistrationGroupNames=[reg_index.deformable[(tpct.Name, qact_name)] for qact_name in targets], ReferenceExaminationNames=[tpct.Name] * len(targets), TargetExaminationNames=list(targets))
+
+    snapshot.invalidate("Contours")  # Geometries on the QACTs changed
+    return fov, reg_status
+
+
+def resize_dose_grid(tpct, qact_names):
+    # Helper function that resizes the current plan's dose grid to include the TPCT image and every geometry on the QACTs, ignoring geometries with infinite coordinates
+    voxel_size = plan.GetDoseGrid().VoxelSize
+    bounds = np.concatenate([Extents.geometry_bounds(case.PatientModel.StructureSets[qact_name])[1] for qact_name in qact_names])
+    box = Extents.union_box(bounds[Extents.finite(bounds)], Extents.point_bounds(tpct.Series[0].ImageStack.GetBoundingBox()))
+    corner, num_voxels = Extents.grid_extents(box, voxel_size)
+    plan.UpdateDoseGrid(Corner=corner, VoxelSize=voxel_size, NumberOfVoxels=num_voxels)
+    plan.TreatmentCourse.TotalDose.UpdateDoseGridStructures()
+
+
+def rename_exams(tpct, qacts):
+    # Helper function that adds dates, "(TPCT)", and "(QACT)" to the TPCT and QACT names, if needed
+    add_date_to_exam_name(tpct)
+    if "TPCT" not in tpct.Name:
+        tpct.Name += " (TPCT)"
+    for qact in qacts:
+        add_date_to_exam_name(qact)
+        if "QACT" not in qact.Name:
+            qact.Name += " (QACT)"
+
+
+def dvh_metrics(dose, roi_names, target_names, exam_name):
+    # Helper function that returns the DVH metrics of a dose distribution on an exam, as a dictionary of ROI name -> metric name -> dose (cGy)
+    # Targets: D95%, D98%, and mean. Other ROIs: max and mean
+    # ROIs without contours on the exam are left out
+
+    metrics = {}
+    for roi_name in roi_names:
+        if not snapshot.has_contours(roi_name, exam_name):
+            continue
+        mean = float(dose.GetDoseStatistic(RoiName=roi_name, DoseType="Average"))
+        if roi_name in target_names:
+            d95, d98 = dose.GetDoseAtRelativeVolumes(RoiName=roi_name, RelativeVolumes=[0.95, 0.98])
+            metrics[roi_name] = {"D95%": float(d95), "D98%": float(d98), "Mean": mean}
+        else:
+            metrics[roi_name] = {"Max": float(dose.GetDoseStatistic(RoiName=roi_name, DoseType="Max")), "Mean": mean}
+    return metrics
+
+
+def trend_store_path(patient_id, case_name, plan_name):
+    # Helper function that returns the absolute path to the trend store for a plan, in the user's temp folder
+    key = "{}|{}|{}".format(patient_id, case_name, plan_name)
+    return os.path.join(tempfile.gettempdir(), "QACTAdaptiveTrend", "{}.json".format(md5(key.encode("utf-8")).hexdigest()))
+
+
+def plan_dose_fingerprint():
+    # Helper function that returns a hash of what the current plan's dose depends on: the dose grid, and each beam set's label, dose algorithm, number of fractions, and beam MUs
+    # Changes when the plan is re-optimized, its dose grid is changed, or its dose is recomputed with a different algorithm
+    dg = plan.GetDoseGrid()
+    grid = ["{:.2f}".format(val) for val in np.concatenate([Extents.to_array(dg.Corner), Extents.to_array(dg.VoxelSize), Extents.to_array(dg.NrVoxels)])]
+    beam_sets = []
+    for bs in plan.BeamSets:
+        beam_sets.append([bs.DicomPlanLabel, bs.AccurateDoseAlgorithm.DoseAlgorithm, bs.FractionationPattern.NumberOfFractions, ["{:.2f}".format(beam.BeamMU) for beam in bs.Beams]])
+    return md5(json.dumps([grid, beam_sets], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def read_trend_store(path, fingerprint):
+    # Helper function that returns the trend store, or an empty store if the file does not exist, is unreadable, or is for a different plan dose (see `plan_dose_fingerprint`)
+    # Store: {"Version": TREND_STORE_VERSION, "Fingerprint": plan dose fingerprint, "Exams": {series instance UID: {"Name": ..., "Date": ..., "Registration": ..., "Metrics": {beam set name: {ROI name: {metric name: dose}}}}}}
+    try:
+        with open(path, "r") as f:
+            store = json.load(f)
+        if store.get("Version") == TREND_STORE_VERSION and store.get("Fingerprint") == fingerprint:
+            return store
+    except (IOError, OSError, ValueError):
+        pass
+    return {"Version": TREND_STORE_VERSION, "Fingerprint": fingerprint, "Exams": {}}
+
+
+def write_trend_store(path, store):
+    # Helper function that writes the trend store
+    # A store that cannot be written is not an error: the QACTs are just evaluated again next time
+    try:
+        store_dir = os.path.dirname(path)
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        with open(path, "w") as f:
+            json.dump(store, f, indent=4, sort_keys=True)
+    except (IOError, OSError):
+        pass
+
+
+def write_trend_table(path, rows):
+    # Helper function that writes the trend table as a CSV
+    # `rows`: List of (exam name, date, beam set name, registration, metrics) tuples. `metrics` is a dictionary of ROI name -> metric name -> dose
+
+    columns = []  # (ROI name, metric name), in order of first appearance
+    for _, _, _, _, metrics in rows:
+        for roi_name, roi_metrics in metrics.items():
+            for metric_name in sorted(roi_metrics):
+                if (roi_name, metric_name) not in columns:
+                    columns.append((roi_name, metric_name))
+
+    with io.open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Exam", "Date", "Beam Set", "Registration"] + ["{} {} (cGy)".format(roi_name, metric_name) for roi_name, metric_name in columns])
+        for exam_name, date, bs_name, registration, metrics in rows:
+            values = []
+            for roi_name, metric_name in columns:
+                value = metrics.get(roi_name, {}).get(metric_name)
+                values.append("" if value is None else "{:.1f}".format(value))
+            writer.writerow([exam_name, date, bs_name, registration] + values)
+
+
 class QACTAdaptiveAnalysisForm(Form):
     """Windows Form that allows user to select parameters for an analysis of whether a replan is needed on an adaptive exam
 
@@ -51,7 +391,7 @@ class QACTAdaptiveAnalysisForm(Form):
         # Make sure data is sufficient
 
         # External ROI exists
-        ext_name = [roi.Name for roi in case.PatientModel.RegionsOfInterest if roi.Type == "External"]
+        ext_name = [roi.name for roi in snapshot.rois_of_type("External")]
         if not ext_name:
             MessageBox.Show("There is no external ROI. Click OK to abort script.", "No External ROI")
             sys.exit(1)
@@ -69,19 +409,8 @@ class QACTAdaptiveAnalysisForm(Form):
             MessageBox.Show("There is no external geometry on the TPCT. Click OK to abort the script.", "No External Geometry")
             sys.exit(1)
 
-        # Possible QACTs are not the TPCT, not registered to TPCT in opposite direction, and not in same frame of reference as TPCT
-        ext_approved = self.ext_name in [struct.OfRoi.Name for ss_ in case.PatientModel.StructureSets for approved_set in ss_.ApprovedStructureSets for struct in approved_set.ApprovedRoiStructures]
-        qacts = []
-        for exam in case.Examinations:
-            if exam.Name == self.tpct.Name:  # Exam is the TPCT
-                continue
-            if exam.EquipmentInfo.FrameOfReference == self.tpct.EquipmentInfo.FrameOfReference:  # Exam is in same FoR as TPCT
-                continue
-            if self.tpct.Name in [reg.RegistrationSource.ToExamination.Name for reg in case.Registrations if reg.RegistrationSource.FromExamination.Name == exam.Name]:  # Exam is registered to TPCT
-                continue
-            if ext_approved and not ss.RoiGeometries[self.ext_name].HasContours():
-                continue
-            qacts.append(exam)
+        ext_approved = snapshot.is_approved(self.ext_name)
+        qacts = possible_qacts(self.tpct, self.ext_name)
         if not qacts:  # No other exams w/ an external
             criteria = ["It is not the TPCT (planning exam for current plan).", 
                         "It is not registered with the TPCT in the opposite direction (QACT -> TPCT).",
@@ -366,7 +695,7 @@ def qact_adaptive_analysis():
     No exam name contains a comma
     """
 
-    global case, plan
+    global case, plan, snapshot, reg_index
 
     # Get current variables
     try:
@@ -374,6 +703,8 @@ def qact_adaptive_analysis():
     except:
         MessageBox.Show("There is no case loaded. Click OK to abort script.", "No Case Loaded")
         sys.exit(1)  # Exit script with an error
+    snapshot = CaseSnapshot(case)  # ROI names, geometry states, and approvals, read once
+    reg_index = RegistrationIndex(case)  # Registrations, read once
     try:
         plan = get_current("Plan")
     except:
@@ -391,107 +722,152 @@ def qact_adaptive_analysis():
     else:
         qact_name = form.qact
     qact = case.Examinations[qact_name]
-    if not case.PatientModel.StructureSets[qact.Name].RoiGeometries[form.ext_name].HasContours():
-        case.PatientModel.RegionsOfInterest[form.ext_name].CreateExternalGeometry(Examination=qact)
     copy_geoms = [geom for geom, cbs in form.geom_cbs.items() if cbs[0].Checked]
     deform_geoms = [geom for geom, cbs in form.geom_cbs.items() if cbs[1] is not None and cbs[1].Checked]
 
-    # Compute rigid registration, if necessary
-    reg = [reg for reg in case.Registrations if reg.RegistrationSource.FromExamination.Name == tpct.Name and reg.RegistrationSource.ToExamination.Name == qact.Name]
-    if reg:
-        reg = reg[0]
-    else:
-        case.ComputeRigidImageRegistration(FloatingExaminationName=qact.Name, ReferenceExaminationName=tpct.Name, HighWeightOnBones=True)
-
-        # Navigate to registration & allow user to make changes
-        ui = get_current("ui")
-        ui.TitleBar.MenuItem["Patient Modeling"].Button_Patient_Modeling.Click()
-        ui = get_current("ui")  # New UI so that "Image Registration" tab is available
-        ui.TabControl_Modules.TabItem["Image Registration"].Select()
-        ui.ToolPanel.TabItem["Registrations"].Select()
-        ui = get_current("ui")  # New UI so that list of registrations is available
-        [tree_item for tree_item in ui.ToolPanel.RegistrationList.TreeItem if qact.Name in re.match(r"<.+'((.+(, )?)+)'>", str(tree_item)).group(1).split(", ")][0].Select()
-        ui.ToolPanel.TabItem["Scripting"].Select()
-        await_user_input("Review the rigid registration and make any necessary changes.")
-
-    # Deformable registration
-    grp_name = [srg.Name for srg in case.PatientModel.StructureRegistrationGroups for dsr in srg.DeformableStructureRegistrations if dsr.FromExamination.Name == tpct.Name and dsr.ToExamination.Name == qact.Name]  # Find deformable reg in structure reg group for TPCT -> QACT
-    if grp_name:
-        grp_name = grp_name[0]
-    else:
-        grp_name = "{} to {}".format(tpct.Name, qact.Name)
-        case.PatientModel.CreateHybridDeformableRegistrationGroup(RegistrationGroupName=grp_name, ReferenceExaminationName=tpct.Name, TargetExaminationNames=[qact.Name])
-
-    # Deform POI geometries
-    #poi_names = [geom.OfPoi.Name for geom in case.PatientModel.StructureSets[tpct.Name].PoiGeometries if abs(geom.Point.x) < 1000]  # POI w/ no geometry has infinite coordinates
-    #case.MapPoiGeometriesDeformably(PoiGeometryNames=poi_names, StructureRegistrationGroupNames=[grp_name], ReferenceExaminationNames=[tpct.Name], TargetExaminationNames=[qact.Name])
-
-    # Copy ROI geometries
-    if copy_geoms: 
-        case.PatientModel.CopyRoiGeometries(SourceExamination=tpct, TargetExaminationNames=[qact.Name], RoiNames=copy_geoms)
-        # Crop to FOV
-        approved_fov_names = list(set([struct.OfRoi.Name for ss_ in case.PatientModel.StructureSets for approved_set in ss_.ApprovedStructureSets for struct in approved_set.ApprovedRoiStructures if struct.OfRoi.Type == "Field-Of-view"]))
-        unapproved_fov_names = [roi.Name for roi in case.PatientModel.RegionsOfInterest if roi.Type == "FieldOfView" and roi.Name not in approved_fov_names]
-        if unapproved_fov_names:
-            fov = case.PatientModel.RegionsOfInterest[unapproved_fov_names[0]]
-        elif approved_fov_names:
-            matches = [re.match("Field-Of-View( \((\d+)\))?", roi.Name, re.IGNORECASE) for roi in case.PatientModel.RegionsOfInterest if re.match("Field-Of-View( \((\d+)\))?", roi.Name, re.IGNORECASE)]
-            if matches:
-                match = sorted(matches, key=lambda match: 0 if not match.group(1) else int(match.group(2)))[-1]
-                if match.group(1):
-                    fov_name = "Field-Of-View ({})".format(match.group(2) + 1)
-                else:
-                    fov_name = "Field-Of-View (1)"
-            fov = case.PatientModel.CreateRoi(Name=fov_name, Type="FieldOfView")
-        else:
-            fov = case.PatientModel.CreateRoi(Name="Field-Of-View", Type="FieldOfView")
-        fov.CreateFieldOfViewROI(ExaminationName=qact.Name)
-        for roi_name in copy_geoms:  # Intersect FOV and each geometry on exam, if possible
-            case.PatientModel.RegionsOfInterest[roi_name].CreateAlgebraGeometry(Examination=qact, ExpressionA={ 'Operation': "Union", 'SourceRoiNames': [roi_name], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ExpressionB={ 'Operation': "Union", 'SourceRoiNames': [fov.Name], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ResultOperation="Intersection", ResultMarginSettings={ 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 })
-
-    # Deform ROI geometries
-    if deform_geoms:
-        case.MapRoiGeometriesDeformably(RoiGeometryNames=deform_geoms, StructureRegistrationGroupNames=[grp_name], ReferenceExaminationNames=[tpct.Name], TargetExaminationNames=[qact.Name])
+    fov, _ = prepare_qacts(tpct, [qact], form.ext_name, copy_geoms, deform_geoms)
     
     # Resize dose grid
     dose_dist = plan.TreatmentCourse.TotalDose
-    dg = plan.GetDoseGrid()
-    minimum, maximum = tpct.Series[0].ImageStack.GetBoundingBox()
-    for geom in case.PatientModel.StructureSets[qact.Name].RoiGeometries:
-        if geom.HasContours():
-            geom_min, geom_max = geom.GetBoundingBox()
-            # If any infinite coordinates, skip this geometry (nothing will ever be over 1000...)
-            if any([abs(coords[coord]) > 1000 for coords in [geom_min, geom_max] for coord in ["x", "y", "z"]]):
-                continue
-            minimum = {coord: min(minimum[coord], geom_min[coord]) for coord in minimum}
-            maximum = {coord: max(maximum[coord], geom_max[coord]) for coord in maximum}
-    num_voxels = {coord: (maximum[coord] - minimum[coord]) / dg.VoxelSize[coord] for coord in minimum}
-    plan.UpdateDoseGrid(Corner=minimum, VoxelSize=dg.VoxelSize, NumberOfVoxels=num_voxels)
-    dose_dist.UpdateDoseGridStructures()
+    resize_dose_grid(tpct, [qact.Name])
 
     # Compute dose on QACT
     if dose_dist.DoseValues is None:
         MessageBox.Show("The dose distribution of the current plan has no dose, so dose will not be computed on the QACT.", "No Dose")
     else:
-        # Create eval dose for each beam set
-        for bs in plan.BeamSets:
-            bs.ComputeDoseOnAdditionalSets(ExaminationNames=[qact.Name], FractionNumbers=[0])
-        # Update dose grid structures for the new eval doses
-        doe = [doe for doe in fe.DoseOnExaminations for fe in case.TreatmentDelivery.FractionEvaluations if doe.OnExamination.Name == qact.Name][0]  # All eval doses on QACT
-        for i in range(plan.BeamSets.Count):
-            list(doe.DoseEvaluations)[-i].UpdateDoseGridStructures()
+        # Create eval dose for each beam set, and update dose grid structures for the new eval doses
+        compute_eval_doses([qact.Name])
 
     # Map dose (alternative to "compute dose")
     #deformable = case.Registrations[0].StructureRegistrations["Deformable Registration1"]
     #case.MapDose(DoseDistribution=dose_dist, StructureRegistration=deformable)
 
     # Rename TPCT and QACT if needed
-    add_date_to_exam_name(tpct)
-    add_date_to_exam_name(qact)
-    if "TPCT" not in tpct.Name:
-        tpct.Name += " (TPCT)"
-    if "QACT" not in qact.Name:
-        qact.Name += " (QACT)"
+    rename_exams(tpct, [qact])
 
     # Delete unnecessary ROI
-    fov.DeleteRoi()
+    if fov is not None:
+        fov.DeleteRoi()
+
+
+def qact_adaptive_trend(deform=False, output_path=None):
+    """Perform the QACT adaptive analysis on every possible QACT in the case, and write a fraction-by-fraction table of target coverage and OAR doses
+
+    No GUI. The possible QACTs are those in `qact_adaptive_analysis` that are CTs with a CT-to-density table (so, e.g., MR, PET, and exams without a density table are never registered or computed on). Only QACTs without results in the local store are processed, so each later run only computes the new QACTs:
+    1. Rigidly register the TPCT to each new QACT, if necessary. Existing registrations are reused; new ones are not reviewed, and are marked "Computed" in the table.
+    2. Copy (or, if `deform` is True, deform) all ROI geometries on the TPCT to the new QACTs, in one call for all QACTs. Support geometries are always copied. Geometries approved on a QACT are skipped.
+    3. Compute each beam set's dose on all new QACTs (see `compute_eval_doses`), on the plan's current dose grid. Unlike `qact_adaptive_analysis`, trend mode does not resize the dose grid, because that would discard the plan dose. If the QACT anatomy extends past the grid, resize it (and recompute the plan dose) before running.
+    4. Compute DVH metrics (targets: D95%, D98%, and mean; organs: max and mean) for each beam set's evaluation dose on each new QACT, and save them in the store.
+    5. Write the table: one row per beam set for the plan, then one row per beam set per QACT, in acquisition date order. Doses are per fraction, in cGy.
+
+    The store is a JSON file in the user's temp folder, named from a hash of the patient ID, case, and plan. QACTs are identified by DICOM series instance UID, so renaming an exam does not make it new. The store also records a fingerprint of the plan dose (dose grid, beam MUs, dose algorithm, and number of fractions). If the plan is re-optimized, or its dose grid or dose algorithm changes, the stored QACT results are discarded and all QACTs are processed again.
+
+    Parameters
+    ----------
+    deform: bool
+        True to deform the geometries, False to copy them (as in the default `qact_adaptive_analysis` selections)
+    output_path: str
+        Absolute path to the CSV table to write
+        Defaults to "<plan name> QACT Trend.csv" in the store's folder
+    """
+
+    global case, plan, snapshot, reg_index
+
+    # Get current variables
+    try:
+        patient = get_current("Patient")
+        case = get_current("Case")
+    except:
+        MessageBox.Show("There is no case loaded. Click OK to abort script.", "No Case Loaded")
+        sys.exit(1)  # Exit script with an error
+    snapshot = CaseSnapshot(case)  # ROI names, geometry states, and approvals, read once
+    reg_index = RegistrationIndex(case)  # Registrations, read once
+    try:
+        plan = get_current("Plan")
+    except:
+        MessageBox.Show("There is no plan loaded. Click OK to abort script.", "No Plan Loaded")
+        sys.exit(1)
+
+    # Check for dose before anything in the case is changed
+    if plan.TreatmentCourse.TotalDose.DoseValues is None:
+        MessageBox.Show("The dose distribution of the current plan has no dose, so dose cannot be computed on the QACTs. Click OK to abort script.", "No Dose")
+        sys.exit(1)
+
+    ext_name = [roi.name for roi in snapshot.rois_of_type("External")]
+    if not ext_name:
+        MessageBox.Show("There is no external ROI. Click OK to abort script.", "No External ROI")
+        sys.exit(1)
+    ext_name = ext_name[0]
+    tpct = plan.GetStructureSet().OnExamination
+    # No user picks the QACTs, so only use CTs that dose can be computed on
+    qacts = [exam for exam in possible_qacts(tpct, ext_name) if exam.EquipmentInfo.Modality == "CT" and exam.EquipmentInfo.ImagingSystemReference is not None]
+    if not qacts:
+        MessageBox.Show("There are no possible QACTs. A QACT must be a CT with a CT-to-density table. Click OK to abort script.", "No Possible QACTs")
+        sys.exit(1)
+
+    store_path = trend_store_path(patient.PatientID, case.CaseName, plan.Name)
+    store = read_trend_store(store_path, plan_dose_fingerprint())  # If the plan dose changed, all QACTs are new
+
+    # New QACTs are those whose series are not in the store
+    old_names = [qact.Name for qact in qacts]  # Names before renaming
+    series = {}  # QACT name (before renaming) -> (series instance UID, acquisition date)
+    for qact in qacts:
+        dcm = qact.GetAcquisitionDataFromDicom()["SeriesModule"]
+        series[qact.Name] = (dcm["SeriesInstanceUID"], dcm["SeriesDateTime"].ToString("yyyy-MM-dd") if dcm["SeriesDateTime"] else "")
+    new_qacts = [qact for qact in qacts if series[qact.Name][0] not in store["Exams"]]
+
+    # ROIs to copy or deform, and to report
+    roi_names = [roi.name for roi in snapshot.contoured_rois(tpct.Name) if roi.type not in ["External", "FieldOfView"]]
+    support_names = set(roi.name for roi in snapshot.rois_of_type("Support"))
+    metric_names = [roi_name for roi_name in roi_names if snapshot.roi(roi_name).type in TARGET_TYPES or snapshot.roi(roi_name).type == "Organ"]
+    target_names = set(roi_name for roi_name in metric_names if snapshot.roi(roi_name).type in TARGET_TYPES)
+
+    # Planned doses are recomputed every run, since the plan may have changed
+    planned_metrics = [(bs.DicomPlanLabel, dvh_metrics(bs.FractionDose, metric_names, target_names, tpct.Name)) for bs in plan.BeamSets]
+
+    new_metrics = {}  # QACT name (before renaming) -> beam set name -> ROI name -> metric name -> dose
+    if new_qacts:
+        new_qact_names = [qact.Name for qact in new_qacts]
+        if deform:
+            copy_geoms = [roi_name for roi_name in roi_names if roi_name in support_names]  # Cannot deform a support geometry
+            deform_geoms = [roi_name for roi_name in roi_names if roi_name not in support_names]
+        else:
+            copy_geoms, deform_geoms = roi_names, []
+        fov, reg_status = prepare_qacts(tpct, new_qacts, ext_name, copy_geoms, deform_geoms, review=False)
+
+        # The dose grid is left alone: changing it would discard the plan dose, so the next run would stop at the no-dose check
+        eval_doses = compute_eval_doses(new_qact_names)
+
+        # Compute the metrics for each new QACT
+        for qact_name in new_qact_names:
+            new_metrics[qact_name] = {}
+            for bs in plan.BeamSets:
+                dose_eval = eval_doses.get((qact_name, bs.DicomPlanLabel))
+                if dose_eval is not None:
+                    new_metrics[qact_name][bs.DicomPlanLabel] = dvh_metrics(dose_eval, metric_names, target_names, qact_name)
+
+        if fov is not None:
+            fov.DeleteRoi()
+
+        # Rename before saving, so that the store has the exams' final names
+        rename_exams(tpct, new_qacts)
+
+    # Save the new QACTs' metrics, and the current names of the QACTs already in the store (an exam may have been renamed since its metrics were saved)
+    for qact, old_name in zip(qacts, old_names):
+        uid, date = series[old_name]
+        if old_name in new_metrics:
+            store["Exams"][uid] = {"Name": qact.Name, "Date": date, "Registration": reg_status[old_name], "Metrics": new_metrics[old_name]}
+        else:
+            store["Exams"][uid]["Name"] = qact.Name
+    write_trend_store(store_path, store)
+
+    # Table rows: the plan, then the QACTs from the store
+    rows = [(tpct.Name, "", bs_name, "", metrics) for bs_name, metrics in planned_metrics]  # (exam name, date, beam set name, registration, metrics)
+    for exam in sorted(store["Exams"].values(), key=lambda exam: (exam["Date"], exam["Name"])):
+        for bs_name, metrics in sorted(exam["Metrics"].items()):
+            rows.append((exam["Name"], exam["Date"], bs_name, exam["Registration"], metrics))
+
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(store_path), "{} QACT Trend.csv".format(re.sub(r'[<>:"/\\|?*]', "_", plan.Name)))
+    write_trend_table(output_path, rows)
+    MessageBox.Show("Computed {} new QACT(s); {} QACT(s) in total. See '{}'.".format(len(new_qacts), len(store["Exams"]), output_path), "QACT Adaptive Trend")
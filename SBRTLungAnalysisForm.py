@@ -11,7 +11,7 @@ clr.AddReference("System.Windows.Forms")
 
 import sys
 from collections import OrderedDict
-from re import search, sub
+from re import sub
 
 import pandas as pd  # Interpolation data from RTOG 0813 is read in as a DataFrame
 from connect import *  # Interact w/ RS
@@ -32,10 +32,13 @@ from scipy import interpolate  # Interpolate stats for a given PTV volume
 from System.Drawing import *
 from System.Windows.Forms import *
 
+from CaseSnapshot import CaseSnapshot
+from UniqueNames import name_item
+
 
 # Don't set these yet so that sbrt_lung_analysis functions can be used by other scripts that don't necessarily need these variables
 # But must be global so multiple functions have easy access
-case = plan = beam_set = None
+case = plan = beam_set = snapshot = None
 report_name = None
 plan_names = OrderedDict()
 
@@ -65,48 +68,30 @@ def create_roi_if_absent(roi_name, roi_type):
             color = colors[roi_name].replace(";", ",")  # E.g., "255; 1; 2; 3" -> "255, 1, 2, 3"
         except:
             color = "255, 255, 255, 255"
-        roi_name = name_item(roi_name, [r.Name for r in case.PatientModel.RegionsOfInterest], 16)
+        roi_name = name_item(roi_name, snapshot.roi_names, 16)
         roi = case.PatientModel.CreateRoi(Name=roi_name, Type=roi_type, Color=color)
+        snapshot.add_roi(roi)
     return roi
 
 
 def get_latest_roi(base_roi_name, **kwargs):
     # Helper function that returns the ROI with the given "base name" and largest copy number
     # kwargs:
-    # unapproved_only: If True, consider only the ROIs that are not part of any approved structure set in the case (defaults to False)
+    # unapproved_only: If True, consider only the ROIs that are not part of any approved structure set on the exam (defaults to False)
     # non_empty_only: If True, consider only the ROIs with geometries on the exam (defaults to False)
     # exam: If `nonempty_only` or `unapproved_only` are True, the exam on which to check for a geometry/approval (defaults to current exam)
 
-    unapproved_only = kwargs.get("unapproved_only", False)
-    non_empty_only = kwargs.get("non_empty_only", False)
-    exam = kwargs.get("exam", get_current("Examination"))
+    exam = kwargs.get("exam")
+    if exam is None:
+        exam = get_current("Examination")
+    roi_name = snapshot.latest_roi_name(base_roi_name, kwargs.get("unapproved_only", False), kwargs.get("non_empty_only", False), exam.Name)
+    return None if roi_name is None else case.PatientModel.RegionsOfInterest[roi_name]
 
-    base_roi_name = base_roi_name.lower()
 
-    rois = case.PatientModel.RegionsOfInterest
-    if unapproved_only:
-        approved_roi_names = set(geom.OfRoi.Name for approved_ss in case.PatientModel.StructureSets[exam.Name].ApprovedStructureSets for geom in approved_ss.ApprovedRoiStructures)
-        rois = [roi for roi in rois if roi.Name not in approved_roi_names]
-    if non_empty_only:
-        rois = [roi for roi in rois if case.PatientModel.StructureSets[exam.Name].RoiGeometries[roi.Name].HasContours()]
-    
-    latest_copy_num = copy_num = -1
-    latest_roi = None
-    for roi in rois:
-        roi_name = roi.Name.lower()
-        if roi_name == base_roi_name:
-            copy_num = 0
-        else:
-            m = search(" \((\d+)\)$".format(base_roi_name), roi_name)
-            if m:  # There is a copy number
-                grp = m.group()
-                length = min(16 - len(grp), len(base_roi_name))
-                if roi_name[:length] == base_roi_name[:length]:
-                    copy_num = int(m.group(1))
-        if copy_num > latest_copy_num:
-            latest_copy_num = copy_num
-            latest_roi = roi
-    return latest_roi
+def delete_roi(roi):
+    # Helper function that deletes the ROI and removes it from the snapshot
+    snapshot.remove_roi(roi.Name)
+    roi.DeleteRoi()
 
 
 def doses_on_addl_set(exam_names=None):
@@ -129,21 +114,6 @@ def get_text_color(bkgrd_color):
     return white if r * 0.00117 + g * 0.0023 + b * 0.00045 <= 0.72941 else black
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
-
-
 def create_iso_roi(dose_dist, idl):
     # Helper function that creates ROI/geometry from `idl` isodose in the given dose distribution
     # Return the ROI
@@ -437,7 +407,7 @@ def sbrt_lung_analysis(**kwargs):
     For simplicity and consistency, all colors are System.Drawing.Color objects, not reportlab.lib.colors.Color objects. They are converted to the latter only when necessary.
     """
 
-    global case, plan, beam_set, report_name
+    global case, plan, beam_set, snapshot, report_name
 
     # Get current variables
     try:
@@ -461,6 +431,7 @@ def sbrt_lung_analysis(**kwargs):
         MessageBox.Show("There are no beam sets in the current plan. Click OK to abort script.", "No Beam Sets")
         sys.exit(1)  # Exit script with an error
     exam = plan.GetStructureSet().OnExamination
+    snapshot = CaseSnapshot(case)  # ROI names, geometry states, and approvals, read once
 
     gui = kwargs.get("gui", False)
 
@@ -486,17 +457,16 @@ def sbrt_lung_analysis(**kwargs):
     # Exams w/ the necessary geometries (necessary to select plans and eval doses)
     exam_names = {}
     for e in case.Examinations:
-        roi_geoms = case.PatientModel.StructureSets[e.Name].RoiGeometries
-        normal_tissue = get_latest_roi("E-PTV_Ev20", exam=e, nonempty_only=True)
-        ext = [geom.OfRoi.Name for geom in roi_geoms if geom.OfRoi.Type == "External"]
-        lungs_ctv = get_latest_roi("Lungs-CTV", exam=e, nonempty_only=True)
+        normal_tissue = get_latest_roi("E-PTV_Ev20", exam=e, non_empty_only=True)
+        ext = [roi.name for roi in snapshot.rois_of_type("External")]
+        lungs_ctv = get_latest_roi("Lungs-CTV", exam=e, non_empty_only=True)
         if lungs_ctv is None:
-            lungs_ctv = get_latest_roi("Lungs-ITV", exam=e, nonempty_only=True)
+            lungs_ctv = get_latest_roi("Lungs-ITV", exam=e, non_empty_only=True)
         if normal_tissue is not None and ext and lungs_ctv is not None:
             exam_names[e.Name] = [normal_tissue.Name, ext[0], lungs_ctv.Name]
 
     # All PTV names
-    all_ptv_names = [roi.Name for roi in case.PatientModel.RegionsOfInterest if roi.Type.upper() == "PTV"]
+    all_ptv_names = [roi.name for roi in snapshot.rois if roi.type.upper() == "PTV"]
     if not all_ptv_names:
         msg = "There are no PTVs in the current case."
         if not gui:
@@ -687,7 +657,7 @@ def sbrt_lung_analysis(**kwargs):
                             plan_stat_val = round(plan_stat_val, 2)  # Round CI to 2 decimal places
                             bk_color = yellow if plan_stat_val < 1 else green if plan_stat_val <= 1.2 else yellow if plan_stat_val <= 1.5 else red
                             
-                            iso_roi.DeleteRoi()
+                            delete_roi(iso_roi)
 
                         elif stat == "Paddick CI":
                             iso_roi = create_iso_roi(dose_dist, rx)  # Create ROI from 100% isodose
@@ -704,8 +674,8 @@ def sbrt_lung_analysis(**kwargs):
                             plan_stat_val = round(plan_stat_val, 2)  # Round CI to 2 decimal places
                             bk_color = yellow if plan_stat_val < 1 else green if plan_stat_val <= 1.2 else yellow if plan_stat_val <= 1.5 else red
                             
-                            intersect_roi.DeleteRoi()
-                            iso_roi.DeleteRoi()
+                            delete_roi(intersect_roi)
+                            delete_roi(iso_roi)
                         
                         elif stat == "GI (R50%)":
                             iso_roi = create_iso_roi(dose_dist, 0.5 * rx)  # 50% isodose
@@ -713,7 +683,7 @@ def sbrt_lung_analysis(**kwargs):
                             plan_stat_val = struct_set.RoiGeometries[iso_roi.Name].GetRoiVolume() / ptv_vol  # Volume of 50% isodose geometry as proportion of PTV volume
                             plan_stat_val = round(plan_stat_val, 2)  # Round GI to 2 decimal places
                             
-                            iso_roi.DeleteRoi()
+                            delete_roi(iso_roi)
 
                         elif stat == "D2cm [%]":
                             normal_tissue_name = exam_names[exam_name][0]
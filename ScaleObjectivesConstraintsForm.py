@@ -7,6 +7,8 @@ from connect import *
 from System.Drawing import *
 from System.Windows.Forms import *
 
+from OptFunctionSchema import function_schema
+
 
 plan = beam_set = objectives = constraints = None
 
@@ -292,9 +294,9 @@ def scale_objectives_constraints():
     # Scale each objective or constraint
     for o_c in objectives_constraints:
         dfp = o_c.DoseFunctionParameters
-        if not hasattr(dfp, "PercentStdDeviation"):  # The objective or constraint is scalable
-            for attr in dir(dfp):
+        schema = function_schema(dfp)  # Dose parameter names are looked up once per function type
+        if schema is not None:  # Function type is recognized. A uniformity constraint has no dose parameters, so is not changed
+            for attr in schema.dose_param_names:
                 # Multiply each dose parameter by the scale factor
-                if "DoseLevel" in attr:
-                    val = getattr(dfp, attr)
-                    setattr(dfp, attr, val * scale_factor)
+                val = getattr(dfp, attr)
+                setattr(dfp, attr, val * scale_factor)
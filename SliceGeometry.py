@@ -0,0 +1,122 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+MOBIUS_SPACING_TOL = 0.1  # Mobius rejects slices whose spacing differs from the expected spacing by more than 0.1 mm
+
+
+def get_exam_z_positions(exam):
+    # Helper function that returns a sorted NumPy array of the z-coordinates (mm) of the slices in an examination's image stack
+    # RS slice positions are offsets (cm) from the image stack corner
+
+    img_stack = exam.Series[0].ImageStack
+    z = (img_stack.Corner.z + np.array(list(img_stack.SlicePositions), dtype=float)) * 10  # cm -> mm
+    return np.sort(z)
+
+
+def find_spacing_errors(z, tol=MOBIUS_SPACING_TOL):
+    """Find the non-uniform gaps in a stack of slices
+
+    The expected spacing is the median distance between adjacent slices.
+
+    Parameters
+    ----------
+    z: array-like of float
+        Slice z-coordinates (mm), sorted ascending
+    tol: float
+        Maximum allowed difference (mm) between a gap and the expected spacing
+        Defaults to the Mobius tolerance of 0.1 mm
+
+    Returns
+    -------
+    2-tuple (expected spacing (mm), indices i of the gaps z[i] -> z[i + 1] that are out of tolerance)
+    """
+
+    z = np.asarray(z, dtype=float)
+    if z.size < 3:
+        return (float(z[1] - z[0]) if z.size == 2 else 0.0), np.array([], dtype=int)
+    deltas = np.diff(z)
+    spacing = float(np.median(deltas))
+    return spacing, np.flatnonzero(np.abs(deltas - spacing) > tol)
+
+
+def slices_to_drop(z, tol=MOBIUS_SPACING_TOL):
+    """Compute the smallest set of slices to remove so that the remaining slices are uniformly spaced
+
+    The remaining slices must lie on a single grid with the expected (median) spacing, with no missing grid positions.
+    Every slice is tried as the grid anchor at once (an n x n residual matrix), and the anchor that puts the most slices on its grid wins.
+    Off-grid slices are dropped, and of the on-grid slices, only the longest run of consecutive grid positions is kept.
+
+    Parameters
+    ----------
+    z: array-like of float
+        Slice z-coordinates (mm), sorted ascending
+    tol: float
+        Maximum allowed difference (mm) between a gap and the expected spacing
+        Defaults to the Mobius tolerance of 0.1 mm
+
+    Returns
+    -------
+    A sorted NumPy array of the indices of the slices to remove (empty if the spacing is already uniform)
+    """
+
+    z = np.asarray(z, dtype=float)
+    spacing, errors = find_spacing_errors(z, tol)
+    if not errors.size:
+        return np.array([], dtype=int)
+
+    # Grid index of every slice (columns) relative to every possible anchor slice (rows)
+    offsets = z[np.newaxis, :] - z[:, np.newaxis]
+    grid_idx = np.rint(offsets / spacing).astype(int)
+    on_grid = np.abs(offsets - grid_idx * spacing) <= tol / 2  # Half the tolerance on each side keeps every adjacent gap within tolerance
+    anchor = int(np.argmax(on_grid.sum(axis=1)))
+
+    # Keep the slice closest to each grid position
+    keep_idx = np.flatnonzero(on_grid[anchor])
+    residuals = np.abs(offsets[anchor, keep_idx] - grid_idx[anchor, keep_idx] * spacing)
+    order = np.lexsort((residuals, grid_idx[anchor, keep_idx]))
+    keep_idx = keep_idx[order]
+    positions = grid_idx[anchor, keep_idx]
+    first = np.concatenate(([True], np.diff(positions) != 0))
+    keep_idx, positions = keep_idx[first], positions[first]
+
+    # Longest run of consecutive grid positions
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [positions.size]))
+    longest = int(np.argmax(ends - starts))
+    keep = np.zeros(z.size, dtype=bool)
+    keep[keep_idx[starts[longest]:ends[longest]]] = True
+    return np.flatnonzero(~keep)
+
+
+def analyze_series(z_by_series, tol=MOBIUS_SPACING_TOL):
+    """Check the slice spacing of many series (e.g., all phases of a 4DCT) in one pass
+
+    Parameters
+    ----------
+    z_by_series: dict
+        Series identifier (e.g., exam name or SeriesInstanceUID) -> sorted slice z-coordinates (mm)
+    tol: float
+        Maximum allowed difference (mm) between a gap and the expected spacing
+        Defaults to the Mobius tolerance of 0.1 mm
+
+    Returns
+    -------
+    An OrderedDict of series identifier -> dictionary with keys:
+        - "Spacing": expected spacing (mm)
+        - "Errors": list of 2-tuples (z before the gap, z after the gap) for the gaps that are out of tolerance
+        - "Drop": indices of the slices to remove
+    """
+
+    results = OrderedDict()
+    for series_id, z in z_by_series.items():
+        z = np.asarray(z, dtype=float)
+        spacing, errors = find_spacing_errors(z, tol)
+        results[series_id] = {
+            "Spacing": spacing,
+            "Errors": [(float(z[i]), float(z[i + 1])) for i in errors],
+            "Drop": slices_to_drop(z, tol) if errors.size else np.array([], dtype=int)
+        }
+    return results
@@ -6,6 +6,10 @@ clr.AddReference("System.Windows.Forms")
 
 import os
 import re
+import sys
+from time import time
+
+import numpy as np
 
 from connect import *  # Interact w/ RS
 
@@ -13,23 +17,95 @@ from connect import *  # Interact w/ RS
 from System.Drawing import *
 from System.Windows.Forms import *
 
+from UniqueNames import name_item, roi_name_allocator
+
 
 case = None
 
 
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
+def plan_propagation(structs, ref_img, target_imgs):
+    """Return the deformable mapping calls needed to propagate ROIs from the reference image to the other images
+
+    The (structure x target image) matrix of needed maps is built from one pass over the target images' geometries: a map is needed wherever the ROI has no contours.
+    Structures that need maps to the same set of images are grouped, so each group is one MapRoiGeometriesDeformably call instead of one call per ROI.
+
+    Parameters
+    ----------
+    structs: List[str]
+        Names of the ROIs to propagate
+    ref_img: str
+        Name of the reference exam
+    target_imgs: List[str]
+        Names of the exams to propagate to. The reference exam is ignored if present.
+
+    Returns
+    -------
+    List of (ROI names, exam names) pairs, one per mapping call, with names in the order of `structs` and `target_imgs`
+    """
+
+    imgs = [img for img in target_imgs if img != ref_img]
+    needed = dict((struct, []) for struct in structs)  # ROI name -> exam names that don't have this ROI contoured
+    for img in imgs:
+        geoms = case.PatientModel.StructureSets[img].RoiGeometries  # Read once per exam
+        for struct in structs:
+            if not geoms[struct].HasContours():
+                needed[struct].append(img)
+
+    groups = {}  # Tuple of exam names -> ROI names
+    order = []  # Exam name tuples in the order first needed
+    for struct in structs:
+        key = tuple(needed[struct])
+        if not key:
+            continue
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(struct)
+    return [(groups[key], list(key)) for key in order]
+
+
+def motion_envelope(roi_name, exam_names):
+    """Compute the motion of an ROI across exams (e.g., the phases of a 4DCT)
+
+    Each exam's geometry is read once: its center and bounding box (two bridge calls). Everything else is computed with NumPy.
+    RS patient coordinates: x is R-L, y is A-P, z is I-S.
+
+    Parameters
+    ----------
+    roi_name: str
+        Name of the ROI (e.g., the target)
+    exam_names: List[str]
+        Names of the exams, in phase order
+
+    Returns
+    -------
+    Dictionary with keys:
+    - "Centroids": n x 3 array of the ROI center on each exam (the centroid trajectory)
+    - "Displacements": n x 3 array of each center minus the mean center
+    - "Amplitude": Length-3 array of the peak-to-peak motion along each axis
+    - "Amplitude3D": Greatest distance between any two centers
+    - "Envelope": 2 x 3 array of the low and high corners of the union of the bounding boxes on all exams
+    - "Phases": Dictionary with keys "Min", "Mid", and "Max": the exam in which the center is most inferior, median, and most superior
+    """
 
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
+    centroids = np.empty((len(exam_names), 3))
+    bounds = np.empty((len(exam_names), 2, 3))
+    for i, img in enumerate(exam_names):
+        geom = case.PatientModel.StructureSets[img].RoiGeometries[roi_name]
+        ctr = geom.GetCenterOfRoi()
+        centroids[i] = [ctr.x, ctr.y, ctr.z]
+        bounds[i] = [[pt.x, pt.y, pt.z] for pt in geom.GetBoundingBox()]
+
+    pairwise = np.sqrt(((centroids[:, np.newaxis, :] - centroids[np.newaxis, :, :]) ** 2).sum(axis=2))  # Distance between each pair of centers
+    order = np.argsort(centroids[:, 2])
+    return {
+        "Centroids": centroids,
+        "Displacements": centroids - centroids.mean(axis=0),
+        "Amplitude": centroids.max(axis=0) - centroids.min(axis=0),
+        "Amplitude3D": pairwise.max(),
+        "Envelope": np.array([bounds.min(axis=(0, 1)), bounds.max(axis=(0, 1))]),
+        "Phases": {"Min": exam_names[order[0]], "Mid": exam_names[order[len(order) // 2]], "Max": exam_names[order[-1]]}
+    }
 
 
 class StructurePropagation4DCTForm(Form):
@@ -212,6 +288,14 @@ class StructurePropagation4DCTForm(Form):
             else:
                 structs.extend([geom.OfRoi.Name for geom in case.PatientModel.StructureSets[ref_img].RoiGeometries[target].GetDependentRois() if geom.OfRoi.Name not in structs])
 
+        # Time per stage, printed at the end
+        timings = []  # List of (stage, seconds)
+        last_time = [time()]
+        def record(stage):
+            now = time()
+            timings.append((stage, now - last_time[0]))
+            last_time[0] = now
+
         grp_4d = case.ExaminationGroups[grp_name]
         target_imgs = [item.Examination.Name for item in grp_4d.Items]  # All images in the group except the reference image
 
@@ -223,92 +307,77 @@ class StructurePropagation4DCTForm(Form):
         # Create deformable registration
         dir_grp_name = name_item("DIR for ROI Propagation", [srg.Name for srg in case.PatientModel.StructureRegistrationGroups])
         case.PatientModel.CreateHybridDeformableRegistrationGroup(RegistrationGroupName=dir_grp_name, ReferenceExaminationName=ref_img, TargetExaminationNames=target_imgs, AlgorithmSettings=default_dir_settings)
+        record("Registration")
 
         # Map ROI geometries from reference to all images in group
         # Ignore ROIs that already have contours on the given target image
+        # One mapping call per group of ROIs that need the same target images
+        for roi_group, imgs in plan_propagation(structs, ref_img, target_imgs):
+            case.MapRoiGeometriesDeformably(RoiGeometryNames=roi_group, StructureRegistrationGroupNames=[dir_grp_name] * len(imgs), ReferenceExaminationNames=[ref_img] * len(imgs), TargetExaminationNames=imgs)  # Map the geometries from the reference to the targets
+        record("Mapping")
+
+        roi_names = roi_name_allocator(case)
+        gated_imgs = None  # Computed when the first target is found
         for struct in structs:
-            # Deform geometry to all target images w/o geometry for this ROI
-            imgs = [img for img in target_imgs if img != ref_img and not case.PatientModel.StructureSets[img].RoiGeometries[struct].HasContours()]  # Exam names that don't have this ROI contoured
-            if imgs:
-                case.MapRoiGeometriesDeformably(RoiGeometryNames=[struct], StructureRegistrationGroupNames=[dir_grp_name] * len(imgs), ReferenceExaminationNames=[ref_img] * len(imgs), TargetExaminationNames=imgs)  # Map the geometry from the refernce to the taregets
-            
             # If ROI is a target, create ITV
             roi = case.PatientModel.RegionsOfInterest[struct]
             if roi.OrganData.OrganType == "Target":
-                gated_imgs = [img for img in target_imgs if "Gated" in case.Examinations[img].GetAcquisitionDataFromDicom()["SeriesModule"]["SeriesDescription"]]  # Only create ITV from gated images
-                non_gated_imgs = [img for img in target_imgs if img not in gated_imgs]
-                
-                # Create "real" and temporary ITV. Temp ITV is from geometries on all phases in group. We will set the geometry for the "real" ITV later by copying the temp ITV geometry into it and then underiving it. The ITV cannot depend on itself
-                real_itv_name = "i{}".format(roi.Type.upper())
-                real_itv_name = name_item(real_itv_name, [r.Name for r in case.PatientModel.RegionsOfInterest], 16)  # Get unique name for "real" ITV
-                real_itv = case.PatientModel.CreateRoi(Name=real_itv_name, Color=roi.Color, Type=roi.Type)
+                if gated_imgs is None:  # Same for every target
+                    gated_imgs = [img for img in target_imgs if "Gated" in case.Examinations[img].GetAcquisitionDataFromDicom()["SeriesModule"]["SeriesDescription"]]  # Only create ITV from gated images
+                    non_gated_imgs = [img for img in target_imgs if img not in gated_imgs]
                 
-                itv_name = "{}^Temp".format(real_itv_name)
-                itv_name = name_item(itv_name, [r.Name for r in case.PatientModel.RegionsOfInterest], 16)  # Get unique name for ITV
+                # ITV is the union of the target on the gated images and on the reference image
+                # CreateITV writes the same geometry to every exam it is given, so including the reference image needs no temporary ROIs or per-phase algebra
+                itv_name = roi_names.allocate("i{}".format(roi.Type.upper()))  # Get unique name for ITV
                 itv = case.PatientModel.CreateRoi(Name=itv_name, Color=roi.Color, Type=roi.Type)
-                itv.CreateITV(SourceRegionOfInterest=roi, ExaminationNames=gated_imgs, MarginSettingsData={ 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 })  # ITV from geometries on gated images
-                
-                # Copy ITV to each non-gated phase in group
-                if non_gated_imgs:
-                    case.PatientModel.CopyRoiGeometries(SourceExamination=case.Examinations[gated_imgs[0]], TargetExaminationNames=non_gated_imgs, RoiNames=[struct])  # Doesn't matter which gated exam we copy from b/c geometry is the same on all
-                
-                # Union each ITV geometry with ITV geometry on the reference exam
-
-                # Create copy of target on reference exam
-                copied_target_name = "Copy of {}".format(struct)
-                copied_target_name = name_item(copied_target_name, [r.Name for r in case.PatientModel.RegionsOfInterest], 16)  # Get unique name for copied target ROI
-                copied_target = case.PatientModel.CreateRoi(Name=copied_target_name)  # ROI that is copy of the target ROI
-                
-                # Copied target's geometry is same as target's
-                copied_target.SetAlgebraExpression(ExpressionA={ 'Operation': "Union", 'SourceRoiNames': [struct], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ExpressionB={ 'Operation': "Union", 'SourceRoiNames': [], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ResultOperation="None", ResultMarginSettings={ 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 })
-                copied_target.UpdateDerivedGeometry(Examination=case.Examinations[ref_img])
-
-                # Copy the copied target to other phases in group
-                case.PatientModel.CopyRoiGeometries(SourceExamination=case.Examinations[ref_img], TargetExaminationNames=[img for img in gated_imgs if img != ref_img], RoiNames=[copied_target_name])
+                itv_imgs = gated_imgs + [img for img in [ref_img] if img not in gated_imgs]
+                itv.CreateITV(SourceRegionOfInterest=roi, ExaminationNames=itv_imgs, MarginSettingsData={ 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 })
 
-                # Union the copied target with the ITV geometry on each phase
-                for img in gated_imgs:
-                    if img != ref_img:
-                        real_itv.SetAlgebraExpression(ExpressionA={ 'Operation': "Union", 'SourceRoiNames': [itv.Name], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ExpressionB={ 'Operation': "Union", 'SourceRoiNames': [copied_target_name], 'MarginSettings': { 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ResultOperation="Union", ResultMarginSettings={ 'Type': "Expand", 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 })
-                        real_itv.UpdateDerivedGeometry(Examination=case.Examinations[img])
-
-                # Underived "real" ITV since we're deleting the ROI it depends on
-                real_itv.DeleteExpression()
-
-                # Delete the temp ITV and the copied target
-                itv.DeleteRoi()
-                copied_target.DeleteRoi()
+                # Copy ITV to each non-gated phase in group
+                copy_imgs = [img for img in non_gated_imgs if img not in itv_imgs]
+                if copy_imgs:
+                    case.PatientModel.CopyRoiGeometries(SourceExamination=case.Examinations[itv_imgs[0]], TargetExaminationNames=copy_imgs, RoiNames=[itv_name])  # Doesn't matter which exam we copy from b/c geometry is the same on all
+
+        record("ITV creation")
+
+        # Add external geometry if necessary
+        ext_name = None
+        derived = []  # Names of derived ROIs, read once for all images
+        for roi in case.PatientModel.RegionsOfInterest:
+            if roi.Type == "External" and ext_name is None:
+                ext_name = roi.Name
+            elif roi.DerivedRoiExpression:
+                derived.append(roi.Name)
+        if ext_name is None:
+            ext_name = case.PatientModel.CreateRoi(Name="External", Color="white", Type="External").Name
+        ext = case.PatientModel.RegionsOfInterest[ext_name]
+        for target_img in target_imgs:
+            if not case.PatientModel.StructureSets[target_img].RoiGeometries[ext_name].HasContours():
+                ext.CreateExternalGeometry(Examination=case.Examinations[target_img])
+        record("External creation")
 
         # Update derived geometries
         for target_img in target_imgs:
             geoms = case.PatientModel.StructureSets[target_img].RoiGeometries
-            # Add external geometry if necessary
-            ext = [geom for geom in geoms if geom.OfRoi.Type == "External"]
-            if ext:
-                ext = ext[0]
-            else:
-                ext = case.PatientModel.CreateRoi(Name="External", Color="white", Type="External")
-                ext.CreateExternalGeometry(Examination=qact)
-            derived_rois = [roi.Name for roi in case.PatientModel.RegionsOfInterest if roi.DerivedRoiExpression and all(geoms[dep_roi].HasContours() for dep_roi in geoms[roi.Name].GetDependentRois())]  # Derived ROIs with contours for all dependent ROIs
+            derived_rois = [roi_name for roi_name in derived if all(geoms[dep_roi].HasContours() for dep_roi in geoms[roi_name].GetDependentRois())]  # Derived ROIs with contours for all dependent ROIs
             if derived_rois:
                 case.PatientModel.UpdateDerivedGeometries(RoiNames=derived_rois, Examination=case.Examinations[target_img])
+        record("Derived updates")
+
+        print("Structure propagation: {} structures, {} images".format(len(structs), len(target_imgs)))
+        for stage, secs in timings:
+            print("    {}: {:.1f} s".format(stage, secs))
 
-        # Transverse coordinate of target center-of-mass in all target images
-        ctrs_of_mass = [case.PatientModel.StructureSets[img].RoiGeometries[target].GetCenterOfRoi() for img in list(set([ref_img] + target_imgs))]
-        ctrs_of_mass_x = [ctr.x for ctr in ctrs_of_mass]
-        ctrs_of_mass_y = [ctr.y for ctr in ctrs_of_mass]
-        ctrs_of_mass_z = [ctr.z for ctr in ctrs_of_mass]
-        max_idx = ctrs_of_mass_z.index(max(ctrs_of_mass_z))
-        min_idx = ctrs_of_mass_z.index(min(ctrs_of_mass_z))
-        mid_idx = ctrs_of_mass_z.index(sorted(ctrs_of_mass_z)[len(ctrs_of_mass_z) / 2])
+        # Target motion over all images in the group (and the reference image, if it is not in the group)
+        motion = motion_envelope(target, target_imgs + [img for img in [ref_img] if img not in target_imgs])
         text = "Phases:\n"
-        text = "    Max: '{}'.\n".format(grp_4d.Items[max_idx].Examination.Name)
-        text += "    Min: '{}'.\n".format(grp_4d.Items[min_idx].Examination.Name)
-        text += "    Mid: '{}'.\n".format(grp_4d.Items[mid_idx].Examination.Name)
+        for label in ["Max", "Min", "Mid"]:
+            text += "    {}: '{}'.\n".format(label, motion["Phases"][label])
         text += "\nMax excursion:\n"
-        text += "    R-L: {:.2f} cm\n".format(max(abs(ctr - ctr_2) for ctr in ctrs_of_mass_x for ctr_2 in ctrs_of_mass_x))
-        text += "    I-S: {:.2f} cm\n".format(max(abs(ctr - ctr_2) for ctr in ctrs_of_mass_y for ctr_2 in ctrs_of_mass_y))
-        text += "    P-A: {:.2f} cm\n".format(max(abs(ctr - ctr_2) for ctr in ctrs_of_mass_z for ctr_2 in ctrs_of_mass_z))
+        for axis, amplitude in zip(["R-L", "A-P", "I-S"], motion["Amplitude"]):
+            text += "    {}: {:.2f} cm\n".format(axis, amplitude)
+        text += "    3D: {:.2f} cm\n".format(motion["Amplitude3D"])
+        text += "\nMotion envelope: {:.2f} x {:.2f} x {:.2f} cm (R-L x A-P x I-S)\n".format(*(motion["Envelope"][1] - motion["Envelope"][0]))
         self.result.Text = text
         self.result.Visible = True
 
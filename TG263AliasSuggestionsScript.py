@@ -0,0 +1,52 @@
+import clr
+clr.AddReference("System.Windows.Forms")
+import csv
+import io
+import os
+import sys
+
+from System.Windows.Forms import MessageBox
+
+import TG263Nomenclature
+
+
+def tg263_alias_suggestions(log_path=r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Output Files\TG263NamesCRMCColors\TG263NamesCRMCColors.txt", output_path=None, min_score=0.5):
+    """Suggest TG-263 primary names for the ROI names that TG263NamesCRMCColorsScript could not match
+
+    Write a CSV with one row per distinct unmatched name (case insensitive, ignoring copy numbers), most frequent first: the name, how many times it was logged, and up to three suggested primary names with their similarity scores.
+    Names with a good suggestion can be added to that primary name's "Possible Alternate Names" in the TG-263 spreadsheet, so that they match exactly next time.
+    No RS objects are used, so this script can run without a patient loaded.
+
+    Parameters
+    ----------
+    log_path: str
+        Absolute path to the no-match log (one ROI name per line)
+    output_path: str
+        Absolute path to the CSV to write
+        Defaults to "TG263 Alias Suggestions.csv" in the log's folder
+    min_score: float
+        Minimum similarity (0 to 1) for a suggestion
+    """
+
+    if not os.path.isfile(log_path):
+        MessageBox.Show("The no-match log '{}' does not exist. Click OK to abort the script.".format(log_path), "No Log File")
+        sys.exit(1)
+    with io.open(log_path, "r", encoding="utf-8") as f:
+        names = f.read().splitlines()
+
+    tg263 = TG263Nomenclature.load()
+    suggestions = TG263Nomenclature.suggest_aliases(names, tg263, min_score)
+
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(log_path), "TG263 Alias Suggestions.csv")
+    with io.open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ROI Name", "Occurrences", "Suggestion 1", "Score 1", "Suggestion 2", "Score 2", "Suggestion 3", "Score 3"])
+        for name, count, matches in suggestions:
+            row = [name, count]
+            for primary_name, score in matches:
+                row.extend([primary_name, "{:.2f}".format(score)])
+            writer.writerow(row)
+
+    num_suggested = sum(1 for _, _, matches in suggestions if matches)
+    MessageBox.Show("Suggested TG-263 names for {} of {} unmatched ROI names. See '{}'.".format(num_suggested, len(suggestions), output_path), "TG-263 Alias Suggestions")
@@ -4,26 +4,13 @@ clr.AddReference("System.Windows.Forms")
 from random import randint
 from re import search, split, IGNORECASE
 
-import numpy as np
-import pandas as pd
 from connect import *
 from System.Drawing import Color
 from System.Windows.Forms import *
 
-
-def name_item(item, l, max_len=sys.maxsize):
-    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
-    # Limit name to `max_len` characters
-    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
-
-    l_lower = [l_item.lower() for l_item in l]
-    copy_num = 0
-    old_item = item
-    while item.lower() in l_lower:
-        copy_num += 1
-        copy_num_str = " ({})".format(copy_num)
-        item = "{}{}".format(old_item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
-    return item[:max_len]
+import TG263Nomenclature
+from CaseSnapshot import CaseSnapshot
+from UniqueNames import roi_name_allocator
 
 
 def tg263_names_crmc_colors():
@@ -32,7 +19,8 @@ def tg263_names_crmc_colors():
     Recolor target ROIs according to target type
     Ensure that ROI names are unique. E.g., if two ROIs need to be renamed to "Lungs", the first is "Lungs" and the second is "Lungs (1)". Duplicate colors are allowed (but aren't ideal), except for targets.
     If an ROI name is not already in the spreadsheet list of TG-263-compliant names, try to match it to a name in the "Possible Alternate Names" column
-    If no match is found, write ROI name to "TG263NamesCRMCColors.txt" output file.
+    If there is no exact match, use a confident fuzzy match (see TG263Nomenclature.Nomenclature.auto_match), e.g., "Bladdder" -> "Bladder" (similarity 0.94). Near misses such as "Esophagous" -> "Esophagus" (0.76) are logged as no-matches instead
+    If no match is found, write ROI name to "TG263NamesCRMCColors.txt" output file. TG263AliasSuggestionsScript turns this file into alias suggestions.
     For best results, an ROI should be in at most one "Possible Alternate Names" lists. If it is in multiple, choose the first from the top.
     """
 
@@ -43,51 +31,65 @@ def tg263_names_crmc_colors():
         MessageBox.Show("There is no case loaded. Click OK to abort script.", "No Case Loaded")
         sys.exit(1)
 
-    # Open file
-    tg263 = pd.read_csv(r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Data\TG263 Nomenclature with CRMC Colors.csv")
+    # Compiled TG-263 lookup tables (the spreadsheet is only parsed when it has changed)
+    tg263 = TG263Nomenclature.load()
     
-    approved_roi_names = set(geom.OfRoi.Name for ss in case.PatientModel.StructureSets for approved_ss in ss.ApprovedStructureSets for geom in approved_ss.ApprovedRoiStructures)
+    approved_roi_names = CaseSnapshot(case).approved_roi_names()  # Approved on any exam
 
     # Targets
     target_types = ["CTV", "GTV", "ITV", "PTV"]
     targets = {target_type: [] for target_type in target_types}
     
+    roi_names = roi_name_allocator(case)
+
     with open(r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Output Files\TG263NamesCRMCColors\TG263NamesCRMCColors.txt", "a") as no_match:  # Output file
         for roi in case.PatientModel.RegionsOfInterest:
-            if roi.Name in approved_roi_names:
+            old_name = roi.Name
+            if old_name in approved_roi_names:
                 continue
 
-            roi_name = split(" \(\d+\)$", roi.Name)[0]  # Remove copy number if it is present
+            roi_name = split(" \(\d+\)$", old_name)[0]  # Remove copy number if it is present
             new_name = None
+            is_target = False
             
             # Add ROI to target types list if necessary
+            roi_type = roi.Type.upper()
             for target_type in target_types:
-                if roi.Type.upper() == target_type or search("(?<!\-){}".format(target_type), roi_name, IGNORECASE):  # ROI name contains target type, but not after a minus sign (e.g., "PTV 70 Gy" but not "Bladder-PTV")
+                if roi_type == target_type or search("(?<!\-){}".format(target_type), roi_name, IGNORECASE):  # ROI name contains target type, but not after a minus sign (e.g., "PTV 70 Gy" but not "Bladder-PTV")
                     targets[target_type].append(roi)  # Add to list of those targets
+                    is_target = True
 
             # Find the matching TG-263 name
             # Check alternate names first due to special case w/ "Bowel" not getting renamed to "Bag_Bowel" b/c "Bowel" is also in the "TG263-Primary Name" column
-            for _, row in tg263.iterrows():
-                alt_names = [alt_name.lower() for alt_name in str(row["Possible Alternate Names"]).split("; ")]
-                if roi_name.lower() in alt_names:
-                    new_name = row["TG263-Primary Name"]
-
-                    # Add ROI to target types list if necessary
-                    if row["Target Type"] == "Target":
-                        targets[row["Major Category"]].append(roi)
-                    break
+            new_name = tg263.primary_name(roi_name)
+            if new_name is not None:
+                # Add ROI to target types list if necessary
+                target_type = tg263.target_type(new_name)
+                if target_type is not None:
+                    targets[target_type].append(roi)
+                    is_target = True
             
             # If it's not an alternate name, is it already TG-263 compliant?
-            if row["Target Type"] != "Target" and new_name is None and roi_name in tg263["TG263-Primary Name"].values:
+            elif roi_name in tg263:
                 new_name = roi_name
+
+            # If it's neither, is it a confident fuzzy match (e.g., a typo)?
+            else:
+                new_name = tg263.auto_match(roi_name)
+                if new_name is not None:
+                    print("Fuzzy match: '{}' -> '{}'".format(old_name, new_name))
+                    target_type = tg263.target_type(new_name)
+                    if target_type is not None:
+                        targets[target_type].append(roi)
+                        is_target = True
            
             # Account for left/right structure
             temp_name = new_name if new_name is not None else roi_name
             if not search("_[LR]$", temp_name):
-                new_name_l = "{}_L".format(temp_name)
-                new_name_r = "{}_R".format(temp_name)
-                if new_name_l in tg263["TG263-Primary Name"].values and new_name_r in tg263["TG263-Primary Name"].values:  # Right and left names are valid
-                    geom_on_left = [ss.RoiGeometries[roi.Name].GetCenterOfRoi().x > 0 for ss in case.PatientModel.StructureSets if ss.RoiGeometries[roi.Name].HasContours()]  # True if the geometry is on the patient's left, False otherwise
+                lateral_pair = tg263.lateral_pair(temp_name)
+                if lateral_pair is not None:  # Right and left names are valid
+                    new_name_l, new_name_r = lateral_pair
+                    geom_on_left = [ss.RoiGeometries[old_name].GetCenterOfRoi().x > 0 for ss in case.PatientModel.StructureSets if ss.RoiGeometries[old_name].HasContours()]  # True if the geometry is on the patient's left, False otherwise
                     if geom_on_left:  # There are geometries
                         if all(geom_on_left):  # Geometry is on the left on all exams
                             new_name = new_name_l
@@ -96,23 +98,20 @@ def tg263_names_crmc_colors():
 
             # No match
             if new_name is None:
-                no_match.write("{}\n".format(roi.Name))
+                no_match.write("{}\n".format(old_name))
                 continue
 
             # Rename, and recolor non-target
-            roi.Name = name_item(new_name, [r.Name for r in case.PatientModel.RegionsOfInterest if r.Name != roi.Name], 16)
+            roi_names.discard(old_name)  # ROI may keep its own name
+            roi.Name = roi_names.allocate(new_name)
             
-            all_target_names = [target.Name for target_list in targets.values() for target in target_list]
-            if roi.Name not in all_target_names:
-                new_color = tg263.loc[tg263["TG263-Primary Name"] == new_name, "Color"].values[0]
-                a, r, g, b = [int(component) for component in new_color.split("; ")]
-                new_color = Color.FromArgb(a, r, g, b)
-                roi.Color = new_color
+            if not is_target:
+                a, r, g, b = tg263.colors[new_name]
+                roi.Color = Color.FromArgb(a, r, g, b)
 
         # Recolor targets and change type if necessary
         for target_type, rois in targets.items():
-            target_color = tg263.loc[tg263["TG263-Primary Name"] == target_type.upper(), "Color"].values[0]
-            a, r, g, b = [int(component) for component in target_color.split("; ")]
+            a, r, g, b = tg263.colors[target_type.upper()]
             # Evenly spaced shades from half to full opacity
             for i, roi in enumerate(rois):
                 if len(rois) > 1:
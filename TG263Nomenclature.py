@@ -0,0 +1,267 @@
+import csv
+import io
+import os
+import pickle
+import re
+import tempfile
+from collections import Counter
+from hashlib import md5
+
+
+TG263_PATH = r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Data\TG263 Nomenclature with CRMC Colors.csv"
+CACHE_VERSION = 1
+
+# A fuzzy match is applied automatically only if it scores at least AUTO_APPLY_SCORE, and beats the best match to any other primary name by at least AUTO_APPLY_MARGIN (so that, e.g., an ambiguous name is never given the wrong laterality)
+AUTO_APPLY_SCORE = 0.85
+AUTO_APPLY_MARGIN = 0.1
+
+
+def trigrams(name):
+    # Helper function that returns the set of character trigrams in the normalized `name`
+    # Normalized: lowercase, with each run of non-alphanumeric characters replaced by a space (so "Lung_L", "lung L", and "Lung-L" all match)
+    # Padded so that short names, and the starts and ends of names, have trigrams
+    name = "  {} ".format(re.sub(r"[^a-z0-9]+", " ", name.lower()).strip())
+    return set(name[i:i + 3] for i in range(len(name) - 2))
+
+
+class FuzzyIndex(object):
+    """Character-trigram inverted index over names, for approximate lookup
+
+    Similarity is the Dice coefficient of the trigram sets: 2 * (number of shared trigrams) / (total number of trigrams in both names). 1 is an exact match after normalization.
+    Only names that share at least one trigram with the query are scored, so a lookup does not scan every name.
+
+    Example:
+    index = FuzzyIndex({"spinalcord": "SpinalCord", "cord": "SpinalCord", "heart": "Heart"})
+    index.matches("Spinal Crd")  # [("SpinalCord", 0.636...)]
+    """
+
+    def __init__(self, names):
+        # `names`: Dictionary of name to match against -> value to return for it (e.g., alias -> primary name)
+
+        self._values = []  # Value for each name
+        self._sizes = []  # Number of trigrams in each name
+        self._postings = {}  # Trigram -> indices of the names that contain it
+        for i, (name, value) in enumerate(names.items()):
+            grams = trigrams(name)
+            self._values.append(value)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(i)
+
+    def matches(self, name, min_score=0.0, limit=3):
+        """Return the best-matching values for `name`
+
+        Parameters
+        ----------
+        name: str
+            Name to look up
+        min_score: float
+            Minimum similarity (0 to 1) to include
+        limit: int
+            Maximum number of matches to return
+
+        Returns
+        -------
+        List of (value, similarity) pairs, best first, with at most one pair per value
+        """
+
+        grams = trigrams(name)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+
+        best = {}  # Value -> best similarity among its names
+        for i, num_shared in shared.items():
+            score = 2.0 * num_shared / (len(grams) + self._sizes[i])
+            if score >= min_score and score > best.get(self._values[i], -1):
+                best[self._values[i]] = score
+        return sorted(best.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+class Nomenclature(object):
+    """TG-263 nomenclature spreadsheet ("TG263 Nomenclature with CRMC Colors.csv"), compiled into lookup tables
+
+    Every lookup is a dictionary or set lookup, so processing n ROI names is O(n) regardless of the spreadsheet size.
+    Use `load` instead of the constructor, so that the spreadsheet is only parsed when it has changed.
+
+    Attributes
+    ----------
+    primary_names: set
+        All "TG263-Primary Name" values
+    aliases: dict
+        Lowercase "Possible Alternate Names" value -> primary name
+        If an alternate name is listed in multiple rows, the first row wins.
+    lateral_pairs: dict
+        Name -> (left primary name, right primary name), for each name X such that both "X_L" and "X_R" are primary names
+    colors: dict
+        Primary name -> (A, R, G, B) color components
+    categories: dict
+        Primary name -> ("Target Type", "Major Category"), e.g., ("Target", "PTV") or ("Anatomic", "Organ")
+    """
+
+    def __init__(self, rows):
+        # `rows`: Spreadsheet rows, as dictionaries with keys "TG263-Primary Name", "Possible Alternate Names", "Color", "Target Type", and "Major Category"
+
+        self.primary_names = set()
+        self.aliases = {}
+        self.colors = {}
+        self.categories = {}
+        for row in rows:
+            name = row["TG263-Primary Name"]
+            if not name:
+                continue
+            if name not in self.primary_names:  # Duplicate rows: the first row wins, as in a top-down search
+                self.primary_names.add(name)
+                self.categories[name] = (row.get("Target Type") or None, row.get("Major Category") or None)
+                color = row.get("Color")
+                if color:
+                    self.colors[name] = tuple(int(component) for component in color.split("; "))
+            for alias in (row.get("Possible Alternate Names") or "").split("; "):
+                alias = alias.strip().lower()
+                if alias and alias not in self.aliases:
+                    self.aliases[alias] = name
+
+        self.lateral_pairs = {}
+        for name in self.primary_names:
+            if name.endswith("_L") and "{}_R".format(name[:-2]) in self.primary_names:
+                self.lateral_pairs[name[:-2]] = (name, "{}_R".format(name[:-2]))
+
+    def __contains__(self, name):
+        return name in self.primary_names
+
+    def primary_name(self, alias):
+        # Primary name for which `alias` is a possible alternate name (case insensitive), or None
+        return self.aliases.get(alias.lower())
+
+    def lateral_pair(self, name):
+        # (Left, right) primary names for the unlateralized `name` (e.g., "Lung" -> ("Lung_L", "Lung_R")), or None
+        return self.lateral_pairs.get(name)
+
+    def target_type(self, name):
+        # Major category (e.g., "PTV") if `name` is a target's primary name, None otherwise
+        target_type, major_category = self.categories.get(name, (None, None))
+        return major_category if target_type == "Target" else None
+
+    @property
+    def fuzzy_index(self):
+        # FuzzyIndex over the primary names and alternate names, built on first use
+        if "_fuzzy_index" not in self.__dict__:
+            names = dict((name.lower(), name) for name in self.primary_names)
+            names.update(self.aliases)
+            self.__dict__["_fuzzy_index"] = FuzzyIndex(names)
+        return self.__dict__["_fuzzy_index"]
+
+    def fuzzy_matches(self, name, min_score=0.0, limit=3):
+        # List of (primary name, similarity) pairs that best match `name`, best first (see `FuzzyIndex.matches`)
+        return self.fuzzy_index.matches(name, min_score, limit)
+
+    def auto_match(self, name):
+        """Return the primary name that `name` fuzzy-matches confidently enough to apply without review, or None
+
+        The best match must score at least `AUTO_APPLY_SCORE`, and beat the runner-up by at least `AUTO_APPLY_MARGIN`.
+        """
+
+        matches = self.fuzzy_matches(name, limit=2)
+        if not matches or matches[0][1] < AUTO_APPLY_SCORE:
+            return None
+        if len(matches) > 1 and matches[0][1] - matches[1][1] < AUTO_APPLY_MARGIN:
+            return None
+        return matches[0][0]
+
+    def _state(self):
+        # Helper method that returns the lookup tables as built-in containers, for the cache file
+        return dict((attr, getattr(self, attr)) for attr in ["primary_names", "aliases", "lateral_pairs", "colors", "categories"])
+
+    @classmethod
+    def _from_state(cls, state):
+        # Helper method that creates a Nomenclature from the lookup tables in a cache file, without parsing the spreadsheet
+        nomenclature = cls.__new__(cls)
+        nomenclature.__dict__.update(state)
+        return nomenclature
+
+
+def read_rows(path):
+    # Helper function that returns the rows of the CSV spreadsheet as dictionaries
+    with io.open(path, "r", newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def load(path=TG263_PATH, cache_path=None):
+    """Return the compiled Nomenclature for the spreadsheet
+
+    The compiled tables are pickled to a binary cache file. The cache is reused until the spreadsheet's modification time or size changes.
+
+    Parameters
+    ----------
+    path: str
+        Absolute path to the TG-263 CSV spreadsheet
+        Defaults to the CRMC spreadsheet on the T: drive
+    cache_path: str
+        Absolute path to the cache file
+        Defaults to a file (named from a hash of `path`) in the user's temp folder, since the spreadsheet's folder may not be writable
+
+    Returns
+    -------
+    The Nomenclature
+    """
+
+    if cache_path is None:
+        cache_path = os.path.join(tempfile.gettempdir(), "TG263Nomenclature", "{}.pickle".format(md5(os.path.abspath(path).lower().encode("utf-8")).hexdigest()))
+    stat = os.stat(path)  # Raises an error if the spreadsheet does not exist
+    source = [stat.st_mtime, stat.st_size]
+
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+        if cache.get("Version") == CACHE_VERSION and cache.get("Source") == source:
+            return Nomenclature._from_state(cache["Tables"])
+    except (IOError, OSError, EOFError, ValueError, KeyError, AttributeError, pickle.UnpicklingError):
+        pass
+
+    nomenclature = Nomenclature(read_rows(path))
+
+    # A cache that cannot be written is not an error: the spreadsheet is just parsed again next time
+    try:
+        cache_dir = os.path.dirname(cache_path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(cache_path, "wb") as f:
+            pickle.dump({"Version": CACHE_VERSION, "Source": source, "Tables": nomenclature._state()}, f, protocol=2)
+    except (IOError, OSError):
+        pass
+
+    return nomenclature
+
+
+def suggest_aliases(names, nomenclature, min_score=0.5, limit=3):
+    """Rank alias suggestions for ROI names that did not match the spreadsheet (e.g., from the TG263NamesCRMCColors no-match log)
+
+    Parameters
+    ----------
+    names: iterable of str
+        Unmatched ROI names, with repeats. Copy numbers (e.g., " (1)") are ignored.
+    nomenclature: Nomenclature
+        The compiled spreadsheet
+    min_score: float
+        Minimum similarity for a suggestion
+    limit: int
+        Maximum number of suggestions per name
+
+    Returns
+    -------
+    List of (ROI name, number of occurrences, [(primary name, similarity), ...]) tuples, most frequent names first
+    Names are grouped case insensitively, under their most common spelling. A name with no suggestions has an empty list.
+    """
+
+    counts = Counter(re.sub(r" \(\d+\)$", "", name.strip()) for name in names if name.strip())
+    spellings = {}  # Lowercase name -> Counter of spellings
+    for name, count in counts.items():
+        spellings.setdefault(name.lower(), Counter())[name] += count
+
+    suggestions = []
+    for spelling_counts in spellings.values():
+        name = spelling_counts.most_common(1)[0][0]
+        matches = nomenclature.fuzzy_matches(name, min_score, limit)
+        suggestions.append((name, sum(spelling_counts.values()), matches))
+    suggestions.sort(key=lambda item: (-item[1], -(item[2][0][1] if item[2] else 0), item[0].lower()))
+    return suggestions
@@ -0,0 +1,119 @@
+import sys
+from re import search
+
+
+class NameAllocator(object):
+    """Generate unique names within one namespace (e.g., the ROIs in a case), case insensitive
+
+    The existing names are read once, into a set. Every name handed out by `allocate` is added to the set automatically, so later names are unique among themselves too.
+    The next copy number to try is remembered per base name, so repeated allocations of the same base name do not retry copy numbers that are already taken.
+
+    Example:
+    roi_names = roi_name_allocator(case)
+    roi_names.allocate("Isocenter Name A")  # "Isocenter Name A (1)" if "Isocenter Name A" already exists
+    """
+
+    def __init__(self, names=(), max_len=sys.maxsize):
+        # `names`: Existing names in the namespace
+        # `max_len`: Default maximum name length (e.g., 16 for RS ROI names)
+
+        self.max_len = max_len
+        self._names = set(name.lower() for name in names)
+        self._next_copy_num = {}  # (lowercase base name, max length) -> smallest copy number that might be free
+
+    def __contains__(self, name):
+        return name.lower() in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name):
+        # Mark `name` as used (e.g., an item created or renamed without `allocate`)
+        self._names.add(name.lower())
+
+    def discard(self, name):
+        # Mark `name` as free (e.g., an item was deleted or renamed)
+        # If the name has a copy number, a lower copy number may be free again, so forget the remembered copy numbers
+        self._names.discard(name.lower())
+        if search(r" \(\d+\)$", name):
+            self._next_copy_num.clear()
+
+    def rename(self, old_name, new_name):
+        # Mark `old_name` as free and `new_name` as used
+        self.discard(old_name)
+        self.add(new_name)
+
+    def allocate(self, item, max_len=None):
+        """Return a unique name for `item`, and mark it as used
+
+        Parameters
+        ----------
+        item: str
+            Desired name
+        max_len: int
+            Maximum name length
+            Defaults to the allocator's `max_len`
+
+        If `item` is taken, append the first free copy number, truncating `item` as necessary.
+        E.g., allocate("Isocenter Name A", 16) with existing names ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"] -> "Isocenter Na (2)"
+        """
+
+        if max_len is None:
+            max_len = self.max_len
+        name = item[:max_len]
+        if name.lower() in self._names:
+            key = (item.lower(), max_len)
+            copy_num = self._next_copy_num.get(key, 1)
+            while True:
+                copy_num_str = " ({})".format(copy_num)
+                name = "{}{}".format(item[:(max_len - len(copy_num_str))].strip(), copy_num_str)
+                if name.lower() not in self._names:
+                    break
+                copy_num += 1
+            self._next_copy_num[key] = copy_num + 1
+        self._names.add(name.lower())
+        return name
+
+
+def name_item(item, l, max_len=sys.maxsize):
+    # Helper function that generates a unique name for `item` in list `l` (case insensitive)
+    # Limit name to `max_len` characters
+    # E.g., name_item("Isocenter Name A", ["Isocenter Name A", "Isocenter Na (1)", "Isocenter N (10)"]) -> "Isocenter Na (2)"
+    # For more than one name in the same namespace, use a NameAllocator instead
+
+    return NameAllocator(l, max_len).allocate(item)
+
+
+# Allocators for RS namespaces, seeded from the current names
+# Names in RS are limited to 16 characters except for exams, exam groups, and registration groups
+
+def roi_name_allocator(case):
+    return NameAllocator([roi.Name for roi in case.PatientModel.RegionsOfInterest], 16)
+
+
+def poi_name_allocator(case):
+    return NameAllocator([poi.Name for poi in case.PatientModel.PointsOfInterest], 16)
+
+
+def plan_name_allocator(case):
+    return NameAllocator([plan.Name for plan in case.TreatmentPlans], 16)
+
+
+def beam_set_name_allocator(plan):
+    return NameAllocator([bs.DicomPlanLabel for bs in plan.BeamSets], 16)
+
+
+def beam_name_allocator(beam_set):
+    return NameAllocator([beam.Name for beam in beam_set.Beams], 16)
+
+
+def exam_name_allocator(case):
+    return NameAllocator([exam.Name for exam in case.Examinations])
+
+
+def exam_group_name_allocator(case):
+    return NameAllocator([grp.Name for grp in case.ExaminationGroups])
+
+
+def registration_group_name_allocator(case):
+    return NameAllocator([srg.Name for srg in case.PatientModel.StructureRegistrationGroups])
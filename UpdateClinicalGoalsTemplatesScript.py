@@ -3,23 +3,48 @@ t_path = r"\\vs20filesvr01\groups\CANCER\Physics"  # T: drive
 import clr
 clr.AddReference("System.Drawing")
 clr.AddReference("System.Windows.Forms")
+import json
 import sys
 sys.path.append(r"{}\Scripts\RayStation".format(t_path))
-from datetime import datetime
-from os.path import getmtime
+from hashlib import md5
 
 import pandas as pd
 from connect import *
 from System.Drawing import *
 from System.Windows.Forms import *
 
+import TG263Nomenclature
 from AddClinicalGoalsForm import add_clinical_goals, specific_rois
 
 
-def update_clinical_goals_templates():
+def sheet_hash(data):
+    # Helper function that returns a hash of a clinical goals template's content
+    # `data`: DataFrame of the sheet, as read from the spreadsheet
+    # The ROI name aliases in `specific_rois` are included because they change which ROIs the applied goals are on
+    content = "{}\n{}".format(data.to_csv(index=False), json.dumps(specific_rois, sort_keys=True))
+    return md5(content.encode("utf-8")).hexdigest()
+
+
+def read_manifest(manifest_filepath):
+    # Helper function that returns the template name -> content hash dictionary saved by the last run, or an empty dictionary if there is none
+    try:
+        with open(manifest_filepath, "r") as f:
+            return json.load(f)["Templates"]
+    except (IOError, OSError, ValueError, KeyError):
+        return {}
+
+
+def write_manifest(manifest_filepath, hashes):
+    # Helper function that saves the template name -> content hash dictionary
+    with open(manifest_filepath, "w") as f:
+        json.dump({"Templates": hashes}, f, indent=4, sort_keys=True)
+
+
+def update_clinical_goals_templates(dry_run=False, force=False):
     """Update clinical goals templates in RayStation to match "Clinical Goals" spreadsheet
     
     Requires user interaction due to unscriptable actions delete and create clinical goals template
+    Only templates whose spreadsheet content changed since this script last saved them (or that are missing from RS) are rebuilt. A content hash of each sheet is stored in "T:/Physics/Scripts/Output Files/UpdateClinicalGoalsTemplates/Template Manifest.json".
     If any ROIs in the template are not in the TG-263 spreadsheet, add them to "T:/Physics/Scripts/Output Files/UpdateClinicalGoalsTemplates/Not in TG-263 Spreadsheet.txt" and do not add goals for those ROIs
     
     Goals with a priority (1) need changing after the template is applied. These goals are one of two types:
@@ -28,6 +53,12 @@ def update_clinical_goals_templates():
         - Volume-to-spare goals. These are implemented as absolute volume goals. The volume in the goal is the volume to spare, not the volume that belongs in the goal. Change the absolute volume to the ROI volume less the volume to spare.
           E.g., "At most 910 cGy dose at 700 cc" for an ROI with volume 1000 cc should be changed to "At most 910 cGy dose at 300 cc"
 
+    Parameters
+    ----------
+    dry_run: bool
+        True to print the planned template operations and the ROIs to create, without changing anything, False to update the templates
+    force: bool
+        True to rebuild all templates regardless of the manifest, False to rebuild only changed or missing templates
     """
 
     # Open templates file
@@ -42,42 +73,32 @@ def update_clinical_goals_templates():
         sys.exit(1)
 
     output_filepath = r"{}\Scripts\Output Files\UpdateClinicalGoalsTemplates".format(t_path)
-    last_run_filepath = r"{}\Last Run.txt".format(output_filepath)
-    # Has clinical goals spreadsheet been modified since last script run?
-    dt_fmt = "%Y-%m-%d %H:%M:%S.%f"
-    try:
-        with open(last_run_filepath, "r") as f: 
-            script_time = datetime.strptime(f.read().strip(), dt_fmt)
-            mod_time = datetime.fromtimestamp(getmtime(filepath))  # Spreadsheet modification date
-            if script_time >= mod_time:
-                msg = "The 'Clinical Goals' spreadsheet has not been modified since this script was last run, so the RS clinical goals templates will not be changed. This script takes a while, so are you sure you want to run it?"
-                cont = MessageBox.Show(msg, "No Updates Necessary", MessageBoxButtons.YesNo)
-                if cont == DialogResult.No:
-                    sys.exit()
-    except (FileNotFoundError, TypeError) as e:  # "Last Run" file does not exist, or value in file is not a valid datetime
-        pass
-
-    # Open dummy patient "Master Test"
-    patient_db = get_current("PatientDB")
-    pt = patient_db.QueryPatientInfo(Filter={"LastName": "Test", "FirstName": "Master", "PatientID": "123456789"})
-    if pt == []:  # Test patient does not exist
-        msg = "The patient Master Test (MR# 123456789) does not exist. Click OK to abort the script."
-        MessageBox.Show(msg, "No Test Patient")
-        sys.exit(1)
-    pt = patient_db.LoadPatient(PatientInfo=pt[0])  # If test patient does exist, there will only be one
-    pt.Cases["UpdateClinicalGoalsTemplates"].SetCurrent()
-    case = get_current("Case")
-    case.TreatmentPlans["Test"].SetCurrent()
-    exam = get_current("Examination")
+    manifest_filepath = r"{}\Template Manifest.json".format(output_filepath)
 
     # Remove "DNU" templates
     goals = {name: data for name, data in goals.items() if not name.endswith("DNU")}
 
+    # Which templates have changed since they were last saved?
+    patient_db = get_current("PatientDB")
+    existing = [template["Name"] for template in patient_db.GetClinicalGoalTemplateInfo()]
+    old_hashes = read_manifest(manifest_filepath)
+    new_hashes = {name: sheet_hash(data) for name, data in goals.items()}
+    changed = sorted(name for name in goals if force or name not in existing or old_hashes.get(name) != new_hashes[name])
+    if not changed:
+        msg = "None of the templates in the 'Clinical Goals' spreadsheet have changed since this script last saved them, so the RS clinical goals templates will not be changed. This script takes a while, so are you sure you want to rebuild all templates?"
+        if dry_run:
+            print(msg)
+            return
+        cont = MessageBox.Show(msg, "No Updates Necessary", MessageBoxButtons.YesNo)
+        if cont == DialogResult.No:
+            sys.exit()
+        changed = sorted(goals)
+
     # Read in all TG-263 names
     filename = "TG263 Nomenclature with CRMC Colors.csv"
     filepath = r"{}\{}\{}".format(t_path, rel_filepath, filename)
     try:
-        tg263 = pd.read_csv(filepath, usecols=["Target Type", "Major Category", "TG263-Primary Name", "Color"])
+        tg263 = TG263Nomenclature.load(filepath)  # Name-keyed lookup tables
     except FileNotFoundError:  # Alert user and abort script if CSV file does not exist
         msg = "TG-263 names spreadsheet '{}' does not exist at 'T:\{}'. Click OK to abort the script.".format(filename, rel_filepath)
         MessageBox.Show(msg, "No TG-263 Names Spreadsheet")
@@ -86,60 +107,97 @@ def update_clinical_goals_templates():
     # Process each clinical goals template in the spreadsheet
     no_tg263 = []  # ROI names not in TG-263 spreadsheet
 
-    # Size and center of ROI geometries to be created
-    exam_min, exam_max = exam.Series[0].ImageStack.GetBoundingBox()
-    exam_sz = {dim: exam_max[dim] - exam_min[dim] for dim in "xyz"}
-    exam_ctr = {dim: (exam_min[dim] + exam_max[dim]) / 2 for dim in "xyz"}
-
     all_rois = ["CTV", "GTV", "PTV"]
-    for data in goals.values():
-        data["ROI"] = pd.Series(data["ROI"]).fillna(method="ffill")  # Autofill ROI name (due to vertically merged cells in spreadsheet)
+    for name in changed:  # Only the ROIs needed by the templates to rebuild
+        data = goals[name]
+        data["ROI"] = pd.Series(data["ROI"]).ffill()  # Autofill ROI name (due to vertically merged cells in spreadsheet)
         
         # Get all matching ROI names
         for roi in set(data["ROI"].values):
             if roi in specific_rois:
-                rois = specific_rois[roi]
+                rois = list(specific_rois[roi])  # Copy so that appending lateral names does not change `specific_rois` (and so the template hashes)
             else:
                 rois = [roi]
             for r in rois:
                 for suffix in "LR":
                     r_side = "{}_{}".format(r, suffix)#add_suffix(r, "_{}".format(suffix))
-                    if r_side in tg263["TG263-Primary Name"].values:
+                    if r_side in tg263:
                         rois.append(r_side)
             all_rois.extend(rois)
 
-    # Create all ROIs
-    #roi_geoms = case.PatientModel.StructureSets[exam.Name].RoiGeometries
+    # Color and type of each ROI to create
+    roi_records = {}  # ROI name -> (color, type)
     for roi in set(all_rois):
-        if roi not in tg263["TG263-Primary Name"].values:
+        if roi not in tg263:
             no_tg263.append(roi)
             continue  # Skip this ROI
 
-        row = tg263.loc[tg263["TG263-Primary Name"] == roi, ["Color", "Target Type", "Major Category"]].iloc[0, :]
-        if row["Target Type"] == "Target":
-            roi_type = row["Major Category"]
-            color = "255,255,255,0" if roi_type == "CTV" else "255,255,165,0" if roi_type == "CTV" else "255,255,0,0"
-            roi_type = roi_type[0].upper() + roi_type[1:].lower()
+        target_type = tg263.target_type(roi)
+        if target_type is not None:
+            color = "255,255,255,0" if target_type == "CTV" else "255,255,165,0" if target_type == "CTV" else "255,255,0,0"
+            roi_type = target_type[0].upper() + target_type[1:].lower()
         else:
             if "PRV" in roi or "Ev" in roi:
                 roi_type = "Control"
             else:
                 roi_type = "Organ"
-            color = ",".join(row["Color"].split("; "))
-        if roi not in [r.Name for r in case.PatientModel.RegionsOfInterest]:
-            r = case.PatientModel.CreateRoi(Name=roi, Color=color, Type=roi_type)
-        else:
-            r = case.PatientModel.RegionsOfInterest[roi]
-            r.Color = color
-        
-        # Create geometry just in case clinical goal(s) require it (e.g., vol to spare)
-        # Large geometry (same size as exam just in case vol to spare is large
-        #if not roi_geoms[roi].HasContours():
-        r.CreateBoxGeometry(Size=exam_sz, Examination=exam, Center=exam_ctr) 
+            color = ",".join(str(component) for component in tg263.colors[roi])
+        roi_records[roi] = (color, roi_type)
+
+    if dry_run:
+        for name in sorted(goals):
+            if name not in changed:
+                print("Skip unchanged template '{}'".format(name))
+            elif name in existing:
+                print("Rebuild changed template '{}': delete, apply, and save".format(name))
+            else:
+                print("Build new template '{}': apply and save".format(name))
+        print("Create or update {} ROIs on the test patient: {}".format(len(roi_records), ", ".join(sorted(roi_records))))
+        if no_tg263:
+            print("Skip {} ROIs not in the TG-263 spreadsheet: {}".format(len(set(no_tg263)), ", ".join(sorted(set(no_tg263)))))
+        return
+
+    # Open dummy patient "Master Test"
+    pt = patient_db.QueryPatientInfo(Filter={"LastName": "Test", "FirstName": "Master", "PatientID": "123456789"})
+    if pt == []:  # Test patient does not exist
+        msg = "The patient Master Test (MR# 123456789) does not exist. Click OK to abort the script."
+        MessageBox.Show(msg, "No Test Patient")
+        sys.exit(1)
+    pt = patient_db.LoadPatient(PatientInfo=pt[0])  # If test patient does exist, there will only be one
+    pt.Cases["UpdateClinicalGoalsTemplates"].SetCurrent()
+    case = get_current("Case")
+    case.TreatmentPlans["Test"].SetCurrent()
+    exam = get_current("Examination")
+
+    # Size and center of ROI geometries to be created
+    exam_min, exam_max = exam.Series[0].ImageStack.GetBoundingBox()
+    exam_sz = {dim: exam_max[dim] - exam_min[dim] for dim in "xyz"}
+    exam_ctr = {dim: (exam_min[dim] + exam_max[dim]) / 2 for dim in "xyz"}
+
+    # Create all ROIs, in one undo step
+    existing_rois = set(r.Name for r in case.PatientModel.RegionsOfInterest)  # Read once instead of per ROI
+    created, updated = [], []
+    with CompositeAction("Create clinical goals template ROIs"):
+        for roi, (color, roi_type) in sorted(roi_records.items()):
+            if roi not in existing_rois:
+                r = case.PatientModel.CreateRoi(Name=roi, Color=color, Type=roi_type)
+                existing_rois.add(roi)
+                created.append(roi)
+            else:
+                r = case.PatientModel.RegionsOfInterest[roi]
+                r.Color = color
+                updated.append(roi)
+            
+            # Create geometry just in case clinical goal(s) require it (e.g., vol to spare)
+            # Large geometry (same size as exam just in case vol to spare is large
+            r.CreateBoxGeometry(Size=exam_sz, Examination=exam, Center=exam_ctr)
+    print("Created {} ROIs: {}".format(len(created), ", ".join(created)))
+    print("Recolored {} existing ROIs: {}".format(len(updated), ", ".join(updated)))
+    if no_tg263:
+        print("Skipped {} ROIs not in the TG-263 spreadsheet: {}".format(len(set(no_tg263)), ", ".join(sorted(set(no_tg263)))))
 
-    existing = [template["Name"] for template in patient_db.GetClinicalGoalTemplateInfo()]
     orig_existing = existing[:]
-    for name in goals.keys():
+    for name in changed:
         # Allow user to delete existing template, if it exists
         while name in existing:
             await_user_input("Please delete the template '{}' from RayStation.\nThen resume the script.".format(name))
@@ -153,6 +211,10 @@ def update_clinical_goals_templates():
             await_user_input("Please save the goals as a template named '{}' in RayStation.\nClick OK in 'Save' dialog if it appears.\nThen resume the script.".format(name))
             existing = [template["Name"] for template in patient_db.GetClinicalGoalTemplateInfo()]
 
+        # Record the saved template's content, so that an interrupted run does not rebuild it again
+        old_hashes[name] = new_hashes[name]
+        write_manifest(manifest_filepath, old_hashes)
+
     # Delete any misnamed added templates
     necessary_templates = set(orig_existing + list(goals.keys()))
     extra = set(existing).difference(necessary_templates)
@@ -166,7 +228,3 @@ def update_clinical_goals_templates():
         no_tg263_filepath = r"{}\not in TG-263 Spreadsheet.txt".format(output_filepath)
         with open(no_tg263_filepath, "w") as f:
             f.write("\n".join(sorted(list(set(no_tg263)))))
-
-    # Write datetime to "Last Run" file
-    with open(last_run_filepath, "w") as f:
-        f.write(datetime.now().strftime(dt_fmt))
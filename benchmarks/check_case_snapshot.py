@@ -0,0 +1,76 @@
+"""Check that CaseSnapshot reads each part of the case once, and again after `invalidate`, against the fake `connect` module
+
+Usage:
+python check_case_snapshot.py
+
+Exits with an error if any check fails.
+"""
+
+import os
+import sys
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "fake_rs"))  # Fake `connect`, `clr`, and `System` take the place of the RS modules
+sys.path.insert(1, os.path.dirname(BENCHMARKS_DIR))
+
+import connect  # The fake
+from CaseSnapshot import CaseSnapshot
+
+
+def read_all(snapshot, exam_name):
+    # Helper function that reads every part of the case through the snapshot
+    snapshot.roi_names
+    snapshot.has_contours("PTV", exam_name)
+    snapshot.is_approved("PTV")
+    snapshot.plans
+
+
+def check_invalidate(fixture_path):
+    """Return a list of failed checks (empty if all pass)
+
+    Parameters
+    ----------
+    fixture_path: str
+        Absolute path to the JSON fixture
+    """
+
+    connect.load_fixture(fixture_path)
+    case = connect.get_current("Case")
+    exam_name = connect.get_current("Examination").Name
+    failures = []
+
+    def expect(snapshot, expected, what):
+        if snapshot.num_loads != expected:
+            failures.append("{}: expected loads {}, got {}".format(what, expected, snapshot.num_loads))
+
+    snapshot = CaseSnapshot(case)
+    read_all(snapshot, exam_name)
+    read_all(snapshot, exam_name)
+    expect(snapshot, {"Rois": 1, "Contours": 1, "Approvals": 1, "Plans": 1}, "Repeated reads")
+
+    # Each part alone. ROIs take contours and approvals with them
+    for part, reloaded in [("Plans", ["Plans"]), ("Approvals", ["Approvals"]), ("Contours", ["Contours"]), ("Rois", ["Rois", "Contours", "Approvals"])]:
+        snapshot = CaseSnapshot(case)
+        read_all(snapshot, exam_name)
+        snapshot.invalidate(part)
+        read_all(snapshot, exam_name)
+        expected = dict((name, 2 if name in reloaded else 1) for name in CaseSnapshot.PARTS)
+        expect(snapshot, expected, "invalidate('{}')".format(part))
+
+    # Everything
+    snapshot = CaseSnapshot(case)
+    read_all(snapshot, exam_name)
+    snapshot.invalidate()
+    read_all(snapshot, exam_name)
+    expect(snapshot, dict.fromkeys(CaseSnapshot.PARTS, 2), "invalidate()")
+
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_invalidate(os.path.join(BENCHMARKS_DIR, "fixtures", "sbrt_lung_patient.json"))
+    for failure in failures:
+        print(failure)
+    print("{} failed".format(len(failures)) if failures else "All checks passed")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,19 @@
+from System._stub import Stub, StubType
+
+
+__all__ = ["Color", "ContentAlignment", "Font", "FontStyle", "Point", "Size", "SystemFonts"]
+
+
+class _Color(Stub):
+    def __init__(self, a=255, r=0, g=0, b=0):
+        self.A, self.R, self.G, self.B = a, r, g, b
+
+    @staticmethod
+    def FromArgb(*args):
+        # FromArgb(r, g, b) or FromArgb(a, r, g, b)
+        return Color(*([255] + list(args) if len(args) == 3 else args))
+
+
+Color = StubType("Color", (_Color,), {})  # Named colors (e.g., `Color.Red`) are stubs
+ContentAlignment = FontStyle = SystemFonts = StubType("Enum", (Stub,), {})
+Font = Point = Size = Stub
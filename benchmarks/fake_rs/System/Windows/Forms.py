@@ -0,0 +1,42 @@
+from System._stub import Stub, StubType
+
+
+__all__ = ["AnchorStyles", "AutoSizeMode", "BorderStyle", "Button", "CheckBox", "CheckState", "ComboBox", "ComboBoxStyle", "DataGridView", "DataGridViewAutoSizeColumnsMode", "DataGridViewAutoSizeRowsMode", "DataGridViewColumnHeadersHeightSizeMode", "DataGridViewSelectionMode", "DialogResult", "DockStyle", "Form", "FormBorderStyle", "FormStartPosition", "GroupBox", "Label", "ListBox", "MessageBox", "MessageBoxButtons", "Panel", "RadioButton", "SelectionMode", "TabControl", "TabPage", "TextBox", "TextRenderer"]
+
+
+class DialogResult(object):
+    OK = "OK"
+    Cancel = "Cancel"
+    Yes = "Yes"
+    No = "No"
+    None_ = "None"
+
+
+class MessageBox(object):
+    shown = []  # (text, caption) of each message box, in order
+
+    @classmethod
+    def Show(cls, text, caption="", *args):
+        cls.shown.append((text, caption))
+        return DialogResult.Yes if args else DialogResult.OK  # With buttons (e.g., MessageBoxButtons.YesNo), answer "Yes"
+
+
+class Form(Stub):
+    """Base class for script forms. `ShowDialog` returns immediately, as if the user clicked OK without changing anything"""
+
+    DialogResult = DialogResult.None_
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = Stub()
+        object.__setattr__(self, name, value)  # Remember, so that `self.Controls.Add(...)` etc. hit the same stub
+        return value
+
+    def ShowDialog(self):
+        self.DialogResult = DialogResult.OK
+        return DialogResult.OK
+
+
+AnchorStyles = AutoSizeMode = BorderStyle = CheckState = ComboBoxStyle = DataGridViewAutoSizeColumnsMode = DataGridViewAutoSizeRowsMode = DataGridViewColumnHeadersHeightSizeMode = DataGridViewSelectionMode = DockStyle = FormBorderStyle = FormStartPosition = MessageBoxButtons = SelectionMode = TextRenderer = StubType("Enum", (Stub,), {})
+Button = CheckBox = ComboBox = DataGridView = GroupBox = Label = ListBox = Panel = RadioButton = TabControl = TabPage = TextBox = Stub
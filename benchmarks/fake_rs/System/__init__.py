@@ -0,0 +1,4 @@
+"""Local stand-ins for the .NET `System` namespaces used by the scripts (see `connect.py` in the parent folder)
+
+There is no GUI outside RS. Controls accept any property and method, dialogs return OK, and message boxes only record their text.
+"""
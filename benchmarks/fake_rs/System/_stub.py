@@ -0,0 +1,43 @@
+class Stub(object):
+    """Object that accepts any property, method call, event handler, or arithmetic, and does nothing"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Stub()
+
+    def __call__(self, *args, **kwargs):
+        return Stub()
+
+    def __iadd__(self, other):  # Event handlers (e.g., `btn.Click += handler`)
+        return self
+
+    def __isub__(self, other):
+        return self
+
+    def __add__(self, other):
+        return self
+
+    __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = __add__
+
+    def __iter__(self):
+        return iter([])
+
+    def __len__(self):
+        return 0
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+
+class StubType(type):
+    # Metaclass so that class-level members (e.g., `Color.Red`, `FontStyle.Bold`) are stubs too
+    def __getattr__(cls, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Stub()
@@ -0,0 +1,5 @@
+"""Local stand-in for the pythonnet/IronPython `clr` module (see `connect.py` in this folder)"""
+
+
+def AddReference(name):
+    pass
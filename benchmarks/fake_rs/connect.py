@@ -0,0 +1,291 @@
+"""Local stand-in for the RayStation `connect` module
+
+Scripts in this repo can only run inside RayStation, so their speed cannot be measured anywhere else. This module replaces `connect` with an object graph loaded from a JSON fixture (see `benchmarks/make_fixture.py`).
+Every property read, collection lookup, and method call on a fake object is a "bridge call": it is counted, and it sleeps for `latency` seconds to imitate crossing the .NET scripting bridge.
+
+Fixture format
+--------------
+- The top-level object has keys "Patient" (the patient object graph), "Current" (get_current name -> path to the object, e.g., "Cases/0/TreatmentPlans/0"), and optionally "PatientDB", "MachineDB", and "NewRoiGeometry" (see below).
+- A JSON object is an RS object. Its key "_type" (e.g., "Roi") is used in the call counts.
+- A JSON list is an RS collection. Items can be looked up by index or by name ("Name", "DicomPlanLabel", or the name of "OfRoi", "OfPoi", or "OnExamination").
+- A key ending in "()" is a method, and its value is the return value regardless of the arguments. E.g., {"HasContours()": true}.
+- {"$ref": "Cases/0/PatientModel/RegionsOfInterest/PTV"} is a reference to another object, by path from the patient.
+
+Members that are not in the fixture:
+- Methods whose names start with "Delete" remove their target (the `FunctionToRemove`-style argument, or else the object itself) from its collection.
+- If the fixture has "NewRoiGeometry", `CreateRoi` adds a lenient ROI to the patient model, and a copy of "NewRoiGeometry" to each structure set, so that scripts can read the geometries of ROIs they create (e.g., isodose ROIs). `DeleteRoi` removes them again.
+- Other methods whose names start with a verb that changes the case (e.g., "Create", "Set", "Update") do nothing and return a lenient object built from their keyword arguments. Lenient objects return None for any missing property and accept any method call.
+- Anything else raises AttributeError, as in RS.
+"""
+
+import copy
+import json
+import time
+from collections import Counter
+
+
+__all__ = ["CompositeAction", "await_user_input", "get_current"]  # What RS scripts get from `from connect import *`
+
+WRITE_PREFIXES = ("Add", "Apply", "Approve", "Compute", "Convert", "Copy", "Create", "Delete", "Edit", "Export", "Import", "Load", "Map", "Remove", "Run", "Save", "Select", "Set", "Unapprove", "Update")
+
+
+class Bridge(object):
+    """State shared by all fake objects"""
+
+    latency = 0.0  # Seconds to sleep on each bridge call
+    calls = Counter()  # "Type.Member" -> number of calls
+    root = None  # Patient object
+    new_geometry = None  # JSON for the geometry of each ROI created by `CreateRoi`. If None, `CreateRoi` adds nothing
+    current = {}  # get_current name -> fake object
+
+    @classmethod
+    def call(cls, type_name, member):
+        # Count, and wait for, one bridge call
+        cls.calls["{}.{}".format(type_name, member)] += 1
+        if cls.latency:
+            time.sleep(cls.latency)
+
+
+def reset_counts():
+    Bridge.calls = Counter()
+
+
+def num_calls():
+    # Total number of bridge calls since the last reset
+    return sum(Bridge.calls.values())
+
+
+def set_latency(seconds):
+    Bridge.latency = seconds
+
+
+def wrap(value, type_name="Object"):
+    # Helper function that converts a JSON value to a fake RS value
+    if isinstance(value, dict):
+        if "$ref" in value:
+            return resolve(value["$ref"])
+        return FakeObject(value, type_name)
+    if isinstance(value, list):
+        return FakeCollection(value, type_name)
+    return value
+
+
+def resolve(path):
+    # Return the fake object at `path` (e.g., "Cases/0/Examinations/CT 1") from the patient, without counting bridge calls
+    obj = Bridge.root
+    for part in (path.split("/") if path else []):
+        if isinstance(obj, FakeCollection):
+            obj = obj._find(int(part) if part.isdigit() else part)
+        else:
+            obj = obj._member(part)
+    return obj
+
+
+class FakeObject(object):
+    """Fake RS object backed by a JSON dictionary"""
+
+    def __init__(self, data, type_name="Object", lenient=False):
+        self.__dict__["_data"] = data
+        self.__dict__["_type"] = data.get("_type", type_name)
+        self.__dict__["_cache"] = {}  # Member name -> wrapped value, so that repeated reads return the same fake object
+        self.__dict__["_collection"] = None  # FakeCollection that contains this object, if any
+        self.__dict__["_lenient"] = lenient
+        self.__dict__["_dependents"] = []  # Fake objects to remove along with this one (e.g., an ROI's geometries)
+
+    def _member(self, name):
+        # Return the wrapped member without counting a bridge call
+        if name not in self._cache:
+            if name in self._data:
+                self._cache[name] = wrap(self._data[name], name.rstrip("s"))
+            elif "{}()".format(name) in self._data:
+                self._cache[name] = FakeMethod(self, name, wrap(self._data["{}()".format(name)], name))
+            elif name.startswith(WRITE_PREFIXES) or self._lenient:
+                return FakeMethod(self, name, None)
+            else:
+                raise AttributeError("'{}' object has no attribute '{}'".format(self._type, name))
+        return self._cache[name]
+
+    def _name(self):
+        # Name by which this object is looked up in a collection
+        for key in ["Name", "DicomPlanLabel"]:
+            if key in self._data:
+                return self._data[key]
+        for key in ["OfRoi", "OfPoi", "OnExamination"]:  # Geometries are looked up by ROI or POI name, structure sets by exam name
+            if key in self._data:
+                return self._member(key)._name()
+        return None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        Bridge.call(self._type, name)
+        try:
+            return self._member(name)
+        except AttributeError:
+            if self._lenient:
+                return None
+            raise
+
+    def __setattr__(self, name, value):
+        Bridge.call(self._type, name)
+        self._data[name] = value
+        self._cache.pop(name, None)
+
+    def __getitem__(self, key):
+        # Some RS objects (e.g., the result of GetAcquisitionDataFromDicom) are dictionaries
+        Bridge.call(self._type, "[{}]".format(key))
+        return wrap(self._data[key], key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def values(self):
+        # For dictionary-like RS objects (e.g., voxel sizes)
+        return [wrap(val) for key, val in self._data.items() if not key.startswith("_")]
+
+    def items(self):
+        return [(key, wrap(val)) for key, val in self._data.items() if not key.startswith("_")]
+
+    def __repr__(self):
+        return "<Fake {} '{}'>".format(self._type, self._name())
+
+
+class FakeMethod(object):
+    """Fake RS method
+
+    Calling the method counts one bridge call.
+    """
+
+    def __init__(self, obj, name, result):
+        self.obj = obj
+        self.name = name
+        self.result = result
+
+    def __call__(self, *args, **kwargs):
+        Bridge.call(self.obj._type, "{}()".format(self.name))
+        if self.name in self.obj._data or "{}()".format(self.name) in self.obj._data:
+            return self.result
+        if self.name.startswith("Delete"):
+            targets = [val for val in list(args) + list(kwargs.values()) if isinstance(val, FakeObject)] or [self.obj]
+            for target in targets:
+                for obj in [target] + target._dependents:
+                    if obj._collection is not None:
+                        obj._collection._remove(obj)
+            return None
+        if self.name == "CreateRoi" and Bridge.new_geometry is not None:
+            return create_roi(self.obj, kwargs)
+        return FakeObject(dict((key, val) for key, val in kwargs.items() if not isinstance(val, (FakeObject, FakeCollection))), self.name[len("Create"):] if self.name.startswith("Create") else "Object", lenient=True)
+
+
+class FakeCollection(object):
+    """Fake RS collection backed by a JSON list"""
+
+    def __init__(self, items, type_name="Object"):
+        self._type = "{}s".format(type_name)
+        self._items = []
+        for item in items:
+            item = wrap(item, type_name)
+            if isinstance(item, FakeObject) and item._collection is None:
+                item.__dict__["_collection"] = self
+            self._items.append(item)
+
+    def _find(self, key):
+        # Return the item with the given index or name, without counting a bridge call
+        if isinstance(key, int):
+            return self._items[key]
+        for item in self._items:
+            if isinstance(item, FakeObject) and item._name() == key:
+                return item
+        raise KeyError("No item named '{}' in {}".format(key, self._type))
+
+    def _add(self, item):
+        item.__dict__["_collection"] = self
+        self._items.append(item)
+
+    def _remove(self, item):
+        self._items = [other for other in self._items if other is not item]
+
+    def __getitem__(self, key):
+        Bridge.call(self._type, "[]")
+        return self._find(key)
+
+    def __iter__(self):
+        # Each item returned from an RS collection is one bridge call
+        for item in list(self._items):
+            Bridge.call(self._type, "iter")
+            yield item
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def Count(self):
+        Bridge.call(self._type, "Count")
+        return len(self._items)
+
+
+def create_roi(patient_model, kwargs):
+    # Helper function that adds an ROI to the patient model, and its geometry to each structure set, as RS `CreateRoi` does
+    data = {"_type": "Roi", "Type": "Control", "DerivedRoiExpression": None, "RoiMaterial": None, "OrganData": {"OrganType": "Other"}}
+    data.update((key, val) for key, val in kwargs.items() if not isinstance(val, (FakeObject, FakeCollection)))
+    if data.get("Color") is None or isinstance(data["Color"], str):  # RS takes the color as a string (e.g., "255, 1, 2, 3" or "Red"), but returns a Color. Named colors are white
+        argb = [int(c) for c in data["Color"].split(",")] if data.get("Color") and data["Color"].count(",") == 3 else [255] * 4
+        data["Color"] = dict(zip("ARGB", argb))
+    roi = FakeObject(data, "Roi", lenient=True)
+    patient_model._member("RegionsOfInterest")._add(roi)
+    for struct_set in patient_model._member("StructureSets")._items:
+        geom = FakeObject(copy.deepcopy(Bridge.new_geometry), "RoiGeometry")
+        geom._data["OfRoi"] = None
+        geom._cache["OfRoi"] = roi  # Look the geometry up by the new ROI's name
+        struct_set._member("RoiGeometries")._add(geom)
+        roi._dependents.append(geom)
+    return roi
+
+
+class CompositeAction(object):
+    """Fake RS CompositeAction (one undo step): only counts the call"""
+
+    def __init__(self, name=""):
+        self.name = name
+
+    def __enter__(self):
+        Bridge.call("CompositeAction", "__enter__")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def load_fixture(path):
+    """Load a fixture file and make its objects current
+
+    Parameters
+    ----------
+    path: str
+        Absolute path to the JSON fixture
+    """
+
+    with open(path, "r") as f:
+        fixture = json.load(f)
+    Bridge.root = FakeObject(fixture["Patient"], "Patient")
+    Bridge.current = {"Patient": Bridge.root}
+    for name, obj_path in fixture.get("Current", {}).items():
+        Bridge.current[name] = resolve(obj_path)
+    Bridge.new_geometry = fixture.get("NewRoiGeometry")
+    for name in ["PatientDB", "MachineDB"]:
+        if name in fixture:
+            Bridge.current[name] = FakeObject(fixture[name], name)
+    reset_counts()
+
+
+def get_current(name):
+    # Return the current object of the given type (e.g., "Case"), as in RS
+    Bridge.call("connect", "get_current")
+    if name not in Bridge.current:
+        raise SystemError("No {} is loaded.".format(name))  # RS raises an error when there is no current object
+    return Bridge.current[name]
+
+
+def await_user_input(msg):
+    # Scripts pause here in RS. There is no user, so continue immediately
+    Bridge.call("connect", "await_user_input")
@@ -0,0 +1,289 @@
+"""Generate a synthetic patient fixture for the fake `connect` module (see `fake_rs/connect.py`)
+
+Usage:
+python make_fixture.py fixtures/medium_patient.json --rois 120 --exams 12 --plans 3
+python make_fixture.py fixtures/sbrt_lung_patient.json --data-dir fixtures  # Also write the Excel data files that scripts read
+"""
+
+import argparse
+import json
+import os
+import random
+
+import pandas as pd
+
+
+# ROI names and RS types to draw from. Some names are TG-263 alternates (e.g., "Cord") so that renaming scripts have work to do
+ROI_TEMPLATES = [
+    ("PTV", "Ptv"), ("CTV", "Ctv"), ("GTV", "Gtv"), ("ITV", "Ctv"),
+    ("Lung_L", "Organ"), ("Lung_R", "Organ"), ("Lungs", "Organ"), ("Lungs-CTV", "Organ"), ("Heart", "Organ"), ("SpinalCord", "Organ"), ("Cord", "Organ"),
+    ("Esophagus", "Organ"), ("Trachea", "Organ"), ("Bronchus", "Organ"), ("Chestwall_L", "Organ"), ("Chestwall_R", "Organ"), ("Liver", "Organ"), ("Stomach", "Organ"),
+    ("E-PTV_Ev20", "Control"), ("Ring", "Control"), ("Bolus", "Bolus"), ("Elekta Couch", "Support"), ("Elekta Couch Foam", "Support")
+]
+
+
+# Clinical goals templates (sheet name -> rows of ROI, goal, and notes), in the format of "Clinical Goals.xlsx"
+# An ROI of None continues the ROI above (vertically merged cells in the real spreadsheet)
+CLINICAL_GOALS = {
+    "SBRT Lung 5Fx": [
+        ("PTV", "D95% > Rx", None), (None, "Dmax < 140% Rx", None),
+        ("SpinalCord", "D0.03cc < 30 Gy", None), (None, "V22.5Gy < 0.25cc", None),
+        ("Esophagus", "D0.03cc < 35 Gy", None), (None, "V27.5Gy < 5cc", None),
+        ("Heart", "D0.03cc < 38 Gy", None), (None, "V32Gy < 15cc", None),
+        ("Trachea", "D0.03cc < 38 Gy", None), ("Bronchus", "D0.03cc < 38 Gy", None),
+        ("Chestwall", "V30Gy < 30cc", "Ipsilateral"),
+        ("Lungs-CTV", "V20Gy < 10%", None), (None, "Dmean < 8 Gy", None), (None, "V12.5Gy < (v-1500) cc", None),
+        ("Liver", "V21Gy < (v-700) cc", None)
+    ],
+    "Thorax": [
+        ("SpinalCord", "Dmax < 45 Gy", None), ("Esophagus", "Dmean < 34 Gy", None), ("Heart", "V30Gy < 46%", None),
+        ("Lungs-CTV", "V20Gy < 37%", None), (None, "V5Gy < 65%", None), (None, "Dmean < 20 Gy", "60 Gy")
+    ],
+    "Thorax DNU": [("Lungs", "V20Gy < 40%", None)]
+}
+
+# RTOG 0813 interpolation table (Table 8.1): PTV volume, then (no deviation, minor deviation) cutoffs for each interpolated statistic
+RTOG0813_PTV_VOLS = [1.8, 3.8, 7.4, 13.2, 22.0, 34.0, 50.0, 70.0, 95.0, 126.0, 163.0]
+RTOG0813_CUTOFFS = {
+    "GI (R50%)": ([5.9, 5.5, 5.1, 4.7, 4.5, 4.3, 4.0, 3.5, 3.3, 3.1, 2.9], [7.5, 6.5, 6.0, 5.8, 5.5, 5.3, 5.0, 4.8, 4.4, 4.0, 3.7]),
+    "D2cm [%]": ([50.0, 50.0, 50.0, 50.0, 54.0, 58.0, 62.0, 66.0, 70.0, 73.0, 77.0], [57.0, 57.0, 58.0, 58.0, 63.0, 68.0, 77.0, 86.0, 89.0, 91.0, 94.0]),
+    "V20Gy [%]": ([10] * 11, [15] * 11)
+}
+
+
+def point(x=0.0, y=0.0, z=0.0):
+    return {"x": x, "y": y, "z": z}
+
+
+def make_rois(num_rois, rng):
+    # External first, then the templates, then copies ("Lungs (1)", ...) until there are `num_rois` ROIs
+    rois = [{"_type": "Roi", "Name": "External", "Type": "External"}]
+    copy_num = 0
+    while len(rois) < num_rois:
+        name, roi_type = ROI_TEMPLATES[(len(rois) - 1) % len(ROI_TEMPLATES)]
+        if len(rois) - 1 >= len(ROI_TEMPLATES):
+            copy_num = (len(rois) - 1) // len(ROI_TEMPLATES)
+            name = "{} ({})".format(name[:(16 - len(" ({})".format(copy_num)))], copy_num)
+        rois.append({"_type": "Roi", "Name": name, "Type": roi_type})
+    for roi in rois:
+        roi.update({
+            "Color": {"A": 255, "R": rng.randint(0, 255), "G": rng.randint(0, 255), "B": rng.randint(0, 255)},
+            "DerivedRoiExpression": None,
+            "RoiMaterial": {"OfMaterial": {"Name": "Cork" if roi["Name"] == "Elekta Couch" else "PMI foam"}} if roi["Type"] == "Support" else None,
+            "OrganData": {"OrganType": "Target" if roi["Type"] in ["Ptv", "Ctv", "Gtv"] else "OrganAtRisk"}
+        })
+    return rois
+
+
+def make_exam(i, rng):
+    name = "CT {} 01/{:02d}/2020".format(i + 1, i + 1)
+    return {
+        "_type": "Examination",
+        "Name": name,
+        "PatientPosition": "HFS",
+        "EquipmentInfo": {"ImagingSystemReference": {"ImagingSystemName": "HOST-7307"}, "FrameOfReference": "1.2.840.{}".format(i + 1)},
+        "Series": [{"_type": "Series", "ImportedDicomUID": "1.2.840.{}.1".format(i + 1), "ImageStack": {
+            "_type": "ImageStack",
+            "PixelSize": point(0.1, 0.1),
+            "SlicePositions": [0.3 * k for k in range(100)],
+            "Corner": point(-25, -25, -15),
+            "GetBoundingBox()": [point(-25, -25, -15), point(25, 25, 15)]
+        }}],
+        "GetAcquisitionDataFromDicom()": {
+            "StudyModule": {"StudyInstanceUID": "1.2.840.{}.0".format(i + 1), "StudyDescription": "CT Chest", "StudyDateTime": None},
+            "SeriesModule": {"SeriesInstanceUID": "1.2.840.{}.1".format(i + 1), "SeriesDescription": "Gated, {}%".format(10 * (i % 10)), "SeriesDateTime": None}
+        }
+    }
+
+
+def make_structure_set(i, rois, approved_fraction, rng):
+    geoms = []
+    for roi in rois:
+        has_contours = roi["Name"] in ["External", "PTV", "E-PTV_Ev20", "Lungs-CTV", "Elekta Couch", "Elekta Couch Foam"] or rng.random() < 0.7  # SBRT lung analysis needs all but the couch
+        ctr = point(rng.uniform(-10, 10), rng.uniform(-10, 10), rng.uniform(-10, 10))
+        geoms.append({
+            "_type": "RoiGeometry",
+            "OfRoi": {"$ref": "Cases/0/PatientModel/RegionsOfInterest/{}".format(roi["Name"])},
+            "HasContours()": has_contours,
+            "GetBoundingBox()": [point(ctr["x"] - 2, ctr["y"] - 2, ctr["z"] - 2), point(ctr["x"] + 2, ctr["y"] + 2, ctr["z"] + 2)] if has_contours else [point(float("-inf"), float("-inf"), float("-inf")), point(float("inf"), float("inf"), float("inf"))],
+            "PrimaryShape": {"Contours": [[point(ctr["x"] + dx, ctr["y"] + dy, ctr["z"] + dz) for dx, dy in [(-2, -2), (2, -2), (2, 2), (-2, 2)]] for dz in [-2, 2]]} if has_contours else None,  # Square on the top and bottom slices
+            "GetCenterOfRoi()": ctr,
+            "GetRoiVolume()": (38.9 if roi["Name"] == "PTV" else rng.uniform(1, 500)) if has_contours else 0  # PTV volume must be in the RTOG 0813 table
+        })
+    approved = [{"OfRoi": {"$ref": "Cases/0/PatientModel/RegionsOfInterest/{}".format(roi["Name"])}} for roi in rois if rng.random() < approved_fraction]
+    return {
+        "_type": "StructureSet",
+        "OnExamination": {"$ref": "Cases/0/Examinations/{}".format(i)},
+        "RoiGeometries": geoms,
+        "PoiGeometries": [],
+        "ApprovedStructureSets": [{"_type": "ApprovedStructureSet", "ApprovedRoiStructures": approved}] if approved else [],
+        "LocalizationPoiGeometry": {"Point": point()}
+    }
+
+
+def make_dose(max_dose, num_beams=0):
+    # Computed dose distribution. Every method returns the same value regardless of the ROI, so every geometry has the same voxels and dose
+    # Beam set dose has a dose for each of the `num_beams` beams
+    return {
+        "_type": "DoseDistribution",
+        "DoseValues": {"DoseData": [0.0, max_dose]},
+        "GetDoseGridRoi()": {"RoiVolumeDistribution": {"VoxelIndices": list(range(20))}},
+        "GetDoseStatistic()": max_dose,
+        "GetDoseAtRelativeVolumes()": [0.5 * max_dose],
+        "GetRelativeVolumeAtDoseValues()": [0.05],
+        "BeamDoses": [{"DoseAtPoint": {"DoseValue": max_dose / num_beams}} for _ in range(num_beams)]
+    }
+
+
+def make_plan(i, num_beam_sets, num_beams):
+    beam_sets = []
+    for j in range(num_beam_sets):
+        beams = [{
+            "_type": "Beam",
+            "Name": str(k + 1),
+            "Number": k + 1,
+            "Description": "Arc {}".format(k + 1),
+            "Isocenter": {"Annotation": {"Name": "Iso"}, "Position": point()},
+            "MachineReference": {"Energy": 6},
+            "BeamMU": 1000.0,
+            "Segments": [{"_type": "Segment", "RelativeWeight": 0.5, "DoseRate": 600} for _ in range(2)]
+        } for k in range(num_beams)]
+        beam_sets.append({
+            "_type": "BeamSet",
+            "DicomPlanLabel": "SBRT Lung {}".format(j + 1),
+            "Modality": "Photons",
+            "PlanGenerationTechnique": "Imrt",
+            "DeliveryTechnique": "DynamicArc",
+            "PatientPosition": "HeadFirstSupine",
+            "Comment": "",
+            "FractionDose": make_dose(1100, num_beams),
+            "AccurateDoseAlgorithm": {"DoseAlgorithm": "CCDose"},
+            "FractionationPattern": {"NumberOfFractions": 5},
+            "MachineReference": {"MachineName": "SBRT 6MV"},
+            "Prescription": {"Description": "", "PrimaryDosePrescription": {"DoseValue": 5000, "PrescriptionType": "DoseAtVolume", "DoseVolume": 95, "OnStructure": {"$ref": "Cases/0/PatientModel/RegionsOfInterest/PTV"}}, "DosePrescriptions": []},
+            "Beams": beams,
+            "PatientSetup": {"SetupBeams": []},
+            "DoseSpecificationPoints": [],
+            "DependentApprovedStructureSet": None,
+            "Review": None,
+            "GetPlanningExamination()": {"$ref": "Cases/0/Examinations/0"}
+        })
+    return {
+        "_type": "Plan",
+        "Name": "SBRT Lung" if i == 0 else "SBRT Lung {}".format(i + 1),
+        "PlannedBy": "Planner",
+        "Comments": "",
+        "Review": None,
+        "BeamSets": beam_sets,
+        "PlanOptimizations": [{
+            "_type": "PlanOptimization",
+            "AutoScaleToPrescription": True,
+            "OptimizationParameters": {
+                "Algorithm": {"OptimalityTolerance": 1e-5},
+                "DoseCalculation": {"ComputeIntermediateDose": True},
+                "TreatmentSetupSettings": [{
+                    "BeamSettings": [{"ArcConversionPropertiesPerBeam": {"FinalArcGantrySpacing": 2, "MaxArcDeliveryTime": 150}} for _ in range(num_beams)],
+                    "SegmentConversion": {"ArcConversionProperties": {"UseMaxLeafTravelDistancePerDegree": True, "MaxLeafTravelDistancePerDegree": 0.3}}
+                }]
+            }
+        } for _ in range(num_beam_sets)],
+        "TreatmentCourse": {"TotalDose": make_dose(5500), "EvaluationSetup": {"EvaluationFunctions": []}},
+        "GetStructureSet()": {"$ref": "Cases/0/PatientModel/StructureSets/0"},
+        "GetDoseGrid()": {"Corner": point(-20, -20, -10), "VoxelSize": point(0.2, 0.2, 0.2), "NrVoxels": point(200, 200, 100)}
+    }
+
+
+def make_fixture(num_rois=60, num_exams=4, num_plans=2, num_beam_sets=1, num_beams=2, approved_fraction=0.1, seed=0):
+    """Return a fixture dictionary for a synthetic SBRT lung patient
+
+    Parameters
+    ----------
+    num_rois, num_exams, num_plans, num_beam_sets, num_beams: int
+        Number of ROIs and exams in the case, plans in the case, beam sets in each plan, and beams in each beam set
+    approved_fraction: float
+        Probability that an ROI is approved on each exam
+    seed: int
+        Random seed, so that the same arguments give the same fixture
+    """
+
+    rng = random.Random(seed)
+    rois = make_rois(num_rois, rng)
+    case = {
+        "_type": "Case",
+        "CaseName": "Case 1",
+        "BodySite": "Thorax",
+        "Diagnosis": "",
+        "Comments": "",
+        "Physician": {"Name": "Smith^John^MD"},
+        "Examinations": [make_exam(i, rng) for i in range(num_exams)],
+        "PatientModel": {
+            "RegionsOfInterest": rois,
+            "PointsOfInterest": [],
+            "StructureSets": [make_structure_set(i, rois, approved_fraction, rng) for i in range(num_exams)],
+            "StructureRegistrationGroups": []
+        },
+        "TreatmentPlans": [make_plan(i, num_beam_sets, num_beams) for i in range(num_plans)],
+        "TreatmentDelivery": {"FractionEvaluations": []},
+        "Registrations": []
+    }
+    patient = {"_type": "Patient", "Name": "Doe^Jane^", "PatientID": "000123456", "Gender": "Female", "Cases": [case]}
+    return {
+        "Patient": patient,
+        "Current": {"Case": "Cases/0", "Examination": "Cases/0/Examinations/0", "Plan": "Cases/0/TreatmentPlans/0", "BeamSet": "Cases/0/TreatmentPlans/0/BeamSets/0"},
+        "PatientDB": {
+            "QueryPatientInfo()": [{"PatientID": patient["PatientID"]}],
+            "LoadPatient()": {"$ref": ""},
+            "LoadTemplatePatientModel()": {"PatientModel": {"RegionsOfInterest": [{"Name": "Elekta Couch"}, {"Name": "Elekta Couch Foam"}]}}
+        },
+        "MachineDB": {"GetTreatmentMachine()": {"Name": "SBRT 6MV"}},
+        "NewRoiGeometry": {  # Geometry of each ROI that a script creates (e.g., a cylinder around the isocenter, or an isodose ROI)
+            "_type": "RoiGeometry",
+            "HasContours()": True,
+            "GetBoundingBox()": [point(-45, -45, -15), point(45, 45, 15)],
+            "PrimaryShape": None,
+            "GetCenterOfRoi()": point(),
+            "GetRoiVolume()": 50.0
+        }
+    }
+
+
+def write_data_files(folder):
+    """Write the Excel data files that scripts read: clinical goals templates ("clinical_goals_sample.xlsx") and the RTOG 0813 table ("rtog0813_sample.xlsx")
+
+    Parameters
+    ----------
+    folder: str
+        Path to the folder to write the files to
+    """
+
+    with pd.ExcelWriter(os.path.join(folder, "clinical_goals_sample.xlsx"), engine="openpyxl") as writer:
+        for sheet_name, rows in CLINICAL_GOALS.items():
+            goals = pd.DataFrame(rows, columns=["ROI", "Goal", "Notes"])
+            goals["Planning Priority"] = None  # Scripts ignore this column
+            goals.to_excel(writer, sheet_name=sheet_name, index=False)
+
+    rtog = pd.DataFrame({"PTV vol [cc]": RTOG0813_PTV_VOLS})
+    for stat, (none_dev, minor_dev) in RTOG0813_CUTOFFS.items():
+        rtog["{} None".format(stat)] = none_dev
+        rtog["{} Minor".format(stat)] = minor_dev
+    rtog.to_excel(os.path.join(folder, "rtog0813_sample.xlsx"), index=False, engine="openpyxl")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic patient fixture for the fake connect module")
+    parser.add_argument("path", help="Output JSON file")
+    parser.add_argument("--rois", type=int, default=60)
+    parser.add_argument("--exams", type=int, default=4)
+    parser.add_argument("--plans", type=int, default=2)
+    parser.add_argument("--beam-sets", type=int, default=1)
+    parser.add_argument("--beams", type=int, default=2)
+    parser.add_argument("--approved-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="Also write the Excel data files to this folder")
+    args = parser.parse_args()
+
+    fixture = make_fixture(args.rois, args.exams, args.plans, args.beam_sets, args.beams, args.approved_fraction, args.seed)
+    with open(args.path, "w") as f:
+        json.dump(fixture, f, indent=1)
+    if args.data_dir:
+        write_data_files(args.data_dir)
@@ -0,0 +1,200 @@
+"""Run scripts headless against the fake `connect` module, and report wall time and bridge calls per script
+
+Usage:
+python run_benchmarks.py                                   # All benchmarks on the default fixture
+python run_benchmarks.py plan_check --latency 0.001         # One benchmark, 1 ms per bridge call
+python run_benchmarks.py --save baseline.json               # Save results
+python run_benchmarks.py --compare baseline.json            # Flag scripts whose bridge calls increased
+python run_benchmarks.py plan_check --trace traces          # Also write a BridgeTrace flame-graph profile and hot-path report per script
+
+Each benchmark loads a fresh copy of the fixture, imports the script module fresh, and calls its main function in a temporary working directory.
+Bridge-call counts are deterministic, so they are what `--compare` checks. Wall time depends on the machine and on `--latency`.
+A script that raises an error (e.g., because the fixture lacks a property it reads, or a library such as reportlab is not installed), exits with an error code, or returns an error message instead of running (e.g., sbrt_lung_analysis without a GUI) is reported with the error and the calls made before it.
+Scripts read and write Windows network paths (e.g., r"\\vs20filesvr01\groups\..."). On Windows, those paths must be reachable. Elsewhere, they are plain file names in the temporary working directory, and `files` in the benchmark definition copies fixture data files there.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+from time import time
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "fake_rs"))  # Fake `connect`, `clr`, and `System` take the place of the RS modules
+sys.path.insert(1, REPO_DIR)
+
+import connect  # The fake
+import BridgeTrace
+from System.Windows.Forms import DialogResult, MessageBox
+
+
+class FormValues(object):
+    # Stand-in for a script's Form class, for scripts that only run from a GUI: "closes" immediately with preset attribute values
+    def __init__(self, **values):
+        self.values = values
+
+    def __call__(self, *args, **kwargs):
+        form = type("PresetForm", (object,), dict(self.values))()
+        form.DialogResult = DialogResult.OK
+        return form
+
+
+# Benchmark name -> definition
+# "module" and "function": The script's main function
+# "kwargs": Keyword arguments to the function (e.g., to skip the GUI)
+# "patches": Module attribute name -> replacement (e.g., a preset form)
+# "files": File name the script reads -> fixture data file (in the "fixtures" folder) to copy there
+BENCHMARKS = {
+    "plan_check": {"module": "PlanCheckScript", "function": "plan_check"},
+    "add_clinical_goals": {
+        "module": "AddClinicalGoalsForm",
+        "function": "add_clinical_goals",
+        "kwargs": {"gui": False, "clear_existing": True},
+        "files": {r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Data\Clinical Goals.xlsx": "clinical_goals_sample.xlsx"}
+    },
+    "sbrt_lung_analysis": {
+        "module": "SBRTLungAnalysisForm",
+        "function": "sbrt_lung_analysis",
+        "kwargs": {"gui": False},
+        "files": {
+            r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Data\TG263 Nomenclature with CRMC Colors.csv": "tg263_sample.csv",
+            r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Data\RTOG0813.xlsx": "rtog0813_sample.xlsx"
+        }
+    },
+    "list_patients": {
+        "module": "ListPatientsForm",
+        "function": "list_patients",
+        "patches": {"ListPatientsForm": FormValues(max_num_pts=float("Inf"), values={"Keywords": ["lung"], "Sex": None, "Patient Position": None, "Treatment Technique": None})}
+    },
+    "delete_empty_rois": {"module": "DeleteEmptyROIsScript", "function": "delete_empty_rois"},
+    "tg263_names_crmc_colors": {
+        "module": "TG263NamesCRMCColorsScript",
+        "function": "tg263_names_crmc_colors",
+        "files": {r"\\vs20filesvr01\groups\CANCER\Physics\Scripts\Data\TG263 Nomenclature with CRMC Colors.csv": "tg263_sample.csv"}
+    }
+}
+
+
+def run_benchmark(name, fixture_path, latency=0.0, trace_dir=None):
+    """Run one benchmark
+
+    Parameters
+    ----------
+    name: str
+        Key in `BENCHMARKS`
+    fixture_path: str
+        Absolute path to the JSON fixture
+    latency: float
+        Seconds per bridge call
+    trace_dir: str
+        Absolute path to the folder for the BridgeTrace files
+        If None, the script is not traced
+
+    Returns
+    -------
+    Dictionary with keys "Status" ("OK" or the error), "Seconds", "Calls" (total), "TopCalls" (list of [member, count] for the most frequent members), and "Messages" (message boxes shown)
+    """
+
+    bench = BENCHMARKS[name]
+    connect.load_fixture(fixture_path)
+    connect.set_latency(latency)
+    MessageBox.shown = []
+
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="benchmark ")
+    for filename, data_filename in bench.get("files", {}).items():
+        shutil.copy(os.path.join(BENCHMARKS_DIR, "fixtures", data_filename), os.path.join(work_dir, filename))
+    os.chdir(work_dir)
+    connect.reset_counts()
+    tracer = BridgeTrace.enable() if trace_dir is not None else None
+    start = time()
+    try:
+        sys.modules.pop(bench["module"], None)  # Import fresh so that module-level state from a previous run does not leak
+        module = importlib.import_module(bench["module"])
+        for attr, value in bench.get("patches", {}).items():
+            setattr(module, attr, value)
+        result = getattr(module, bench["function"])(**bench.get("kwargs", {}))
+        status = "Returned: {}".format(result) if isinstance(result, str) else "OK"  # Without a GUI, some scripts (e.g., sbrt_lung_analysis) return an error message instead of exiting
+    except SystemExit as e:
+        status = "OK" if not e.code else "Exited ({})".format(e.code)
+    except Exception as e:
+        status = "{}: {}".format(type(e).__name__, e)
+        if os.environ.get("BENCHMARK_TRACEBACK"):
+            traceback.print_exc()
+    seconds = time() - start
+    if tracer is not None:
+        BridgeTrace.disable()
+        tracer.write(name, trace_dir)
+    os.chdir(cwd)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "Status": status,
+        "Seconds": seconds,
+        "Calls": connect.num_calls(),
+        "TopCalls": [list(item) for item in connect.Bridge.calls.most_common(5)],
+        "Messages": [text for text, _ in MessageBox.shown]
+    }
+
+
+def format_results(results, baseline=None, tolerance=0.05):
+    # Helper function that returns a text table of the results
+    # If `baseline` results are given, flag benchmarks whose bridge calls increased by more than `tolerance` (fraction)
+
+    lines = ["{:<26}{:>10}{:>10}  {}".format("Benchmark", "Seconds", "Calls", "Status")]
+    for name, res in results.items():
+        flag = ""
+        if baseline is not None and name in baseline:
+            old = baseline[name]["Calls"]
+            if res["Calls"] > old * (1 + tolerance):
+                flag = "  REGRESSION: {} -> {} calls".format(old, res["Calls"])
+            elif res["Calls"] < old:
+                flag = "  ({} -> {} calls)".format(old, res["Calls"])
+        lines.append("{:<26}{:>10.3f}{:>10}  {}{}".format(name, res["Seconds"], res["Calls"], res["Status"], flag))
+        for member, count in res["TopCalls"]:
+            lines.append("{:<26}{:>20}  {}".format("", count, member))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scripts against the fake connect module")
+    parser.add_argument("benchmarks", nargs="*", help="Benchmarks to run (default: all): {}".format(", ".join(sorted(BENCHMARKS))))
+    parser.add_argument("--fixture", default=os.path.join(BENCHMARKS_DIR, "fixtures", "sbrt_lung_patient.json"), help="JSON fixture file")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per bridge call")
+    parser.add_argument("--save", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare bridge calls to results saved with --save")
+    parser.add_argument("--trace", help="Folder to write a BridgeTrace profile and report for each benchmark to")
+    args = parser.parse_args()
+
+    names = args.benchmarks or sorted(BENCHMARKS)
+    trace_dir = None
+    if args.trace:
+        trace_dir = os.path.abspath(args.trace)
+        if not os.path.isdir(trace_dir):
+            os.makedirs(trace_dir)
+    results = {}
+    for name in names:
+        results[name] = run_benchmark(name, os.path.abspath(args.fixture), args.latency, trace_dir)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None and any(name in baseline and res["Calls"] > baseline[name]["Calls"] * 1.05 for name, res in results.items()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()